@@ -36,6 +36,9 @@ def custom_openapi_doc(app: FastAPI):
         except:
             pass
         openapi_schema["paths"]["/combine/{full_path}"]["get"]["summary"] = "Chain endpoints"
+        openapi_schema["paths"]["/export/{entity}"]["get"]["summary"] = "Export all the instances of an entity"
+        openapi_schema["paths"]["/stats/{entity}"]["get"]["summary"] = "Count the instances of an entity by group"
+        openapi_schema["paths"]["/{entity}/_batch"]["post"]["summary"] = "Get many instances of an entity by id"
         openapi_schema["paths"]["/namings/{naming_id}"]["get"]["summary"] = "Get one Naming"
         openapi_schema["paths"]["/contexts/{context_id}"]["get"]["summary"] = "Get one Context"
         openapi_schema["paths"]["/variants/{variant_id}"]["get"]["summary"] = "Get one Variant"
@@ -77,7 +80,7 @@ def custom_openapi_doc(app: FastAPI):
         find_enpoint_parameter(openapi_schema, "/contexts", "aa_positional_change_id")["description"] = "Returns Contexts that contain a specific Aa Positional Change (e.g., S:D614G)"
         find_enpoint_parameter(openapi_schema, "/contexts", "nuc_positional_mutation_id")["description"] = "Returns Contexts connected to a specific Nuc Positional Mutation (e.g., G1942T)"
         find_enpoint_parameter(openapi_schema, "/contexts", "owner")["description"] = "Returns Contexts of a given owner"
-        find_enpoint_parameter(openapi_schema, "/contexts", "rule_description")["description"] = "Returns Contexts with a given rule description"
+        find_enpoint_parameter(openapi_schema, "/contexts", "rule_description")["description"] = "Returns Contexts whose rule description contains the given text (case insensitive), best matches first"
 
         find_enpoint_parameter(openapi_schema, "/effects", "variant_id")["description"] = "Returns Effects connected to a specific Variant"
         find_enpoint_parameter(openapi_schema, "/effects", "aa_positional_change_id")["description"] = "Returns Effects of a specific Aa Positional Change (e.g., S:D614G)"
@@ -37,12 +37,52 @@ class MyExceptions:
     incomplete_optional_pagination_params = HTTPException(
         status_code=status.HTTP_400_BAD_REQUEST
         , detail="The request specifies only one between page and limit. You should define either both or none.")
+    invalid_pagination_cursor = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST
+        , detail="The given cursor is not valid. Use the next_cursor value returned by the previous page or "
+                 "cursor=first to request the first page.")
+    export_unsupported_entity = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST
+        , detail="The requested entity can't be exported. Use the corresponding endpoint with pagination instead.")
+    batch_unsupported_entity = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST
+        , detail="Bulk lookups are available only for variants, effects, sequences, nuc_mutations, aa_changes and "
+                 "epitopes.")
+    stats_unsupported_entity = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST
+        , detail="Statistics are available only for sequences and host_samples.")
+    stats_unsupported_group_by = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST
+        , detail="The requested entity can't be grouped by the given dimension. Host samples can be grouped by "
+                 "continent, country and collection_month only.")
+    invalid_query_parameter_value = HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY
+        , detail="The value of a query parameter is not valid for its type.")
+    admin_forbidden = HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN
+        , detail="This operation requires a valid administration token.")
     page_0_error = HTTPException(
         status_code=status.HTTP_400_BAD_REQUEST
         , detail="You requested page number 0, but pages starts from 1. Please repeat the request with ?page=1")
     invalid_object_id = HTTPException(
         status_code=status.HTTP_400_BAD_REQUEST
         , detail="The given object ID is badly formatted. Hex stirng IDs should be 24-characters long.")
+    co_occurrence_without_mutations = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST
+        , detail="The request must list at least one mutation in all_of or any_of.")
+
+    @staticmethod
+    def co_occurrence_too_many_mutations(max_mutations):
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST
+            , detail=f"The request lists too many mutations. At most {max_mutations} mutations are allowed.")
+
+    @staticmethod
+    def batch_too_many_ids(max_ids):
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST
+            , detail=f"The request lists too many ids. At most {max_ids} ids are allowed per request.")
+
     @staticmethod
     def compose_request_intermediate_result_too_large(request_name):
         return HTTPException(
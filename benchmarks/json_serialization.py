@@ -0,0 +1,84 @@
+"""
+Compares the serialization of 10k /nuc_mutations-shaped rows (plus an ObjectId per row, as in the KB entities) by the
+default path of FastAPI (jsonable_encoder, then JSONResponse) with FastJSONResponse, using orjson and using the json
+fallback. It also times whole GET requests through two routes of a FastAPI app that return the same rows, one
+created as a plain APIRoute and one as a FastJSONRoute. Needs neither database. Run it from the root of the project:
+    python -m benchmarks.json_serialization [--rows 10000] [--number 20]
+"""
+import argparse
+import timeit
+
+import fastapi
+from bson import ObjectId
+from fastapi import FastAPI, APIRouter
+from fastapi.encoders import jsonable_encoder, ENCODERS_BY_TYPE
+from fastapi.testclient import TestClient
+from starlette.responses import JSONResponse
+
+import fast_json
+from fast_json import FastJSONResponse, FastJSONRoute
+
+# as beanie does for PydanticObjectId, so that jsonable_encoder converts the ids of the rows
+ENCODERS_BY_TYPE.setdefault(ObjectId, str)
+
+
+def make_rows(n_rows: int) -> list:
+    return [{
+        "nuc_mutation_id": f"A{i}G",
+        "reference": "A",
+        "position": i,
+        "alternative": "G",
+        "type": "SUB",
+        "length": 1,
+        "variant_id": ObjectId(),
+    } for i in range(n_rows)]
+
+
+def best_ms(function, number: int) -> float:
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e3
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="JSON serialization of a page of results")
+    parser.add_argument("--rows", type=int, default=10000, help="rows per response")
+    parser.add_argument("--number", type=int, default=20, help="serializations per measure")
+    args = parser.parse_args()
+    rows = make_rows(args.rows)
+    print(f"FastAPI {fastapi.__version__}, {args.rows} rows, best of 5 x {args.number} runs")
+
+    # like FastAPI does for an endpoint without response_model
+    default_ms = best_ms(lambda: JSONResponse(jsonable_encoder(rows)), args.number)
+    print(f"{'jsonable_encoder + JSONResponse':40} {default_ms:8.1f} ms")
+    if fast_json.orjson is not None:
+        orjson_ms = best_ms(lambda: FastJSONResponse(rows), args.number)
+        print(f"{'FastJSONResponse (orjson)':40} {orjson_ms:8.1f} ms")
+    orjson_module, fast_json.orjson = fast_json.orjson, None
+    try:
+        json_ms = best_ms(lambda: FastJSONResponse(rows), args.number)
+    finally:
+        fast_json.orjson = orjson_module
+    print(f"{'FastJSONResponse (json fallback)':40} {json_ms:8.1f} ms")
+
+    app = FastAPI()
+    default_router = APIRouter()
+    fast_router = APIRouter(route_class=FastJSONRoute)
+
+    @default_router.get("/default")
+    async def get_default():
+        return rows
+
+    @fast_router.get("/fast")
+    async def get_fast():
+        return rows
+
+    app.include_router(default_router)
+    app.include_router(fast_router)
+    with TestClient(app) as client:
+        assert client.get("/default").json() == client.get("/fast").json()
+        for path in ("/default", "/fast"):
+            request_ms = best_ms(lambda: client.get(path), args.number)
+            print(f"{'GET ' + path + ' (whole request)':40} {request_ms:8.1f} ms")
+
+
+if __name__ == "__main__":
+    _main()
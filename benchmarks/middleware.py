@@ -0,0 +1,55 @@
+"""
+Measures the check of the query parameters done by main_middleware for every request to an entity endpoint, as it
+was before the route registry (eval() of the name of the endpoint function and inspect.getfullargspec() at every
+request) and as it is now (a lookup in the frozenset of Entity2Request.route_of(entity)). Run it from the root of the
+project:
+    python -m benchmarks.middleware [--entity sequences] [--number 100000]
+"""
+import argparse
+import inspect
+import timeit
+
+import main_beanie
+from main_beanie import Entity2Request
+
+
+def old_check(endpoint_name: str, query_param_names) -> bool:
+    function_name = Entity2Request._endpoint_of_entity.get(endpoint_name)
+    if function_name is not None:
+        accepted_q_params = inspect.getfullargspec(eval(function_name, vars(main_beanie))).args
+        for param in query_param_names:
+            if param not in accepted_q_params:
+                return False
+    return True
+
+
+def new_check(endpoint_name: str, query_param_names) -> bool:
+    route = Entity2Request.route_of(endpoint_name)
+    if route is not None:
+        for param in query_param_names:
+            if param not in route.accepted_query_params:
+                return False
+    return True
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Per-request cost of the query parameter check of main_middleware")
+    parser.add_argument("--entity", default="sequences", help="entity endpoint of the simulated requests")
+    parser.add_argument("--number", type=int, default=100000, help="requests simulated per measure")
+    args = parser.parse_args()
+    route = Entity2Request.route_of(args.entity)
+    if route is None:
+        raise SystemExit(f"unknown entity {args.entity}")
+    # a request with two filters, and the pagination parameters if the endpoint has them
+    pagination_params = [x for x in ("limit", "page") if x in route.accepted_query_params]
+    query_param_names = sorted(route.accepted_query_params - {"limit", "page", "cursor"})[:2] + pagination_params
+    print(f"/{args.entity}: {len(route.accepted_query_params)} accepted query parameters, "
+          f"request with {', '.join(query_param_names)}")
+    for name, check in (("before", old_check), ("after", new_check)):
+        assert check(args.entity, query_param_names)
+        seconds = min(timeit.repeat(lambda: check(args.entity, query_param_names), number=args.number, repeat=5))
+        print(f"{name:6} {seconds / args.number * 1e6:.2f} us per request")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,75 @@
+"""
+Counts the memory allocated per row when projected KB documents are turned into the rows of a response, as beanie did
+before raw_projection.py (a validated Pydantic object of the projection model per document, then vars()) and as
+RawProjection.rows does now. The documents are built in memory with the shape that MongoDB returns for the
+Settings.projection of the model, so neither the database nor Motor are involved. For each path, tracemalloc reports
+the blocks and bytes still allocated once the rows are built (the rows themselves and anything they keep alive) and
+the peak of the bytes allocated while building them. Run it from the root of the project:
+    python -m benchmarks.projection_allocations [--rows 100000]
+"""
+import argparse
+import gc
+import tracemalloc
+
+from bson import ObjectId
+
+from dal.kb_beanie.projections import NUCPositionalMutationProjection, EffectProjection
+from dal.kb_beanie.raw_projection import RawProjection
+
+
+def nuc_positional_mutation_documents(n_rows: int) -> list:
+    return [{"nuc_positional_mutation_id": f"A{i}G", "reference": "A", "position": i, "alternative": "G",
+             "type": "SUB", "length": 1} for i in range(n_rows)]
+
+
+def effect_documents(n_rows: int) -> list:
+    return [{"effect_id": ObjectId(), "type": "IMMUNE_RESPONSE", "lv": "HIGHER", "method": "IN_VITRO"}
+            for _ in range(n_rows)]
+
+
+def pydantic_rows(projection_model, documents: list) -> list:
+    validate = getattr(projection_model, "model_validate", None) or projection_model.parse_obj
+    return list(map(vars, [validate(document) for document in documents]))
+
+
+def raw_rows(projection_model, documents: list) -> list:
+    return RawProjection.of(projection_model).rows(documents)
+
+
+def measure(build_rows, projection_model, documents: list):
+    """
+    Returns the blocks and bytes allocated by build_rows(projection_model, documents) that are still allocated
+    afterwards, and the peak of the bytes allocated during the call.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    rows = build_rows(projection_model, documents)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    differences = after.compare_to(before, "filename")
+    n_blocks = sum(x.count_diff for x in differences)
+    n_bytes = sum(x.size_diff for x in differences)
+    del rows
+    return n_blocks, n_bytes, peak_bytes
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Allocations per row of the KB projections")
+    parser.add_argument("--rows", type=int, default=100000, help="documents per projection")
+    args = parser.parse_args()
+    for projection_model, make_documents in ((NUCPositionalMutationProjection, nuc_positional_mutation_documents),
+                                             (EffectProjection, effect_documents)):
+        RawProjection.of(projection_model)     # the projection is analysed once per model, not per query
+        print(f"{projection_model.__name__}, {args.rows} rows")
+        for name, build_rows in (("pydantic + vars", pydantic_rows), ("RawProjection", raw_rows)):
+            documents = make_documents(args.rows)
+            n_blocks, n_bytes, peak_bytes = measure(build_rows, projection_model, documents)
+            print(f"    {name:16} {n_blocks / args.rows:6.2f} blocks and {n_bytes / args.rows:7.1f} bytes retained "
+                  f"per row, peak {peak_bytes / args.rows:7.1f} bytes per row")
+
+
+if __name__ == "__main__":
+    _main()
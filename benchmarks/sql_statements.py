@@ -0,0 +1,109 @@
+"""
+Compares the single-instance lookups of the VCM database as they were sent before dal/data_sqlalchemy/statements.py
+(SQL text with the values inlined, i.e. a new statement for every value) with the named statements run with bound
+parameters. Every lookup is executed for the same sample of values in both modes, for a number of rounds, and for
+each mode the script prints the wall time and the difference of the pg_stat_statements counters of the current
+database before and after the run: calls, plans, planning time and execution time.
+Requires the pg_stat_statements extension, with pg_stat_statements.track_planning = on for the planning counters,
+and no other load on the database during the run. Run it from the root of the project, with the same connection
+parameters of the API:
+    python -m benchmarks.sql_statements [--samples 200] [--rounds 5]
+"""
+import argparse
+import asyncio
+import re
+import time
+from os.path import sep
+from typing import *
+
+from sqlalchemy import text
+
+from dal.db_settings import read_db_settings
+from dal.data_sqlalchemy import statements
+from dal.data_sqlalchemy.model import config_db_engine, dispose_db_engine, get_session, \
+    read_postgres_connection_parameters_csv
+
+PG_STAT_STATEMENTS_TOTALS = text(
+    "select coalesce(sum(calls), 0), coalesce(sum(plans), 0), coalesce(sum(total_plan_time), 0), "
+    "coalesce(sum(total_exec_time), 0) "
+    "from pg_stat_statements "
+    "where dbid = (select oid from pg_database where datname = current_database());"
+)
+
+# named statement -> query returning a sample of its parameter values (the columns are named as the parameters)
+LOOKUPS = {
+    statements.SEQUENCE_BY_ID:
+        "select sequence_id from sequence where virus_id = 1 order by sequence_id limit :n;",
+    statements.HOST_SAMPLE_BY_ID:
+        "select host_sample_id from host_sample order by host_sample_id limit :n;",
+    statements.NUC_MUTATION_BY_REF_POS_ALT:
+        "select sequence_original as ref, start_original as pos, sequence_alternative as alt "
+        "from nucleotide_variant limit :n;",
+    statements.EPITOPE_BY_ID:
+        "select epi_fragment_id as epitope_id from epitope natural join epitope_fragment where virus_id = 1 "
+        "order by epi_fragment_id limit :n;",
+}
+
+
+def _literal(value) -> str:
+    if isinstance(value, int):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def inlined(statement, params: dict) -> str:
+    """
+    Returns the text of statement with its bound parameters replaced by the literal values in params, as the queries
+    were written before the named statements.
+    """
+    return re.sub(r"(?<!:):(\w+)", lambda m: _literal(params[m.group(1)]), statement.text)
+
+
+async def read_samples(n_samples: int) -> List[Tuple[Any, List[dict]]]:
+    samples = []
+    async with get_session() as session:
+        for statement, sample_query in LOOKUPS.items():
+            result = await session.execute(text(sample_query), {"n": n_samples})
+            samples.append((statement, [dict(row._mapping) for row in result]))
+    return samples
+
+
+async def run(mode: str, samples: List[Tuple[Any, List[dict]]], rounds: int):
+    n_executions = 0
+    async with get_session() as session:
+        before = (await session.execute(PG_STAT_STATEMENTS_TOTALS)).one()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for statement, sample in samples:
+                for params in sample:
+                    if mode == "inlined":
+                        await session.execute(text(inlined(statement, params)))
+                    else:
+                        await session.execute(statement, params)
+                    n_executions += 1
+        elapsed = time.perf_counter() - start
+        after = (await session.execute(PG_STAT_STATEMENTS_TOTALS)).one()
+    calls, plans, plan_ms, exec_ms = (a - b for a, b in zip(after, before))
+    print(f"{mode:8} {n_executions} executions in {elapsed:.2f} s ({elapsed / n_executions * 1e3:.3f} ms each): "
+          f"{calls} calls, {plans} plans, planning {plan_ms:.1f} ms, execution {exec_ms:.1f} ms")
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Inlined SQL vs named statements with bound parameters")
+    parser.add_argument("--samples", type=int, default=200, help="values looked up per statement")
+    parser.add_argument("--rounds", type=int, default=5, help="times the whole sample is looked up")
+    args = parser.parse_args()
+    db_name, db_user, db_psw, db_port = read_postgres_connection_parameters_csv(f".{sep}postgresql_db_conn_params.csv")
+    db_settings = read_db_settings(f".{sep}db_settings.csv")
+    db_settings.pg_statement_timeout_ms = 0
+    config_db_engine(db_name, db_user, db_psw, db_port, db_settings)
+    try:
+        samples = await read_samples(args.samples)
+        for mode in ("inlined", "bound"):
+            await run(mode, samples, args.rounds)
+    finally:
+        await dispose_db_engine()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -1,7 +1,9 @@
 import re
 import warnings
-from typing import Optional
+from bisect import bisect_right
+from typing import Optional, List, Sequence, Tuple
 
+import numpy as np
 from loguru import logger
 
 from api_exceptions import MyExceptions
@@ -103,6 +105,28 @@ def vcm_aa_change_2_aa_change_id(aa_change_db_obj, suggested_protein: Optional[s
     }
 
 
+def vcm_aa_changes_2_aa_change_ids(aa_change_db_objs) -> List[dict]:
+    """
+    Same as vcm_aa_change_2_aa_change_id (without suggested protein) for every element of aa_change_db_objs, but the
+    positions of the ORF1a/ORF1ab changes are converted all at once with convertORF1ab_columns.
+    """
+    aa_change_db_objs = list(aa_change_db_objs)
+    if not aa_change_db_objs:
+        return []
+    short_prots, positions = convertORF1ab_columns(
+        [vcm_syntax_2_short_protein_name[x.protein] for x in aa_change_db_objs],
+        [int(x.position) for x in aa_change_db_objs])
+    return [{
+        "aa_change_id": f"{short_prot}:{x.reference}{x.position}{x.alternative}",
+        "protein_id": short_prot,
+        "reference": x.reference,
+        "position": int(pos),
+        "alternative": x.alternative,
+        "type": x.type,
+        "length": x.length
+    } for x, short_prot, pos in zip(aa_change_db_objs, short_prots, positions)]
+
+
 def aa_change_id_2_vcm_aa_change(aa_change_id: str):
     aa_change_re_match = re.fullmatch(r'([a-zA-Z]+):([a-zA-Z\-\*]*)([\d/]+)([a-zA-Z\-\*]+)', aa_change_id.upper())
     if not aa_change_re_match:
@@ -160,75 +184,122 @@ def epitope_protein_2_kb_protein(epitope_db_obj, suggested_protein: Optional[str
     }
 
 
+class _ORF1Table:
+    """
+    Coordinates of the NSPs within an ORF1 polyprotein: the NSPs in order of position, the position in the polyprotein
+    where each of them starts, the position in the NSP of that first residue (ORF1b starts inside NSP12) and the last
+    position of the polyprotein covered by an NSP.
+    """
+
+    def __init__(self, nsps: List[str], starts: List[int], first_positions: List[int], end: int):
+        self.nsps = nsps
+        self.starts = starts
+        self.first_positions = first_positions
+        self.end = end
+        self.nsps_array = np.array(nsps, dtype=object)
+        self.starts_array = np.array(starts, dtype=np.int64)
+        self.offsets_array = np.array(first_positions, dtype=np.int64) - self.starts_array
+        self.ends = [x - 1 for x in starts[1:]] + [end]
+        self.ends_array = np.array(self.ends, dtype=np.int64)
+        self.index_of_nsp = {nsp: i for i, nsp in enumerate(nsps)}
+
+    def index_of(self, pos: int) -> Optional[int]:
+        """
+        Returns the index of the NSP covering the given position of the polyprotein, or None.
+        """
+        i = bisect_right(self.starts, pos) - 1
+        return i if i >= 0 and pos <= self.end else None
+
+
+# ORF1a is converted with the same table of ORF1ab (the two polyproteins coincide up to NSP10)
+_ORF1AB_TABLE = _ORF1Table(
+    nsps=["NSP1", "NSP2", "NSP3", "NSP4", "NSP5", "NSP6", "NSP7", "NSP8", "NSP9", "NSP10", "NSP12", "NSP13", "NSP14",
+          "NSP15", "NSP16"],
+    starts=[1, 181, 819, 2764, 3264, 3570, 3860, 3943, 4141, 4254, 4393, 5325, 5926, 6453, 6799],
+    first_positions=[1] * 15,
+    end=7096)
+_ORF1B_TABLE = _ORF1Table(
+    nsps=["NSP12", "NSP13", "NSP14", "NSP15", "NSP16"],
+    starts=[1, 924, 1525, 2052, 2398],
+    first_positions=[10, 1, 1, 1, 1],
+    end=2695)
+_orf1_table_of_protein = {
+    'ORF1AB': _ORF1AB_TABLE,
+    'ORF1A': _ORF1AB_TABLE,
+    'ORF1B': _ORF1B_TABLE
+}
+
+
 def convertORF1ab(protein, pos):
-    # map ORF1A/B to sub-proteins
-    if protein == 'ORF1AB' or protein == 'ORF1A':
-        if 1 <= pos <= 180:
-            protein = "NSP1"
-        elif 181 <= pos <= 818:
-            pos = pos - 181 + 1
-            protein = "NSP2"
-        elif 819 <= pos <= 2763:
-            pos = pos - 819 + 1
-            protein = "NSP3"
-        elif 2764 <= pos <= 3263:
-            pos = pos - 2764 + 1
-            protein = "NSP4"
-        elif 3264 <= pos <= 3569:
-            pos = pos - 3264 + 1
-            protein = "NSP5"
-        elif 3570 <= pos <= 3859:
-            pos = pos - 3570 + 1
-            protein = "NSP6"
-        elif 3860 <= pos <= 3942:
-            pos = pos - 3860 + 1
-            protein = "NSP7"
-        elif 3943 <= pos <= 4140:
-            pos = pos - 3943 + 1
-            protein = "NSP8"
-        elif 4141 <= pos <= 4253:
-            pos = pos - 4141 + 1
-            protein = "NSP9"
-        elif 4254 <= pos <= 4392:
-            pos = pos - 4254 + 1
-            protein = "NSP10"
-        elif 4393 <= pos <= 5324:
-            pos = pos - 4393 + 1
-            protein = "NSP12"
-        elif 5325 <= pos <= 5925:
-            pos = pos - 5325 + 1
-            protein = "NSP13"
-        elif 5926 <= pos <= 6452:
-            pos = pos - 5926 + 1
-            protein = "NSP14"
-        elif 6453 <= pos <= 6798:
-            pos = pos - 6453 + 1
-            protein = "NSP15"
-        elif 6799 <= pos <= 7096:
-            pos = pos - 6799 + 1
-            protein = "NSP16"
-        else:
-            warnings.warn(f"AA change with protein {protein} and pos {pos} doesn't resolve to any NSP")
-        return protein, pos
-    elif protein == 'ORF1B':
-        if 1 <= pos <= 923:  # 1 -> 923
-            pos = pos + 9
-            protein = "NSP12"
-        elif 924 <= pos <= 1524:  # 924 -> 1524
-            pos = pos - 924 + 1
-            protein = "NSP13"
-        elif 1525 <= pos <= 2051:  # 1525 -> 2051
-            pos = pos - 1525 + 1
-            protein = "NSP14"
-        elif 2052 <= pos <= 2397:  # 2052 ->2397
-            pos = pos - 2052 + 1
-            protein = "NSP15"
-        elif 2398 <= pos <= 2695:  # 2398 -> 2695
-            pos = pos - 2398 + 1
-            protein = "NSP16"
-        else:
-            warnings.warn(f"AA change with protein {protein} and pos {pos} doesn't resolve to any NSP")
+    """
+    Maps a position of ORF1ab, ORF1a or ORF1b to the NSP containing it and to the position within that NSP.
+    Positions outside the NSPs are returned unchanged (with a warning); other proteins raise KeyError.
+    """
+    table = _orf1_table_of_protein.get(protein)
+    if table is None:
+        raise KeyError(f"Cannot convert coordinates of protein {protein} and pos {pos}")
+    i = table.index_of(pos)
+    if i is None:
+        warnings.warn(f"AA change with protein {protein} and pos {pos} doesn't resolve to any NSP")
         return protein, pos
-    else:
+    return table.nsps[i], pos - table.starts[i] + table.first_positions[i]
+
+
+def convertNSP2ORF1ab(protein, pos):
+    """
+    Inverse of convertORF1ab for ORF1ab: maps a position of an NSP to the position within ORF1ab. Positions outside
+    the NSP are returned unchanged (with a warning); proteins other than the NSPs of ORF1ab raise KeyError.
+    """
+    table = _ORF1AB_TABLE
+    i = table.index_of_nsp.get(protein)
+    if i is None:
         raise KeyError(f"Cannot convert coordinates of protein {protein} and pos {pos}")
+    orf1ab_pos = pos - table.first_positions[i] + table.starts[i]
+    if not table.starts[i] <= orf1ab_pos <= table.ends[i]:
+        warnings.warn(f"AA change with protein {protein} and pos {pos} is outside the NSP")
+        return protein, pos
+    return 'ORF1AB', orf1ab_pos
+
+
+def convertORF1ab_columns(proteins: Sequence[str], positions: Sequence[int]) -> Tuple[List[str], np.ndarray]:
+    """
+    Same as convertORF1ab applied to every (protein, position) pair of two columns, with one vectorised lookup per
+    ORF1 polyprotein. Pairs of other proteins, or outside the NSPs, are returned unchanged.
+    """
+    proteins = np.array(proteins, dtype=object)
+    positions = np.array(positions, dtype=np.int64)
+    converted_proteins = proteins.copy()
+    converted_positions = positions.copy()
+    for protein, table in _orf1_table_of_protein.items():
+        rows = np.flatnonzero(proteins == protein)
+        if not len(rows):
+            continue
+        indexes = np.searchsorted(table.starts_array, positions[rows], side='right') - 1
+        resolved = (indexes >= 0) & (positions[rows] <= table.end)
+        if not resolved.all():
+            warnings.warn(f"{int((~resolved).sum())} AA changes with protein {protein} don't resolve to any NSP")
+        rows, indexes = rows[resolved], indexes[resolved]
+        converted_proteins[rows] = table.nsps_array[indexes]
+        converted_positions[rows] = positions[rows] + table.offsets_array[indexes]
+    return converted_proteins.tolist(), converted_positions
+
 
+def convertNSP2ORF1ab_columns(proteins: Sequence[str], positions: Sequence[int]) -> Tuple[List[str], np.ndarray]:
+    """
+    Same as convertNSP2ORF1ab applied to every (protein, position) pair of two columns. Pairs of other proteins, or
+    outside the NSP, are returned unchanged.
+    """
+    proteins = list(proteins)
+    positions = np.array(positions, dtype=np.int64)
+    table = _ORF1AB_TABLE
+    indexes = np.array([table.index_of_nsp.get(x, -1) for x in proteins], dtype=np.int64)
+    known = indexes >= 0
+    orf1ab_positions = positions.copy()
+    orf1ab_positions[known] -= table.offsets_array[indexes[known]]
+    resolved = known & (orf1ab_positions >= table.starts_array[indexes]) & \
+        (orf1ab_positions <= table.ends_array[indexes])
+    if (known & ~resolved).any():
+        warnings.warn(f"{int((known & ~resolved).sum())} AA changes are outside their NSP")
+    converted_positions = np.where(resolved, orf1ab_positions, positions)
+    converted_proteins = ['ORF1AB' if x else protein for protein, x in zip(proteins, resolved)]
+    return converted_proteins, converted_positions
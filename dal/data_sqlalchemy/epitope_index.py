@@ -0,0 +1,79 @@
+from collections import defaultdict
+from typing import *
+
+from loguru import logger
+
+from dal.interval_index import IntervalIndex
+from dal.data_sqlalchemy.model import get_session
+from dal.data_sqlalchemy import statements
+
+
+class EpitopeIndex:
+    """
+    Index of the epitope fragments of the VCM database by protein (in VCM syntax) and by the positions they cover.
+    An epitope fragment is over a position p when epi_frag_annotation_start < p < epi_frag_annotation_stop (the
+    bounds are excluded), so each fragment is indexed as the closed interval [start + 1, stop - 1].
+    """
+
+    def __init__(self, fragments: Iterable[Tuple[str, int, int, int]]):
+        """
+        :param fragments: (protein_name, epi_frag_annotation_start, epi_frag_annotation_stop, epi_fragment_id) tuples.
+        """
+        intervals_of_protein = defaultdict(list)
+        self._size = 0
+        for protein_name, start, stop, epi_fragment_id in fragments:
+            intervals_of_protein[protein_name].append((start + 1, stop - 1, epi_fragment_id))
+            self._size += 1
+        self._index_of_protein = {protein_name: IntervalIndex(intervals)
+                                  for protein_name, intervals in intervals_of_protein.items()}
+
+    def __len__(self):
+        return self._size
+
+    def epitopes_over(self, protein_name: str, position: int) -> List[int]:
+        """
+        Returns the ids of the epitope fragments of protein_name over the given position.
+        """
+        index = self._index_of_protein.get(protein_name)
+        return index.stab(position) if index else []
+
+    def epitopes_over_any(self, protein_positions: Iterable[Tuple[str, int]]) -> List[int]:
+        """
+        Returns the ids of the epitope fragments over at least one of the given (protein_name, position) pairs
+        (without duplicates).
+        """
+        positions_of_protein = defaultdict(list)
+        for protein_name, position in protein_positions:
+            positions_of_protein[protein_name].append(position)
+        epitope_ids = dict()
+        for protein_name, positions in positions_of_protein.items():
+            index = self._index_of_protein.get(protein_name)
+            if index:
+                for epitopes_of_position in index.stab_many(positions).values():
+                    epitope_ids.update(dict.fromkeys(epitopes_of_position))
+        return list(epitope_ids)
+
+
+_epitope_index: Optional[EpitopeIndex] = None
+# version of the VCM database the index was built from (see model.read_vcm_version)
+_epitope_index_vcm_version: Optional[str] = None
+
+
+async def load_epitope_index(vcm_version: str):
+    """
+    Builds the index of the epitope fragments, unless it was already built from the given version of the VCM
+    database. Call it (after config_db_engine) at startup and whenever the VCM version may have changed.
+    """
+    global _epitope_index, _epitope_index_vcm_version
+    if _epitope_index is not None and _epitope_index_vcm_version == vcm_version:
+        return
+    async with get_session() as session:
+        result = await session.execute(statements.EPITOPE_FRAGMENT_INTERVALS)
+        _epitope_index = EpitopeIndex((protein_name, int(start), int(stop), epi_fragment_id)
+                                      for protein_name, start, stop, epi_fragment_id in result.fetchall())
+    _epitope_index_vcm_version = vcm_version
+    logger.info(f'Epitope index loaded: {len(_epitope_index)} epitope fragments')
+
+
+def get_epitope_index() -> EpitopeIndex:
+    return _epitope_index
@@ -0,0 +1,155 @@
+import re
+from typing import Optional, List, Tuple, Sequence, Callable, AsyncIterator
+
+from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
+
+from api_exceptions import MyExceptions
+
+# value standing for NULL in the keyset, by type: the row comparison of the seek condition is NULL as soon as one of
+# its elements is NULL, so the nullable columns of a keyset are compared through nullable_key()
+_NULL_KEY = {int: -1, str: ""}
+
+
+def nullable_key(expression: str, value_type: type) -> str:
+    """
+    Returns the keyset expression of a nullable column, i.e. expression with NULL replaced by a value of value_type
+    that key_of() puts in the cursor in place of None.
+    """
+    null_key = _NULL_KEY[value_type]
+    return f"coalesce({expression}, {null_key if value_type is int else repr(null_key)})"
+
+
+class SQLQuery:
+    """
+    Composes the filters of a list endpoint into a single statement of the form
+        <select_from> where <condition> and <condition> ... [group by ...] [order by ...] [limit ... offset ...]
+    so that the database evaluates the conjunction, the ordering and the pagination in one round trip.
+    Conditions are SQL fragments whose values are always passed as bound parameters (:name).
+    If a keyset is given, i.e. a list of (SQL expression, output column name, Python type) triples uniquely
+    identifying each row of the result, the query can also be paginated with a cursor (see queries.KeysetPagination):
+    the page is then sought with (<keyset expressions>) > (<last key>) instead of skipping rows with an offset. The
+    expressions of nullable columns must be built with nullable_key(), and, in a select distinct, must appear in the
+    select list: queries that de-duplicate on them group by the output columns instead.
+    map_row converts a result row into the object returned by the API.
+    """
+
+    def __init__(self, select_from: str, *conditions: str, order_by: Optional[str] = None,
+                 keyset: Optional[Sequence[Tuple[str, str, type]]] = None, map_row: Callable = dict,
+                 group_by: Optional[str] = None, **params):
+        self.select_from = select_from
+        self.group_by = group_by
+        self.order_by = order_by
+        self.keyset = keyset
+        self.map_row = map_row
+        self.conditions: List[str] = list(conditions)
+        self.params = dict(params)
+        self._filters_count = 0
+
+    def where(self, condition: str, **params):
+        """
+        Adds a filter condition to the conjunction. Parameter names must be unique within the same query.
+        """
+        duplicated_params = self.params.keys() & params.keys()
+        if duplicated_params:
+            raise ValueError(f"query parameters {duplicated_params} are already bound")
+        self.conditions.append(condition)
+        self.params.update(params)
+        self._filters_count += 1
+        return self
+
+    def has_filters(self) -> bool:
+        """
+        Returns True if at least one filter was added with where() (conditions given to the constructor don't count).
+        """
+        return self._filters_count > 0
+
+    def statement(self, pagination=None) -> Tuple[TextClause, dict]:
+        """
+        Returns the composed statement and its bound parameters.
+        :param pagination: queries.OptionalPagination, queries.KeysetPagination or None.
+        """
+        stmt, params = self.sql(pagination)
+        return text(stmt + ";"), params
+
+    def subquery(self, prefix: str) -> Tuple[str, dict]:
+        """
+        Returns the statement without ordering and pagination, as a SQL fragment to be nested in another statement,
+        and its bound parameters renamed with the given prefix, so that they don't collide with the ones of the
+        enclosing statement.
+        """
+        stmt, params = self.sql(ordered=False)
+        stmt = re.sub(r"(?<![:\w]):(\w+)",
+                      lambda m: f":{prefix}{m.group(1)}" if m.group(1) in params else m.group(0), stmt)
+        return stmt, {f"{prefix}{name}": value for name, value in params.items()}
+
+    def sql(self, pagination=None, ordered: bool = True) -> Tuple[str, dict]:
+        """
+        Same as statement(), but returns the SQL text without the final semicolon. If ordered is False, the statement
+        has no order by clause.
+        """
+        conditions = list(self.conditions)
+        order_by = self.order_by if ordered else None
+        params = dict(self.params)
+        if pagination and pagination.is_keyset:
+            if not self.keyset:
+                raise ValueError("this query does not define a keyset and can't be paginated with a cursor")
+            keyset_expressions = [expression for expression, _, _ in self.keyset]
+            if pagination.last_key is not None:
+                if not self._is_key(pagination.last_key):
+                    raise MyExceptions.invalid_pagination_cursor
+                key_params = {f"_key_{i}": v for i, v in enumerate(pagination.last_key)}
+                conditions.append(f"({', '.join(keyset_expressions)}) > ({', '.join(':' + k for k in key_params)})")
+                params.update(key_params)
+            order_by = ", ".join(keyset_expressions)
+
+        stmt = self.select_from
+        if conditions:
+            stmt += " where " + " and ".join(f"({c})" for c in conditions)
+        if self.group_by:
+            stmt += f" group by {self.group_by}"
+        if order_by:
+            stmt += f" order by {order_by}"
+        if pagination:
+            stmt += " limit :_limit"
+            params["_limit"] = pagination.limit
+            if not pagination.is_keyset:
+                stmt += " offset :_offset"
+                params["_offset"] = pagination.skip
+        return stmt, params
+
+    async def fetchall(self, session, pagination=None) -> list:
+        stmt, params = self.statement(pagination)
+        result = await session.execute(stmt, params)
+        return result.fetchall()
+
+    async def stream(self, session) -> AsyncIterator:
+        """
+        Yields the mapped rows of the whole (unpaginated) result, read through a server-side cursor so that the result
+        is never held in memory at once.
+        """
+        stmt, params = self.statement()
+        result = await session.stream(stmt, params)
+        async for row in result:
+            yield self.map_row(row)
+
+    def key_of(self, row) -> list:
+        """
+        Returns the values of the keyset of a result row, i.e. what a cursor pointing after that row must encode.
+        """
+        key = [row._mapping[column] for _, column, _ in self.keyset]
+        return [_NULL_KEY[value_type] if value is None else value
+                for value, (_, _, value_type) in zip(key, self.keyset)]
+
+    def _is_key(self, key: list) -> bool:
+        """
+        Returns True if key (decoded from a cursor) has one value of the right type for each element of the keyset.
+        Values are never None, as key_of() replaces the null columns of the last row (see nullable_key()).
+        """
+        if len(key) != len(self.keyset):
+            return False
+        for value, (_, _, value_type) in zip(key, self.keyset):
+            # bool is a subclass of int, but JSON true/false are never the key of a row
+            if not isinstance(value, value_type) or isinstance(value, bool):
+                return False
+        return True
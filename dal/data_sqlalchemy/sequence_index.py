@@ -0,0 +1,209 @@
+"""
+Inverted index from each nuc mutation and aa change of the VCM database to the set of the sequences carrying it,
+stored as a compressed (roaring) bitmap of sequence_ids.
+The index is derived data written to a file: rebuild it after each import of data into the VCM database (and after
+rebuilding the summary tables, see summary_tables.py) with
+    python -m dal.data_sqlalchemy.sequence_index
+(run from the root of the project, with the same connection parameters of the API). The file records the version of
+the VCM database it was built from (see model.read_vcm_version): the API uses it only while that version is current.
+The file is memory-mapped, so only the bitmaps that are actually read are loaded into memory.
+Requires the optional dependency pyroaring: without it the index is not used and the queries join the VCM tables.
+"""
+import asyncio
+import json
+import mmap
+import os
+import struct
+from collections import defaultdict
+from os.path import sep
+from typing import *
+
+from loguru import logger
+
+from dal.data_sqlalchemy import statements
+from dal.data_sqlalchemy.model import get_session, config_db_engine, dispose_db_engine, read_vcm_version, \
+    read_postgres_connection_parameters_csv
+from dal.db_settings import read_db_settings
+
+try:
+    from pyroaring import BitMap, FrozenBitMap
+except ImportError:     # optional dependency: the queries don't use the index
+    BitMap = FrozenBitMap = None
+
+SEQUENCE_INDEX_FILE = f".{sep}sequence_index.bin"
+# file layout: <MAGIC> <header length: unsigned 64 bit little endian> <header: JSON> <serialized bitmaps>
+_MAGIC = b"COV2KSEQIDX1"
+_HEADER_LENGTH = struct.Struct("<Q")
+
+
+def nuc_mutation_key(ref: str, pos: int, alt: str) -> str:
+    """
+    Key of a nuc mutation in VCM syntax (lowercase ref and alt).
+    """
+    return f"N{ref}{pos}{alt}"
+
+
+def aa_change_key(prot: str, ref: str, pos: int, alt: str) -> str:
+    """
+    Key of an aa change in VCM syntax (the protein is the VCM product name).
+    """
+    return f"A{prot}:{ref}{pos}{alt}"
+
+
+class SequenceIndex:
+    """
+    Read-only view of an index file. Missing keys (mutations that no sequence carries) have an empty posting list.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.file_mtime = os.path.getmtime(file_path)
+        with open(file_path, mode='rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._buffer[:len(_MAGIC)] != _MAGIC:
+            self._buffer.close()
+            raise ValueError(f"{file_path} is not a sequence index file")
+        header_start = len(_MAGIC) + _HEADER_LENGTH.size
+        header_length, = _HEADER_LENGTH.unpack_from(self._buffer, len(_MAGIC))
+        header = json.loads(self._buffer[header_start:header_start + header_length])
+        self.vcm_version: str = header["vcm_version"]
+        # key -> (offset, size, cardinality) of its bitmap
+        self._postings: Dict[str, Tuple[int, int, int]] = header["postings"]
+        self._data_start = header_start + header_length
+
+    def __len__(self):
+        return len(self._postings)
+
+    def close(self):
+        self._buffer.close()
+
+    def cardinality(self, key: str) -> int:
+        posting = self._postings.get(key)
+        return posting[2] if posting else 0
+
+    def sequences_of(self, key: str) -> FrozenBitMap:
+        posting = self._postings.get(key)
+        if posting is None:
+            return FrozenBitMap()
+        offset, size, _ = posting
+        start = self._data_start + offset
+        return FrozenBitMap.deserialize(self._buffer[start:start + size])
+
+    def all_of(self, keys: Iterable[str]) -> FrozenBitMap:
+        """
+        Returns the sequences carrying every one of the keys. The bitmaps are intersected from the smallest one, and
+        the intersection stops as soon as it is empty.
+        """
+        keys = sorted(set(keys), key=self.cardinality)
+        if not keys:
+            return FrozenBitMap()
+        result = self.sequences_of(keys[0])
+        for key in keys[1:]:
+            if not result:
+                break
+            result = result & self.sequences_of(key)
+        return result
+
+    def any_of(self, keys: Iterable[str]) -> FrozenBitMap:
+        """
+        Returns the sequences carrying at least one of the keys.
+        """
+        return FrozenBitMap.union(FrozenBitMap(), *(self.sequences_of(key) for key in set(keys)))
+
+    @staticmethod
+    def write(file_path: str, sequences_of_key: Dict[str, BitMap], vcm_version: str):
+        postings = dict()
+        offset = 0
+        serialized_bitmaps = []
+        for key, sequences in sequences_of_key.items():
+            sequences.run_optimize()
+            serialized = sequences.serialize()
+            postings[key] = (offset, len(serialized), len(sequences))
+            serialized_bitmaps.append(serialized)
+            offset += len(serialized)
+        header = json.dumps({"vcm_version": vcm_version, "postings": postings}, separators=(",", ":"))\
+            .encode("utf-8")
+        # written under a temporary name and then renamed, so that a running API never reads a partial file
+        temp_file_path = file_path + ".tmp"
+        with open(temp_file_path, mode='wb') as f:
+            f.write(_MAGIC)
+            f.write(_HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            for serialized in serialized_bitmaps:
+                f.write(serialized)
+        os.replace(temp_file_path, file_path)
+
+
+_sequence_index: Optional[SequenceIndex] = None
+
+
+def load_sequence_index(file_path: str, vcm_version: str):
+    """
+    Loads the index from file_path if it was built from the given version of the VCM database, or unloads it if it
+    is outdated. Call it at startup and whenever the VCM version may have changed: the file is read again only if it
+    was rewritten.
+    """
+    if FrozenBitMap is None:
+        return
+    if _sequence_index is not None and (
+            not os.path.exists(file_path) or os.path.getmtime(file_path) != _sequence_index.file_mtime):
+        _replace_sequence_index(None)
+    if _sequence_index is None:
+        try:
+            _replace_sequence_index(SequenceIndex(file_path))
+        except FileNotFoundError:
+            logger.info(f"{file_path} not found: the sequence index is not used")
+            return
+        logger.info(f"Sequence index loaded: {len(_sequence_index)} nuc mutations and aa changes")
+    if _sequence_index.vcm_version != vcm_version:
+        logger.warning(f"{file_path} is outdated: the sequence index is not used until it is rebuilt")
+        _replace_sequence_index(None)
+
+
+def _replace_sequence_index(sequence_index: Optional[SequenceIndex]):
+    """
+    Closes the memory map of the current index, if any, and replaces it. The queries use the index without awaiting
+    in between (and the bitmaps they get are copies), so no request is still reading the closed map.
+    """
+    global _sequence_index
+    if _sequence_index is not None:
+        _sequence_index.close()
+    _sequence_index = sequence_index
+
+
+def get_sequence_index() -> Optional[SequenceIndex]:
+    """
+    Returns the sequence index, or None if it is not available.
+    """
+    return _sequence_index
+
+
+async def build_sequence_index(file_path: str):
+    vcm_version = await read_vcm_version()
+    sequences_of_key = defaultdict(BitMap)
+    async with get_session() as session:
+        rows = await session.stream(statements.NUC_MUTATION_SEQUENCE_IDS)
+        async for ref, pos, alt, sequence_id in rows:
+            sequences_of_key[nuc_mutation_key(ref, pos, alt)].add(sequence_id)
+        rows = await session.stream(statements.AA_CHANGE_SEQUENCE_IDS)
+        async for prot, ref, pos, alt, sequence_id in rows:
+            sequences_of_key[aa_change_key(prot, ref, pos, alt)].add(sequence_id)
+    SequenceIndex.write(file_path, sequences_of_key, vcm_version)
+    logger.info(f"{file_path} written: {len(sequences_of_key)} nuc mutations and aa changes")
+
+
+async def _main():
+    if BitMap is None:
+        raise SystemExit("the sequence index requires pyroaring (pip install pyroaring)")
+    db_name, db_user, db_psw, db_port = read_postgres_connection_parameters_csv(f".{sep}postgresql_db_conn_params.csv")
+    db_settings = read_db_settings(f".{sep}db_settings.csv")
+    db_settings.pg_statement_timeout_ms = 0     # the timeout is meant for the requests to the API, not for the build
+    config_db_engine(db_name, db_user, db_psw, db_port, db_settings)
+    try:
+        await build_sequence_index(SEQUENCE_INDEX_FILE)
+    finally:
+        await dispose_db_engine()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
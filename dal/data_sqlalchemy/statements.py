@@ -0,0 +1,264 @@
+"""
+Named, parameterised statements of the VCM database. Their text never changes and every value is passed as a bound
+parameter (:name), so that the asyncpg driver prepares each statement once per connection and then reuses the cached
+prepared statement (and, after a few executions, a generic plan) instead of parsing and planning a new query string at
+every request.
+Statements whose filters are composed at request time are built with query_builder.SQLQuery, which binds values in
+the same way.
+"""
+from sqlalchemy import text
+
+
+# sequences
+
+SEQUENCE_BY_ID = text(
+    "select sequence_id, accession_id, database_source as \"source_database\", length, "
+    "n_percentage, gc_percentage "
+    "from sequence natural join sequencing_project "
+    "where sequence_id = :sequence_id "
+    "limit 1;"
+)
+
+SEQUENCES_BY_IDS = text(
+    "select sequence_id, accession_id, database_source as \"source_database\", length, "
+    "n_percentage, gc_percentage "
+    "from sequence natural join sequencing_project "
+    "where sequence_id = any(:sequence_ids) "
+    "and virus_id = 1 "
+    "order by sequence_id;"
+)
+
+SEQUENCES_BY_HOST_SAMPLE_IDS = text(
+    "select sequence_id, accession_id, database_source as \"source_database\", length, "
+    "n_percentage, gc_percentage "
+    "from sequence natural join sequencing_project natural join host_sample hs "
+    "where hs.host_sample_id = any(:host_sample_ids) "
+    "and virus_id = 1 "
+    "order by sequence_id;"
+)
+
+SEQUENCES_BY_ANY_NUC_REF_POS_ALT = text(
+    "select sequence_id, accession_id, database_source as \"source_database\", length, "
+    "n_percentage, gc_percentage "
+    "from sequence natural join sequencing_project natural join nucleotide_variant nv "
+    "where (nv.sequence_original, nv.start_original, nv.sequence_alternative) in ("
+    "  select * from unnest(cast(:refs as text[]), cast(:positions as integer[]), "
+    "                      cast(:alts as text[]))) "
+    "and virus_id = 1 "
+    "order by sequence_id;"
+)
+
+SEQUENCES_BY_ANY_AA_PROT_REF_POS_ALT = text(
+    "select sequence_id, accession_id, database_source as \"source_database\", length, "
+    "n_percentage, gc_percentage "
+    "from sequence natural join sequencing_project natural join annotation a "
+    "natural join aminoacid_variant av "
+    "where (a.product, av.sequence_aa_original, av.start_aa_original, av.sequence_aa_alternative) in ("
+    "  select * from unnest(cast(:prots as text[]), cast(:refs as text[]), "
+    "                      cast(:positions as integer[]), cast(:alts as text[]))) "
+    "and virus_id = 1 "
+    "order by sequence_id;"
+)
+
+
+# host samples
+
+HOST_SAMPLE_BY_ID = text(
+    "select host_sample_id, geo_group as \"continent\", country, region, collection_date, "
+    "host_taxon_name as \"host_species\" "
+    "from host_sample natural join host_specie "
+    "where host_sample_id = :host_sample_id "
+    "limit 1;"
+)
+
+HOST_SAMPLES_BY_SEQUENCE_IDS = text(
+    "select host_sample_id, geo_group as \"continent\", country, region, collection_date, "
+    "host_taxon_name as \"host_species\" "
+    "from host_sample natural join host_specie natural join sequence s "
+    "where s.sequence_id = any(:sequence_ids) "
+    "and s.virus_id = 1 "
+    "order by host_sample_id;"
+)
+
+
+# nuc mutations
+
+NUC_MUTATION_BY_REF_POS_ALT = text(
+    "select upper(concat(sequence_original, start_original, sequence_alternative)) as \"nuc_mutation_id\", "
+    "upper(sequence_original) as \"reference\", "
+    "start_original as \"position\", upper(sequence_alternative) as \"alternative\", "
+    "variant_type as \"type\", variant_length as \"length\" "
+    "from nucleotide_variant natural join sequence "
+    "where virus_id = 1 "
+    "and sequence_original = :ref "
+    "and start_original = :pos "
+    "and sequence_alternative = :alt "
+    "limit 1;"
+)
+
+NUC_MUTATIONS_BY_SEQUENCE_IDS = text(
+    "select distinct upper(concat(sequence_original, start_original, sequence_alternative)) "
+    "as \"nuc_mutation_id\", "
+    "upper(sequence_original) as \"reference\", "
+    "start_original as \"position\", upper(sequence_alternative) as \"alternative\", "
+    "variant_type as \"type\", variant_length as \"length\" "
+    "from nucleotide_variant natural join sequence where virus_id = 1 "
+    "and sequence_id = any(:sequence_ids) "
+    "order by reference, position, alternative;"
+)
+
+NUC_MUTATIONS_BY_ANY_REF_POS_ALT = text(
+    "select distinct on (sequence_original, start_original, sequence_alternative) "
+    "upper(concat(sequence_original, start_original, sequence_alternative)) as \"nuc_mutation_id\", "
+    "upper(sequence_original) as \"reference\", "
+    "start_original as \"position\", upper(sequence_alternative) as \"alternative\", "
+    "variant_type as \"type\", variant_length as \"length\" "
+    "from nucleotide_variant natural join sequence "
+    "where virus_id = 1 "
+    "and (sequence_original, start_original, sequence_alternative) in ("
+    "  select * from unnest(cast(:refs as text[]), cast(:positions as integer[]), "
+    "                      cast(:alts as text[])));"
+)
+
+
+# aa changes
+
+AA_CHANGE_BY_PROT_REF_POS_ALT = text(
+    "select product as \"protein\", sequence_aa_original as \"reference\", "
+    "start_aa_original as \"position\", sequence_aa_alternative as \"alternative\", "
+    "variant_aa_type as \"type\", variant_aa_length as \"length\" "
+    "from aminoacid_variant natural join annotation natural join sequence where virus_id = 1 "
+    "and product = :prot "
+    "and sequence_aa_original = :ref "
+    "and start_aa_original = :pos "
+    "and sequence_aa_alternative = :alt "
+    "limit 1;"
+)
+
+AA_CHANGES_BY_SEQUENCE_IDS = text(
+    "select distinct product as \"protein\", sequence_aa_original as \"reference\", "
+    "start_aa_original as \"position\", sequence_aa_alternative as \"alternative\", "
+    "variant_aa_type as \"type\", variant_aa_length as \"length\" "
+    "from aminoacid_variant natural join annotation natural join sequence where virus_id = 1 "
+    "and sequence_id = any(:sequence_ids) "
+    "order by protein, reference, position, alternative;"
+)
+
+AA_CHANGES_BY_ANY_PROT_REF_POS_ALT = text(
+    "select distinct on (product, sequence_aa_original, start_aa_original, sequence_aa_alternative) "
+    "product as \"protein\", sequence_aa_original as \"reference\", "
+    "start_aa_original as \"position\", sequence_aa_alternative as \"alternative\", "
+    "variant_aa_type as \"type\", variant_aa_length as \"length\" "
+    "from aminoacid_variant natural join annotation natural join sequence where virus_id = 1 "
+    "and (product, sequence_aa_original, start_aa_original, sequence_aa_alternative) in ("
+    "  select * from unnest(cast(:prots as text[]), cast(:refs as text[]), "
+    "                      cast(:positions as integer[]), cast(:alts as text[])));"
+)
+
+
+# summary tables (see summary_tables.py)
+
+NUC_MUTATION_SEQUENCE_COUNT = text(
+    "select sum(n_sequences) from nuc_mutation_summary "
+    "where reference = :ref and position = :pos and alternative = :alt;"
+)
+
+AA_CHANGE_SEQUENCE_COUNT = text(
+    "select sum(n_sequences) from aa_change_summary "
+    "where vcm_protein = :prot and reference = :ref and vcm_position = :pos and alternative = :alt;"
+)
+
+
+# sequence index (see sequence_index.py)
+
+NUC_MUTATION_SEQUENCE_IDS = text(
+    "select sequence_original, start_original, sequence_alternative, sequence_id "
+    "from nucleotide_variant natural join sequence "
+    "where virus_id = 1;"
+)
+
+AA_CHANGE_SEQUENCE_IDS = text(
+    "select product, sequence_aa_original, start_aa_original, sequence_aa_alternative, sequence_id "
+    "from aminoacid_variant natural join annotation natural join sequence "
+    "where virus_id = 1;"
+)
+
+
+# co-occurrence (see get_sequences_co_occurrence in queries.py)
+
+# temporary table of the sequences among which a co-occurrence query searches, when they are too many to be passed as
+# an array parameter
+CREATE_CO_OCCURRENCE_AMONG = text(
+    "create temporary table if not exists co_occurrence_among (sequence_id integer primary key) on commit drop;"
+)
+
+TRUNCATE_CO_OCCURRENCE_AMONG = text(
+    "truncate co_occurrence_among;"
+)
+
+INSERT_CO_OCCURRENCE_AMONG = text(
+    "insert into co_occurrence_among select unnest(cast(:sequence_ids as integer[]));"
+)
+
+ANALYZE_CO_OCCURRENCE_AMONG = text(
+    "analyze co_occurrence_among;"
+)
+
+
+# epitopes
+
+EPITOPE_BY_ID = text(
+    "select epi_fragment_id as \"epitope_id\" , protein_name as \"protein_id\", "
+    "host_taxon_name as \"host_species\", epi_frag_annotation_start as \"epitope_start\", "
+    "epi_frag_annotation_stop as \"epitope_stop\" "
+    "from epitope natural join epitope_fragment natural join host_specie "
+    "where virus_id = 1 "
+    "and epi_fragment_id = :epitope_id "
+    "limit 1;"
+)
+
+EPITOPE_FRAGMENT_INTERVALS = text(
+    "select protein_name, epi_frag_annotation_start, epi_frag_annotation_stop, epi_fragment_id "
+    "from epitope natural join epitope_fragment "
+    "where virus_id = 1 "
+    "and epi_frag_annotation_start is not null and epi_frag_annotation_stop is not null;"
+)
+
+PROTEIN_OF_EPITOPE = text(
+    "select protein_name from epitope natural join epitope_fragment "
+    "where epi_fragment_id = :epitope_id and virus_id = 1 limit 1;"
+)
+
+
+# assays
+
+ASSAY_BY_ID = text(
+    "select epitope_id as \"assay_id\", "
+    "cell_type as \"assay_type\", mhc_class, mhc_allele as \"hla_restriction\" "
+    "from epitope "
+    "where epitope_id = :assay_id and virus_id = 1 "
+    "limit 1;"
+)
+
+
+# database version
+
+# fingerprint of the content of the data tables: the greatest id of each table (a lookup in its primary key index)
+# and the number of rows of the tables of sequences, host samples and epitopes, whose deletions the ids don't reveal.
+# Unlike the statistics counters it survives restarts and isn't affected by the summary tables.
+VCM_VERSION = text(
+    "select concat_ws('-', "
+    "(select coalesce(max(host_id), 0) from host_specie), "
+    "(select coalesce(max(host_sample_id), 0) from host_sample), "
+    "(select coalesce(max(sequencing_project_id), 0) from sequencing_project), "
+    "(select coalesce(max(sequence_id), 0) from sequence), "
+    "(select coalesce(max(annotation_id), 0) from annotation), "
+    "(select coalesce(max(nucleotide_variant_id), 0) from nucleotide_variant), "
+    "(select coalesce(max(aminoacid_variant_id), 0) from aminoacid_variant), "
+    "(select coalesce(max(epitope_id), 0) from epitope), "
+    "(select coalesce(max(epi_fragment_id), 0) from epitope_fragment), "
+    "(select count(*) from sequence), "
+    "(select count(*) from host_sample), "
+    "(select count(*) from epitope), "
+    "(select count(*) from epitope_fragment));"
+)
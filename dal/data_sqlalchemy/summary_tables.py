@@ -0,0 +1,167 @@
+"""
+Summary tables of the VCM database, i.e. one row per distinct nuc mutation and per distinct aa change of the virus,
+with the number of sequences having it. The list endpoints of nuc mutations and aa changes read them instead of
+de-duplicating the whole nucleotide_variant / aminoacid_variant tables at every request (except when the result is
+filtered by sequence, which the summary tables don't record).
+The tables are derived data: rebuild them after each import of data into the VCM database with
+    python -m dal.data_sqlalchemy.summary_tables
+(run from the root of the project, with the same connection parameters of the API). Each table is built under a
+temporary name and swapped with the old one at the end, so the API keeps reading the previous version meanwhile.
+"""
+import asyncio
+from os.path import sep
+from typing import *
+
+from loguru import logger
+from sqlalchemy import text
+
+from dal.data_sqlalchemy.convert_prot_names import vcm_aa_changes_2_aa_change_ids, vcm_syntax_2_short_protein_name
+from dal.data_sqlalchemy.model import get_session, config_db_engine, dispose_db_engine, \
+    read_postgres_connection_parameters_csv
+from dal.data_sqlalchemy.query_builder import nullable_key
+from dal.db_settings import read_db_settings
+
+NUC_MUTATION_SUMMARY = "nuc_mutation_summary"
+AA_CHANGE_SUMMARY = "aa_change_summary"
+
+_CREATE_NUC_MUTATION_SUMMARY = (
+    "create table {table} as "
+    "select upper(concat(sequence_original, start_original, sequence_alternative)) as nuc_mutation_id, "
+    "upper(sequence_original) as reference, start_original as position, "
+    "upper(sequence_alternative) as alternative, variant_type as type, variant_length as length, "
+    "count(distinct sequence_id) as n_sequences "
+    "from nucleotide_variant natural join sequence "
+    "where virus_id = 1 "
+    "group by 1, 2, 3, 4, 5, 6;"
+)
+
+# aa changes are stored both in VCM syntax (vcm_protein, vcm_position), which the filters and the ordering of the
+# list endpoint refer to, and in KB syntax (aa_change_id, protein_id, position), i.e. already converted by
+# vcm_aa_changes_2_aa_change_ids (ORF1ab changes are mapped to the NSPs)
+_CREATE_AA_CHANGE_SUMMARY = (
+    "create table {table} ("
+    "aa_change_id text, protein_id text, position integer, "
+    "vcm_protein text, vcm_position integer, "
+    "reference text, alternative text, type text, length integer, "
+    "n_sequences integer);"
+)
+
+_DISTINCT_AA_CHANGES = text(
+    "select product as \"protein\", sequence_aa_original as \"reference\", "
+    "start_aa_original as \"position\", sequence_aa_alternative as \"alternative\", "
+    "variant_aa_type as \"type\", variant_aa_length as \"length\", "
+    "count(distinct sequence_id) as \"n_sequences\" "
+    "from aminoacid_variant natural join annotation natural join sequence "
+    "where virus_id = 1 "
+    "group by product, sequence_aa_original, start_aa_original, sequence_aa_alternative, "
+    "variant_aa_type, variant_aa_length;"
+)
+
+_INSERT_AA_CHANGE_SUMMARY = (
+    "insert into {table} values (:aa_change_id, :protein_id, :position, :vcm_protein, :vcm_position, "
+    ":reference, :alternative, :type, :length, :n_sequences);"
+)
+
+_INSERT_BATCH_SIZE = 10000
+
+_summary_tables_available: Optional[bool] = None
+
+
+async def refresh_summary_tables():
+    """
+    Rebuilds the summary tables from the current content of the VCM database.
+    """
+    async with get_session() as session:
+        async with session.begin():
+            await session.execute(text(f"drop table if exists {NUC_MUTATION_SUMMARY}_new;"))
+            await session.execute(text(_CREATE_NUC_MUTATION_SUMMARY.format(table=f"{NUC_MUTATION_SUMMARY}_new")))
+            index_names = await _index(session, NUC_MUTATION_SUMMARY,
+                                       unique_key=("reference", nullable_key("position", int), "alternative", "type",
+                                                   "length"),
+                                       columns=("position", "alternative", "type", "length"))
+            await _swap(session, NUC_MUTATION_SUMMARY, index_names)
+        logger.info(f"{NUC_MUTATION_SUMMARY} rebuilt")
+
+        async with session.begin():
+            await session.execute(text(f"drop table if exists {AA_CHANGE_SUMMARY}_new;"))
+            await session.execute(text(_CREATE_AA_CHANGE_SUMMARY.format(table=f"{AA_CHANGE_SUMMARY}_new")))
+            insert = text(_INSERT_AA_CHANGE_SUMMARY.format(table=f"{AA_CHANGE_SUMMARY}_new"))
+            distinct_aa_changes = await session.execute(_DISTINCT_AA_CHANGES)
+            vcm_aa_changes = []
+            for vcm_aa_change in distinct_aa_changes.fetchall():
+                if vcm_aa_change.protein not in vcm_syntax_2_short_protein_name:
+                    logger.error(f"aa change {tuple(vcm_aa_change)} skipped: unknown protein {vcm_aa_change.protein}")
+                    continue
+                vcm_aa_changes.append(vcm_aa_change)
+            rows = vcm_aa_changes_2_aa_change_ids(vcm_aa_changes)
+            for vcm_aa_change, aa_change in zip(vcm_aa_changes, rows):
+                aa_change["vcm_protein"] = vcm_aa_change.protein
+                aa_change["vcm_position"] = vcm_aa_change.position
+                aa_change["n_sequences"] = vcm_aa_change.n_sequences
+            for i in range(0, len(rows), _INSERT_BATCH_SIZE):
+                await session.execute(insert, rows[i:i + _INSERT_BATCH_SIZE])
+            index_names = await _index(session, AA_CHANGE_SUMMARY,
+                                       unique_key=("vcm_protein", "reference", nullable_key("vcm_position", int),
+                                                   "alternative", "type", "length"),
+                                       columns=("reference", "vcm_position", "alternative", "type", "length"))
+            await _swap(session, AA_CHANGE_SUMMARY, index_names)
+        logger.info(f"{AA_CHANGE_SUMMARY} rebuilt")
+
+
+async def _index(session, table: str, unique_key: Tuple[str, ...], columns: Tuple[str, ...]) -> List[str]:
+    """
+    Indexes the new version of table with a unique index on unique_key (the keyset of the list endpoint, whose first
+    column is also the leading column filter) and one index on each of the other filtered columns. Returns the index
+    names without the table name.
+    """
+    new_table = f"{table}_new"
+    await session.execute(text(f"create unique index {new_table}_key_idx on {new_table} ({', '.join(unique_key)});"))
+    for column in columns:
+        await session.execute(text(f"create index {new_table}_{column}_idx on {new_table} ({column});"))
+    await session.execute(text(f"analyze {new_table};"))
+    return ["key", *columns]
+
+
+async def _swap(session, table: str, index_names: List[str]):
+    new_table = f"{table}_new"
+    await session.execute(text(f"drop table if exists {table};"))
+    await session.execute(text(f"alter table {new_table} rename to {table};"))
+    for name in index_names:
+        await session.execute(text(f"alter index {new_table}_{name}_idx rename to {table}_{name}_idx;"))
+
+
+async def check_summary_tables():
+    """
+    Checks whether the summary tables exist. Until they do, the list endpoints query the VCM tables directly.
+    """
+    global _summary_tables_available
+    async with get_session() as session:
+        result = await session.execute(text(f"select to_regclass('{NUC_MUTATION_SUMMARY}') is not null "
+                                            f"and to_regclass('{AA_CHANGE_SUMMARY}') is not null;"))
+        available = bool(result.scalar())
+    if available != _summary_tables_available:
+        if available:
+            logger.info("VCM summary tables found")
+        else:
+            logger.warning("VCM summary tables not found: build them with "
+                           "python -m dal.data_sqlalchemy.summary_tables")
+    _summary_tables_available = available
+
+
+def summary_tables_available() -> bool:
+    return bool(_summary_tables_available)
+
+
+async def _main():
+    db_name, db_user, db_psw, db_port = read_postgres_connection_parameters_csv(f".{sep}postgresql_db_conn_params.csv")
+    db_settings = read_db_settings(f".{sep}db_settings.csv")
+    db_settings.pg_statement_timeout_ms = 0     # the timeout is meant for the requests to the API, not for the rebuild
+    config_db_engine(db_name, db_user, db_psw, db_port, db_settings)
+    try:
+        await refresh_summary_tables()
+    finally:
+        await dispose_db_engine()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,111 @@
+import os
+from typing import *
+
+from loguru import logger
+
+READ_PREFERENCES = ("primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest")
+
+
+def _parse_bool(value: str) -> bool:
+    if value.lower() in ("true", "yes", "1"):
+        return True
+    elif value.lower() in ("false", "no", "0"):
+        return False
+    raise ValueError(f"{value} is not a boolean")
+
+
+class DBSettings:
+    """
+    Connection pool and engine settings of the PostgreSQL (VCM) and MongoDB (KB) clients.
+    Every setting has a default, which can be overridden by the settings file and then by an environment variable
+    named COV2K_<SETTING NAME IN UPPERCASE> (e.g. COV2K_PG_POOL_SIZE=20).
+    """
+
+    # name: (parser, default, description)
+    SETTINGS = {
+        "pg_pool_size": (int, 5, "connections kept open in the PostgreSQL pool"),
+        "pg_max_overflow": (int, 10, "connections that can be opened beyond pg_pool_size under load"),
+        "pg_pool_timeout": (float, 30.0, "seconds to wait for a free PostgreSQL connection before failing"),
+        "pg_pool_recycle": (int, -1, "seconds after which a PostgreSQL connection is replaced (-1 = never)"),
+        "pg_pool_pre_ping": (_parse_bool, False, "test PostgreSQL connections when they are checked out"),
+        "pg_statement_timeout_ms": (int, 0, "server-side timeout of PostgreSQL statements (0 = no timeout)"),
+        "pg_echo": (_parse_bool, False, "log every SQL statement"),
+        "mongo_uri": (str, "mongodb://localhost:27017", "URI of the MongoDB deployment"),
+        "mongo_max_pool_size": (int, 100, "max connections of the Motor pool (per server)"),
+        "mongo_min_pool_size": (int, 0, "connections that the Motor pool keeps open (per server)"),
+        "mongo_read_preference": (str, "primary", f"one of {', '.join(READ_PREFERENCES)}"),
+    }
+
+    def __init__(self, **settings):
+        for name, (_, default, _) in DBSettings.SETTINGS.items():
+            setattr(self, name, settings.pop(name, default))
+        if settings:
+            raise ValueError(f"unknown DB settings: {', '.join(settings)}")
+        self.validate()
+
+    def validate(self):
+        errors = []
+        if self.pg_pool_size < 1:
+            errors.append("pg_pool_size must be >= 1")
+        if self.pg_max_overflow < 0:
+            errors.append("pg_max_overflow must be >= 0")
+        if self.pg_pool_timeout <= 0:
+            errors.append("pg_pool_timeout must be > 0")
+        if self.pg_pool_recycle < -1:
+            errors.append("pg_pool_recycle must be >= -1")
+        if self.pg_statement_timeout_ms < 0:
+            errors.append("pg_statement_timeout_ms must be >= 0")
+        if not self.mongo_uri.startswith(("mongodb://", "mongodb+srv://")):
+            errors.append("mongo_uri must start with mongodb:// or mongodb+srv://")
+        if self.mongo_max_pool_size < 1:
+            errors.append("mongo_max_pool_size must be >= 1")
+        if not 0 <= self.mongo_min_pool_size <= self.mongo_max_pool_size:
+            errors.append("mongo_min_pool_size must be between 0 and mongo_max_pool_size")
+        if self.mongo_read_preference not in READ_PREFERENCES:
+            errors.append(f"mongo_read_preference must be one of {', '.join(READ_PREFERENCES)}")
+        if errors:
+            raise ValueError("invalid DB settings: " + "; ".join(errors))
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in DBSettings.SETTINGS}
+
+
+def read_db_settings(file_path: str) -> DBSettings:
+    """
+    Reads the DB settings from file_path (a CSV file with a header line and one "setting_name,value" line per
+    setting; the file is optional) and from the environment, and validates them. Raises ValueError if any setting is
+    unknown or invalid.
+    """
+    raw_settings = dict()
+    try:
+        with open(file_path, mode='r') as f:
+            f.readline()
+            for line in f:
+                if line.strip():
+                    name, value = line.rstrip("\n").split(",", maxsplit=1)
+                    raw_settings[name.strip()] = value.strip()
+    except FileNotFoundError:
+        logger.info(f"{file_path} not found: DB settings are taken from defaults and environment")
+    for name in DBSettings.SETTINGS:
+        env_value = os.environ.get(f"COV2K_{name.upper()}")
+        if env_value is not None:
+            raw_settings[name] = env_value
+
+    settings = dict()
+    errors = []
+    for name, value in raw_settings.items():
+        if name not in DBSettings.SETTINGS:
+            errors.append(f"unknown setting {name}")
+            continue
+        parser = DBSettings.SETTINGS[name][0]
+        try:
+            settings[name] = parser(value)
+        except ValueError:
+            errors.append(f"{name}={value} is not a valid value")
+    if errors:
+        raise ValueError("invalid DB settings: " + "; ".join(errors))
+    db_settings = DBSettings(**settings)
+    # the URI is not logged because it can contain credentials
+    logged_settings = {k: v for k, v in db_settings.as_dict().items() if k != 'mongo_uri'}
+    logger.info(f"DB settings: {logged_settings}")
+    return db_settings
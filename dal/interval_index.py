@@ -0,0 +1,101 @@
+from bisect import bisect_right
+from heapq import heappush, heappop
+from typing import *
+
+
+class IntervalIndex:
+    """
+    Static index of closed integer intervals [start, stop], each associated with a value, answering
+     - stab(p): the values of the intervals containing position p,
+     - overlap(start, stop): the values of the intervals intersecting [start, stop],
+     - stab_many(positions): stab(p) for every p in positions, computed with a single sweep.
+    It is a centered interval tree: each node keeps the intervals containing its center, sorted by start and by stop,
+    and delegates the intervals entirely on the left/right of the center to its children.
+    Values are returned in the order the intervals were given to the constructor.
+    """
+
+    class _Node:
+        def __init__(self, intervals: List[Tuple[int, int, int]]):
+            # intervals are (start, stop, insertion_order) triples
+            endpoints = sorted(x for start, stop, _ in intervals for x in (start, stop))
+            self.center = endpoints[len(endpoints) // 2]
+            left, right, here = [], [], []
+            for interval in intervals:
+                if interval[1] < self.center:
+                    left.append(interval)
+                elif interval[0] > self.center:
+                    right.append(interval)
+                else:
+                    here.append(interval)
+            self.by_start = sorted(here, key=lambda x: x[0])
+            self.by_stop = sorted(here, key=lambda x: x[1], reverse=True)
+            self.left = IntervalIndex._Node(left) if left else None
+            self.right = IntervalIndex._Node(right) if right else None
+
+    def __init__(self, intervals: Iterable[Tuple[int, int, Any]]):
+        """
+        :param intervals: (start, stop, value) triples. Intervals with stop < start are ignored.
+        """
+        self._values = []
+        triples = []
+        for start, stop, value in intervals:
+            if stop >= start:
+                triples.append((start, stop, len(self._values)))
+                self._values.append(value)
+        self._root = IntervalIndex._Node(triples) if triples else None
+        # intervals sorted by start, for overlap() and stab_many()
+        self._sorted_by_start = sorted(triples, key=lambda x: x[0])
+        self._starts = [x[0] for x in self._sorted_by_start]
+
+    def __len__(self):
+        return len(self._values)
+
+    def _stab(self, position: int) -> List[int]:
+        matches = []
+        node = self._root
+        while node is not None:
+            if position < node.center:
+                for start, _, order in node.by_start:
+                    if start > position:
+                        break
+                    matches.append(order)
+                node = node.left
+            elif position > node.center:
+                for _, stop, order in node.by_stop:
+                    if stop < position:
+                        break
+                    matches.append(order)
+                node = node.right
+            else:
+                matches.extend(order for _, _, order in node.by_start)
+                break
+        return sorted(matches)
+
+    def stab(self, position: int) -> list:
+        return [self._values[order] for order in self._stab(position)]
+
+    def overlap(self, start: int, stop: int) -> list:
+        # the intervals intersecting [start, stop] either contain start or begin in (start, stop]
+        orders = set(self._stab(start))
+        first, last = bisect_right(self._starts, start), bisect_right(self._starts, stop)
+        orders.update(order for _, _, order in self._sorted_by_start[first:last])
+        return [self._values[order] for order in sorted(orders)]
+
+    def stab_many(self, positions: Iterable[int]) -> Dict[int, list]:
+        """
+        Returns a dictionary mapping each of the given positions to the values of the intervals containing it.
+        Positions and intervals are swept together in increasing order, so the cost is linear in their number (plus
+        sorting) rather than one tree descent per position.
+        """
+        result = dict()
+        active = []     # heap of (stop, order) of the intervals started before the current position
+        next_interval = 0
+        for position in sorted(set(positions)):
+            while next_interval < len(self._starts) and self._starts[next_interval] <= position:
+                _, stop, order = self._sorted_by_start[next_interval]
+                heappush(active, (stop, order))
+                next_interval += 1
+            while active and active[0][0] < position:
+                heappop(active)
+            result[position] = [self._values[order] for order in sorted(order for _, order in active)]
+        return result
@@ -0,0 +1,61 @@
+from typing import *
+
+from loguru import logger
+
+from dal.interval_index import IntervalIndex
+from dal.kb_beanie.model import Structure
+from dal.kb_beanie.projections import NucAnnotationProjection
+from dal.kb_beanie.raw_projection import find_raw
+
+
+class NucAnnotationIndex:
+    """
+    In-memory copy of the Nuc Annotations of the KB (the Structure collection), indexed by id and by the interval of
+    the reference genome that they cover.
+    """
+
+    def __init__(self, annotations: List[dict]):
+        self._annotation_of_id = {x["nuc_annotation_id"]: x for x in annotations}
+        self._intervals = IntervalIndex((x["start_on_ref"], x["stop_on_ref"], x) for x in annotations)
+
+    def __len__(self):
+        return len(self._annotation_of_id)
+
+    def annotation(self, nuc_annotation_id: str) -> Optional[dict]:
+        annotation = self._annotation_of_id.get(nuc_annotation_id)
+        return dict(annotation) if annotation else None
+
+    def containing(self, position: int) -> List[dict]:
+        """
+        Returns the annotations whose interval contains the given genome position.
+        """
+        return [dict(x) for x in self._intervals.stab(position)]
+
+    def containing_any(self, positions: Iterable[int]) -> List[dict]:
+        """
+        Returns the annotations whose interval contains at least one of the given genome positions (without
+        duplicates).
+        """
+        annotations = dict()
+        for annotations_of_position in self._intervals.stab_many(positions).values():
+            for x in annotations_of_position:
+                annotations[x["nuc_annotation_id"]] = x
+        return [dict(x) for x in annotations.values()]
+
+
+_nuc_annotation_index: Optional[NucAnnotationIndex] = None
+
+
+async def load_nuc_annotation_index():
+    """
+    Builds the index of the Nuc Annotations from the Structure collection. Call it at startup and whenever the KB
+    changes (see KBCache.on_refresh).
+    """
+    global _nuc_annotation_index
+    annotations = await find_raw(Structure, NucAnnotationProjection, {})
+    _nuc_annotation_index = NucAnnotationIndex(annotations)
+    logger.info(f'Nuc annotation index loaded: {len(_nuc_annotation_index)} annotations')
+
+
+def get_nuc_annotation_index() -> NucAnnotationIndex:
+    return _nuc_annotation_index
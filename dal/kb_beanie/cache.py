@@ -0,0 +1,147 @@
+import asyncio
+import functools
+import inspect
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import *
+
+from loguru import logger
+from pymongo.errors import OperationFailure
+
+from dal.kb_beanie.model import KB_DOCUMENT_MODELS
+
+
+class KBCache:
+    """
+    Read-through cache of the results of the queries on the knowledge base (KB). The KB is small, curated and changes
+    rarely, so the results of the queries are kept in memory and tagged with the version of the KB they were computed
+    from. When refresh() detects a new KB version, the whole cache is swapped with an empty one at once, so that
+    results of different KB versions are never mixed.
+    """
+
+    def __init__(self, max_entries: int = 8192):
+        self.max_entries = max_entries
+        self.version: Optional[str] = None
+        self._entries: OrderedDict = OrderedDict()
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_callbacks: List[Callable[[], Awaitable]] = []
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[tuple]:
+        try:
+            result = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result: tuple, version: Optional[str]):
+        # a result computed from a KB version that was replaced in the meantime is discarded
+        if version != self.version:
+            return
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def on_refresh(self, callback: Callable[[], Awaitable]):
+        """
+        Registers an async function that rebuilds some in-memory structure derived from the KB. The callbacks run at
+        every refresh that replaces the cache, before the new cache is made available.
+        """
+        self._refresh_callbacks.append(callback)
+
+    async def refresh(self, force: bool = False) -> bool:
+        """
+        Reads the current version of the KB and, if it differs from the cached one (or force is True), atomically
+        replaces the cache content with an empty one. Returns True if the cache was replaced.
+        """
+        async with self._refresh_lock:
+            new_version = await read_kb_version()
+            if new_version == self.version and not force:
+                return False
+            for callback in self._refresh_callbacks:
+                await callback()
+            self._entries = OrderedDict()
+            self.version = new_version
+            logger.info(f"KB cache reset to KB version {new_version}")
+            return True
+
+    def stats(self) -> dict:
+        return {
+            "kb_version": self.version,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+async def read_kb_version() -> str:
+    """
+    Returns a fingerprint of the content of the KB collections. It uses the dbHash command (an md5 of each collection)
+    and falls back to the number of documents in each collection where dbHash is not available (e.g., on mongos).
+    """
+    database = KB_DOCUMENT_MODELS[0].get_motor_collection().database
+    collection_names = [model.get_motor_collection().name for model in KB_DOCUMENT_MODELS]
+    try:
+        result = await database.command("dbHash", collections=collection_names)
+        return result["md5"]
+    except OperationFailure:
+        counts = [str(await model.get_motor_collection().estimated_document_count()) for model in KB_DOCUMENT_MODELS]
+        return "counts-" + "-".join(counts)
+
+
+kb_cache = KBCache()
+
+
+def _cache_key_value(value):
+    # requests are identified by the path they target (e.g. /aa_residues_ref vs /aa_residues_alt)
+    if hasattr(value, "url"):
+        return "url", value.url.path
+    # the batch queries (*_by_*_ids) return the same rows whatever the order of the ids
+    if isinstance(value, (list, set)):
+        return tuple(sorted(value))
+    if isinstance(value, tuple):
+        return value
+    return value
+
+
+def _frozen(value):
+    # read-only view of a result, shared by all the callers: dicts become mappingproxy and lists become tuples
+    if isinstance(value, dict):
+        return MappingProxyType({k: _frozen(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen(x) for x in value)
+    return value
+
+
+def kb_cached(function: Callable):
+    """
+    Decorates an async query function that reads only the KB, so that its results are served by kb_cache.
+    The cache key is made of the function name and of the values of all its arguments (defaults included).
+    The result is cached and returned as a tuple of read-only rows (mappingproxy, with tuples in place of lists),
+    shared by all the callers without copies: a caller that needs to modify the rows must copy them first.
+    """
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        bound_args = signature.bind(*args, **kwargs)
+        bound_args.apply_defaults()
+        key = (function.__name__, tuple((name, _cache_key_value(value))
+                                        for name, value in bound_args.arguments.items()))
+        result = kb_cache.get(key)
+        if result is not None:
+            return result
+        version = kb_cache.version
+        result = await function(*args, **kwargs)
+        if isinstance(result, (list, tuple)):
+            result = _frozen(result)
+            kb_cache.put(key, result, version)
+        return result
+
+    return wrapper
@@ -0,0 +1,119 @@
+from collections import defaultdict
+from typing import *
+
+from loguru import logger
+
+from dal.kb_beanie.model import Variant, Rule
+from dal.kb_beanie.projections import RuleProjection
+from dal.kb_beanie.raw_projection import find_raw
+from dal.kb_beanie.trigram_index import TrigramIndex
+
+
+class ContextIndex:
+    """
+    In-memory copy of the Contexts of the KB. A Context is a pair (variant, organization) taken from the
+    characterizations of the variants (org_2_aa_changes and org_2_nuc_changes), identified by
+    <variant_id>_<organization>. The KB doesn't store them: the index holds each Context with the changes that the
+    organization assigns to the variant and with the rules of the organization, and indexes them by every filter of
+    the /contexts endpoint. The descriptions of the rules are searched through a TrigramIndex.
+    """
+
+    def __init__(self, variants: Iterable[dict], rules: Iterable[dict]):
+        rules = list(rules)
+        self._rules: List[Optional[str]] = [rule["rule"] for rule in rules]
+        self._rule_search = TrigramIndex(self._rules)
+        self._rules_of_owner: Dict[str, List[int]] = defaultdict(list)
+        for i, rule in enumerate(rules):
+            self._rules_of_owner[rule["owner"]].append(i)
+        self._owner_of_context: Dict[str, str] = dict()
+        self._aa_changes_of_context: Dict[str, List[str]] = defaultdict(list)
+        self._nuc_changes_of_context: Dict[str, List[str]] = defaultdict(list)
+        self._contexts_of_variant: Dict[str, Set[str]] = defaultdict(set)
+        self._contexts_of_owner: Dict[str, Set[str]] = defaultdict(set)
+        self._contexts_of_aa_change: Dict[str, Set[str]] = defaultdict(set)
+        self._contexts_of_nuc_change: Dict[str, Set[str]] = defaultdict(set)
+        for variant in variants:
+            variant_id = str(variant["_id"])
+            for characterizations, changes_of_context, contexts_of_change in (
+                    (variant.get("org_2_aa_changes") or [], self._aa_changes_of_context, self._contexts_of_aa_change),
+                    (variant.get("org_2_nuc_changes") or [], self._nuc_changes_of_context,
+                     self._contexts_of_nuc_change)):
+                for characterization in characterizations:
+                    owner = characterization["org"]
+                    context_id = f"{variant_id}_{owner}"
+                    self._owner_of_context[context_id] = owner
+                    self._contexts_of_variant[variant_id].add(context_id)
+                    self._contexts_of_owner[owner].add(context_id)
+                    for change in characterization["changes"]:
+                        changes_of_context[context_id].append(change)
+                        contexts_of_change[change].add(context_id)
+
+    def __len__(self):
+        return len(self._owner_of_context)
+
+    def __contains__(self, context_id: str):
+        return context_id in self._owner_of_context
+
+    def context_ids(self, variant_id: Optional[str] = None, aa_positional_change_id: Optional[str] = None,
+                    nuc_positional_mutation_id: Optional[str] = None, owner: Optional[str] = None) -> Set[str]:
+        """
+        Returns the ids of the Contexts matching all the given filters (all the Contexts if no filter is given).
+        """
+        context_ids = None
+        for value, contexts_of_value in ((variant_id, self._contexts_of_variant),
+                                         (aa_positional_change_id, self._contexts_of_aa_change),
+                                         (nuc_positional_mutation_id, self._contexts_of_nuc_change),
+                                         (owner, self._contexts_of_owner)):
+            if value:
+                matching = contexts_of_value.get(value, set())
+                context_ids = set(matching) if context_ids is None else context_ids & matching
+        return set(self._owner_of_context) if context_ids is None else context_ids
+
+    def contexts(self, context_ids: Iterable[str], rule_description: Optional[str] = None) -> List[dict]:
+        """
+        Returns the given Contexts sorted by context_id, as one {"context_id", "owner", "rule_description"} for every
+        rule of the owner (Contexts whose owner has no rules are omitted). If rule_description is given, only the rules
+        containing it (as literal text, ignoring the case) are returned, sorted by rank (see TrigramIndex.search) and
+        then by context_id.
+        """
+        rank_of_rule = self._rule_search.search(rule_description) if rule_description else None
+        ranked_result = []
+        for context_id in sorted(context_ids):
+            owner = self._owner_of_context.get(context_id)
+            if owner is None:
+                continue
+            for i in self._rules_of_owner.get(owner, ()):
+                if rank_of_rule is None:
+                    ranked_result.append((None, context_id, owner, i))
+                elif i in rank_of_rule:
+                    ranked_result.append((rank_of_rule[i], context_id, owner, i))
+        if rank_of_rule is not None:
+            ranked_result.sort(key=lambda x: x[0])
+        return [{"context_id": context_id, "owner": owner, "rule_description": self._rules[i]}
+                for _, context_id, owner, i in ranked_result]
+
+    def aa_changes_of(self, context_id: str) -> List[str]:
+        return list(self._aa_changes_of_context.get(context_id, ()))
+
+    def nuc_changes_of(self, context_id: str) -> List[str]:
+        return list(self._nuc_changes_of_context.get(context_id, ()))
+
+
+_context_index: Optional[ContextIndex] = None
+
+
+async def load_context_index():
+    """
+    Builds the index of the Contexts from the Variant and Rule collections. Call it at startup and whenever the KB
+    changes (see KBCache.on_refresh).
+    """
+    global _context_index
+    variants = await Variant.get_motor_collection().find({}, {"org_2_aa_changes": 1, "org_2_nuc_changes": 1})\
+        .to_list(length=None)
+    rules = await find_raw(Rule, RuleProjection, {})
+    _context_index = ContextIndex(variants, rules)
+    logger.info(f'Context index loaded: {len(_context_index)} contexts')
+
+
+def get_context_index() -> ContextIndex:
+    return _context_index
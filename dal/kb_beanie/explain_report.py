@@ -0,0 +1,170 @@
+"""
+Reports how MongoDB executes the queries of the KB endpoints, and flags the ones that scan a whole collection.
+Every KB query function of queries.py is called with one filter at a time (the values are taken from the KB
+itself), the find and aggregate commands that it sends are captured, and each of them is explained with
+verbosity executionStats. A command is flagged if any stage of its plan, including the collections joined by
+$lookup stages, is a COLLSCAN. Run it from the root of the project, with the same connection parameters of the API:
+    python -m dal.kb_beanie.explain_report
+The exit status is 1 if at least one command scans a collection.
+"""
+import asyncio
+import sys
+from os.path import sep
+from typing import *
+
+from loguru import logger
+from pymongo.monitoring import CommandListener
+
+import queries
+from dal.db_settings import read_db_settings
+from dal.kb_beanie.annotation_index import load_nuc_annotation_index
+from dal.kb_beanie.context_index import load_context_index
+from dal.kb_beanie.model import init_db_model, read_mongodb_connection_parameters, Variant, Effect, EffectSource, \
+    Structure, AAResidue
+
+EXPLAINED_COMMANDS = ("find", "aggregate")
+
+
+class CommandRecorder(CommandListener):
+    """
+    Records the find and aggregate commands sent to MongoDB while it is recording.
+    """
+
+    def __init__(self):
+        self.recording = False
+        self.commands: List[dict] = []
+
+    def started(self, event):
+        if self.recording and event.command_name in EXPLAINED_COMMANDS:
+            # session, cluster time and read preference fields can't be passed to explain
+            self.commands.append({k: v for k, v in event.command.items() if not k.startswith("$") and k != "lsid"})
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def read_sample_values() -> Dict[str, Any]:
+    """
+    Returns a value for each filter of the KB endpoints, taken from existing documents.
+    """
+    variant = await Variant.get_motor_collection().find_one({"org_2_aa_changes.changes.0": {"$exists": True},
+                                                             "effects.0": {"$exists": True}})
+    org_2_aa_changes = variant["org_2_aa_changes"][0]
+    nuc_variant = await Variant.get_motor_collection().find_one({"org_2_nuc_changes.changes.0": {"$exists": True}})
+    aa_change_group = await Effect.get_motor_collection().find_one({"aa_changes.1": {"$exists": True}})
+    evidence = await EffectSource.get_motor_collection().find_one({"effect_ids.0": {"$exists": True}})
+    structure = await Structure.get_motor_collection().find_one({"protein_characterization.0": {"$exists": True}})
+    aa_residue = await AAResidue.get_motor_collection().find_one({})
+    return {
+        "variant_id": variant["_id"],
+        "naming_id": variant["aliases"][0]["name"],
+        "organization": variant["aliases"][0]["org"],
+        "effect_id": str(variant["effects"][0]),
+        "context_id": f"{variant['_id']}_{org_2_aa_changes['org']}",
+        "owner": org_2_aa_changes["org"],
+        "aa_positional_change_id": org_2_aa_changes["changes"][0],
+        "nuc_positional_mutation_id": nuc_variant["org_2_nuc_changes"][0]["changes"][0] if nuc_variant else "A1G",
+        "aa_change_group_id": str(aa_change_group["_id"]) if aa_change_group else str(variant["effects"][0]),
+        "evidence_id": str(evidence["_id"]),
+        "nuc_annotation_id": structure["annotation_id"],
+        "protein_id": structure["protein_characterization"][0]["protein_name"],
+        "position": 1,
+        "aa_residue_id": aa_residue["residue"],
+    }
+
+
+# KB query functions of queries.py and the filters each of them is called with (one at a time)
+FILTERS_OF_FUNCTION = {
+    "get_variants": ["naming_id", "effect_id", "context_id"],
+    "get_variant": ["variant_id"],
+    "get_namings": ["variant_id", "organization"],
+    "get_naming": ["naming_id"],
+    "get_contexts": ["variant_id", "aa_positional_change_id", "nuc_positional_mutation_id", "owner"],
+    "get_context": ["context_id"],
+    "get_effects": ["variant_id", "aa_positional_change_id", "evidence_id", "aa_change_group_id"],
+    "get_effect": ["effect_id"],
+    "get_evidences": ["effect_id"],
+    "get_evidence": ["evidence_id"],
+    "get_nuc_positional_mutations": ["context_id", "nuc_annotation_id", "position"],
+    "get_nuc_positional_mutation": ["nuc_positional_mutation_id"],
+    "get_aa_positional_changes": ["context_id", "effect_id", "protein_id", "aa_change_group_id", "position"],
+    "get_aa_positional_change": ["aa_positional_change_id"],
+    "get_aa_change_groups": ["aa_positional_change_id", "effect_id"],
+    "get_aa_change_group": ["aa_change_group_id"],
+    "get_nuc_annotations": ["protein_id"],
+    "get_proteins": ["nuc_annotation_id"],
+    "get_protein_regions": ["protein_id"],
+    "get_aa_residue": ["aa_residue_id"],
+}
+
+
+def collection_scans(explain_output) -> List[str]:
+    """
+    Returns the namespaces (or stages) scanned as a whole according to an explain output, searching the nested plans
+    and the $lookup statistics.
+    """
+    scans = []
+    if isinstance(explain_output, dict):
+        if explain_output.get("stage") == "COLLSCAN":
+            scans.append(explain_output.get("namespace") or "COLLSCAN")
+        if "$lookup" in explain_output and explain_output.get("collectionScans", 0) > 0:
+            scans.append(f"$lookup from {explain_output['$lookup'].get('from')}")
+        for value in explain_output.values():
+            scans.extend(collection_scans(value))
+    elif isinstance(explain_output, list):
+        for value in explain_output:
+            scans.extend(collection_scans(value))
+    return scans
+
+
+async def explain_report(database, recorder: CommandRecorder) -> int:
+    """
+    Prints one line for each command sent by the KB query functions and returns the number of commands scanning a
+    collection.
+    """
+    sample_values = await read_sample_values()
+    n_scanning_commands = 0
+    for function_name, filters in FILTERS_OF_FUNCTION.items():
+        function = getattr(queries, function_name)
+        function = getattr(function, "__wrapped__", function)   # bypasses the KB cache
+        for query_param in filters:
+            call = f"{function_name}({query_param}={sample_values[query_param]!r})"
+            recorder.commands = []
+            recorder.recording = True
+            try:
+                await function(**{query_param: sample_values[query_param]})
+            except Exception as e:
+                print(f"ERROR    {call}: {e!r}")
+                continue
+            finally:
+                recorder.recording = False
+            for command in recorder.commands:
+                explain_output = await database.command({"explain": command, "verbosity": "executionStats"})
+                scans = collection_scans(explain_output)
+                command_name = next(iter(command))
+                if scans:
+                    n_scanning_commands += 1
+                    print(f"COLLSCAN {call}: {command_name} {command[command_name]} scans {', '.join(scans)}")
+                else:
+                    print(f"ok       {call}: {command_name} {command[command_name]}")
+    return n_scanning_commands
+
+
+async def _main():
+    kb_db_name = read_mongodb_connection_parameters(f".{sep}mongodb_conn_params.csv")
+    db_settings = read_db_settings(f".{sep}db_settings.csv")
+    recorder = CommandRecorder()
+    await init_db_model(kb_db_name, db_settings, event_listeners=[recorder])
+    await load_nuc_annotation_index()
+    await load_context_index()
+    database = Variant.get_motor_collection().database
+    n_scanning_commands = await explain_report(database, recorder)
+    logger.info(f"{n_scanning_commands} commands scan a collection")
+    sys.exit(1 if n_scanning_commands else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,102 @@
+from typing import *
+
+import numpy as np
+from loguru import logger
+
+
+class GranthamMatrix:
+    """
+    Precomputed table of the Aa Residue Changes, i.e. of every ordered pair of distinct amino acid residues with their
+    Grantham distance, sorted by aa_residue_change_id. Filters are evaluated as vectorised boolean masks over the
+    reference, alternative and distance columns of the table.
+    """
+    RADICAL_THRESHOLD = 66
+
+    def __init__(self, residues: List[str], distances: np.ndarray):
+        """
+        :param residues: the one-letter residue names, in the order of the rows/columns of distances.
+        :param distances: a symmetric square matrix of Grantham distances (the diagonal is ignored).
+        """
+        changes = sorted((ref + alt, i, j) for i, ref in enumerate(residues) for j, alt in enumerate(residues)
+                         if i != j)
+        self.references = np.array([i for _, i, _ in changes], dtype=np.int8)
+        self.alternatives = np.array([j for _, _, j in changes], dtype=np.int8)
+        self.distances = np.array([distances[i, j] for _, i, j in changes], dtype=np.int16)
+        self.radical = self.distances >= GranthamMatrix.RADICAL_THRESHOLD
+        self._residue_index = {residue: i for i, residue in enumerate(residues)}
+        self._change_index = {change_id: position for position, (change_id, _, _) in enumerate(changes)}
+        self._changes = [{
+            "aa_residue_change_id": change_id,
+            "reference": residues[i],
+            "alternative": residues[j],
+            "grantham_distance": int(distances[i, j]),
+            "type": "radical" if distances[i, j] >= GranthamMatrix.RADICAL_THRESHOLD else "conservative"
+        } for change_id, i, j in changes]
+
+    @classmethod
+    def from_csv(cls, file_path: str):
+        """
+        Reads the upper triangular matrix of assets/grantham_distance.csv: the header lists the residues of the
+        columns, every other line lists the distances of the residue named in its last field.
+        """
+        with open(file_path, mode='r') as f:
+            column_residues = f.readline().rstrip().rstrip(';').split(';')
+            rows = [line.rstrip().split(';') for line in f if line.strip()]
+        row_residues = [row[-1] for row in rows]
+        residues = sorted(set(column_residues) | set(row_residues))
+        index = {residue: i for i, residue in enumerate(residues)}
+        distances = np.zeros((len(residues), len(residues)), dtype=np.int16)
+        for row in rows:
+            i = index[row[-1]]
+            for column_residue, value in zip(column_residues, row[:-1]):
+                if value:
+                    j = index[column_residue]
+                    distances[i, j] = distances[j, i] = int(value)
+        return cls(residues, distances)
+
+    def __len__(self):
+        return len(self._changes)
+
+    def change(self, aa_residue_change_id: str) -> Optional[dict]:
+        position = self._change_index.get(aa_residue_change_id)
+        return dict(self._changes[position]) if position is not None else None
+
+    def changes(self, reference: Optional[str] = None, alternative: Optional[str] = None,
+                grantham_distance: Optional[int] = None, min_grantham_distance: Optional[int] = None,
+                max_grantham_distance: Optional[int] = None, radical: Optional[bool] = None) -> List[dict]:
+        """
+        Returns the changes (sorted by aa_residue_change_id) that satisfy all the given conditions.
+        Residues not in the matrix match no change.
+        """
+        mask = np.ones(len(self._changes), dtype=bool)
+        for residue, column in ((reference, self.references), (alternative, self.alternatives)):
+            if residue is not None:
+                residue_index = self._residue_index.get(residue)
+                if residue_index is None:
+                    return []
+                mask &= column == residue_index
+        if grantham_distance is not None:
+            mask &= self.distances == grantham_distance
+        if min_grantham_distance is not None:
+            mask &= self.distances >= min_grantham_distance
+        if max_grantham_distance is not None:
+            mask &= self.distances <= max_grantham_distance
+        if radical is not None:
+            mask &= self.radical if radical else ~self.radical
+        return [dict(self._changes[position]) for position in np.flatnonzero(mask)]
+
+
+_grantham_matrix: Optional[GranthamMatrix] = None
+
+
+def load_grantham_matrix(file_path: str):
+    """
+    Call this method once to build the table of Aa Residue Changes from the Grantham distance CSV.
+    """
+    global _grantham_matrix
+    _grantham_matrix = GranthamMatrix.from_csv(file_path)
+    logger.info(f'Grantham matrix loaded: {len(_grantham_matrix)} aa residue changes')
+
+
+def get_grantham_matrix() -> GranthamMatrix:
+    return _grantham_matrix
@@ -0,0 +1,195 @@
+from typing import *
+
+import numpy as np
+from bson import ObjectId
+from bson.errors import InvalidId
+from loguru import logger
+
+from dal.kb_beanie.model import Variant, Effect, EffectSource, NUCChange, AAChange, Rule
+
+
+class _Adjacency:
+    """
+    Compressed sparse row adjacency from n_nodes source nodes: the neighbours of node i are
+    indices[indptr[i]:indptr[i + 1]], sorted and without repetitions.
+    """
+
+    def __init__(self, n_nodes: int, sources: np.ndarray, targets: np.ndarray):
+        edges = np.unique(np.stack((sources, targets), axis=1), axis=0) if len(sources) \
+            else np.empty((0, 2), dtype=np.int64)
+        self.indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edges[:, 0], minlength=n_nodes), out=self.indptr[1:])
+        self.indices = edges[:, 1].astype(np.int32)
+
+    def neighbours(self, nodes: np.ndarray) -> np.ndarray:
+        """
+        Returns the distinct neighbours of the given nodes, sorted.
+        """
+        starts = self.indptr[nodes]
+        lengths = self.indptr[nodes + 1] - starts
+        n_neighbours = int(lengths.sum())
+        if n_neighbours == 0:
+            return np.empty(0, dtype=np.int32)
+        # position of each neighbour in indices: the start of its node plus its offset from there
+        offsets = np.arange(n_neighbours) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return np.unique(self.indices[np.repeat(starts, lengths) + offsets])
+
+
+def _object_id(value: str) -> str:
+    if not ObjectId.is_valid(value):
+        raise InvalidId(f"{value!r} is not a valid ObjectId")
+    return str(ObjectId(value))
+
+
+class _NodeType:
+    def __init__(self, ids: Iterable[str]):
+        self.ids: List[str] = sorted(set(ids))
+        self.index_of_id: Dict[str, int] = {x: i for i, x in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class _Relationship:
+    """
+    Edges between the nodes of two types, stored as a CSR adjacency in each direction.
+    """
+
+    def __init__(self, source_type: _NodeType, target_type: _NodeType, edges: Iterable[Tuple[str, str]]):
+        self.source_type = source_type
+        self.target_type = target_type
+        sources, targets = [], []
+        for source_id, target_id in edges:
+            source = source_type.index_of_id.get(source_id)
+            target = target_type.index_of_id.get(target_id)
+            if source is not None and target is not None:
+                sources.append(source)
+                targets.append(target)
+        sources = np.array(sources, dtype=np.int64)
+        targets = np.array(targets, dtype=np.int64)
+        self.forward = _Adjacency(len(source_type), sources, targets)
+        self.backward = _Adjacency(len(target_type), targets, sources)
+        self.n_edges = len(self.forward.indices)
+
+
+class KBGraph:
+    """
+    In-memory graph of the relationships between the entities of the KB that are stored as arrays of ids inside the
+    documents (Variant.effects, EffectSource.effect_ids, and the changes that each organization assigns to a variant,
+    i.e. the Contexts). Each node type holds the ids of the existing instances of an entity, and each relationship is
+    a CSR adjacency in both directions, so the ids related to a set of ids are found with array operations instead of
+    a query. Every characterization is a Context node, as the context_id filters of /variants,
+    /aa_positional_changes and /nuc_positional_mutations accept any of them, but the ids of Contexts are returned only
+    for the Contexts whose owner has some rule, as in /contexts.
+    """
+
+    # (entity, query parameter) -> (relationship, direction): the ids of the instances of entity filtered by the query
+    # parameter. Entity names and query parameters are the ones of the API.
+    _relationship_of_entity_and_param = {
+        ('effects', 'variant_id'): ('variant_effect', 'forward'),
+        ('variants', 'effect_id'): ('variant_effect', 'backward'),
+        ('effects', 'evidence_id'): ('evidence_effect', 'forward'),
+        ('evidences', 'effect_id'): ('evidence_effect', 'backward'),
+        ('contexts', 'variant_id'): ('variant_context', 'forward'),
+        ('variants', 'context_id'): ('variant_context', 'backward'),
+        ('aa_positional_changes', 'context_id'): ('context_aa_change', 'forward'),
+        ('contexts', 'aa_positional_change_id'): ('context_aa_change', 'backward'),
+        ('nuc_positional_mutations', 'context_id'): ('context_nuc_change', 'forward'),
+        ('contexts', 'nuc_positional_mutation_id'): ('context_nuc_change', 'backward'),
+    }
+
+    # values of the query parameters are normalized as the query functions do
+    _normalize_of_param = {
+        'variant_id': str.upper,
+        'context_id': str.upper,
+        'aa_positional_change_id': str.upper,
+        'nuc_positional_mutation_id': str.upper,
+        'effect_id': _object_id,
+        'evidence_id': _object_id,
+    }
+
+    def __init__(self, variants: List[dict], effect_ids: Iterable[str], evidences: List[dict],
+                 aa_change_ids: Iterable[str], nuc_change_ids: Iterable[str], rule_owners: Iterable[str]):
+        variant_context, context_aa_change, context_nuc_change = [], [], []
+        owner_of_context = dict()
+        for variant in variants:
+            variant_id = str(variant["_id"])
+            for characterizations, context_change in ((variant.get("org_2_aa_changes") or [], context_aa_change),
+                                                      (variant.get("org_2_nuc_changes") or [], context_nuc_change)):
+                for characterization in characterizations:
+                    context_id = f"{variant_id}_{characterization['org']}"
+                    owner_of_context[context_id] = characterization["org"]
+                    variant_context.append((variant_id, context_id))
+                    context_change.extend((context_id, change) for change in characterization["changes"])
+        variant_type = _NodeType(str(x["_id"]) for x in variants)
+        effect_type = _NodeType(effect_ids)
+        evidence_type = _NodeType(str(x["_id"]) for x in evidences)
+        context_type = _NodeType(context_id for _, context_id in variant_context)
+        rule_owners = set(rule_owners)
+        self._context_type = context_type
+        self._context_has_rules = np.array([owner_of_context[x] in rule_owners for x in context_type.ids], dtype=bool)
+        aa_change_type = _NodeType(aa_change_ids)
+        nuc_change_type = _NodeType(nuc_change_ids)
+        self._relationships: Dict[str, _Relationship] = {
+            'variant_effect': _Relationship(variant_type, effect_type,
+                                            ((str(x["_id"]), str(effect_id))
+                                             for x in variants for effect_id in x.get("effects") or ())),
+            'evidence_effect': _Relationship(evidence_type, effect_type,
+                                             ((str(x["_id"]), str(effect_id))
+                                              for x in evidences for effect_id in x.get("effect_ids") or ())),
+            'variant_context': _Relationship(variant_type, context_type, variant_context),
+            'context_aa_change': _Relationship(context_type, aa_change_type, context_aa_change),
+            'context_nuc_change': _Relationship(context_type, nuc_change_type, context_nuc_change),
+        }
+
+    def n_edges(self) -> int:
+        return sum(x.n_edges for x in self._relationships.values())
+
+    def has_relationship(self, entity_name: str, query_param: str) -> bool:
+        return (entity_name, query_param) in self._relationship_of_entity_and_param
+
+    def related_ids(self, entity_name: str, query_param: str, values: Iterable[str]) -> List[str]:
+        """
+        Returns the sorted ids of the instances of entity_name matching query_param=v for any v in values, i.e. the ids
+        of the results of the corresponding endpoint repeated for every value. Values that aren't the id of an
+        instance are ignored. Check has_relationship(entity_name, query_param) first.
+        Raises InvalidId if query_param is an ObjectId and a value is not.
+        """
+        values = [self._normalize_of_param[query_param](str(x)) for x in values]
+        relationship_name, direction = self._relationship_of_entity_and_param[(entity_name, query_param)]
+        relationship = self._relationships[relationship_name]
+        if direction == 'forward':
+            adjacency, from_type, to_type = relationship.forward, relationship.source_type, relationship.target_type
+        else:
+            adjacency, from_type, to_type = relationship.backward, relationship.target_type, relationship.source_type
+        nodes = np.array(sorted({from_type.index_of_id[x] for x in values if x in from_type.index_of_id}),
+                         dtype=np.int64)
+        neighbours = adjacency.neighbours(nodes)
+        if to_type is self._context_type:
+            neighbours = neighbours[self._context_has_rules[neighbours]]
+        return [to_type.ids[i] for i in neighbours]
+
+
+_kb_graph: Optional[KBGraph] = None
+
+
+async def load_kb_graph():
+    """
+    Builds the graph of the KB relationships from the Variant, Effect, EffectSource, NUCChange, AAChange and Rule
+    collections, and replaces the previous one as a whole. Call it at startup and whenever the KB changes (see
+    KBCache.on_refresh).
+    """
+    global _kb_graph
+    variants = await Variant.get_motor_collection()\
+        .find({}, {"effects": 1, "org_2_aa_changes": 1, "org_2_nuc_changes": 1}).to_list(length=None)
+    effect_ids = [str(x) for x in await Effect.get_motor_collection().distinct("_id")]
+    evidences = await EffectSource.get_motor_collection().find({}, {"effect_ids": 1}).to_list(length=None)
+    aa_change_ids = await AAChange.get_motor_collection().distinct("change_id")
+    nuc_change_ids = await NUCChange.get_motor_collection().distinct("change_id")
+    rule_owners = await Rule.get_motor_collection().distinct("owner")
+    _kb_graph = KBGraph(variants, effect_ids, evidences, aa_change_ids, nuc_change_ids, rule_owners)
+    logger.info(f'KB graph loaded: {_kb_graph.n_edges()} relationships')
+
+
+def get_kb_graph() -> Optional[KBGraph]:
+    return _kb_graph
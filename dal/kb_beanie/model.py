@@ -1,8 +1,13 @@
+import threading
 from typing import *
 from pydantic import Field, BaseModel
 from beanie import Document, init_beanie, PydanticObjectId
 import motor
 from loguru import logger
+from pymongo import ASCENDING
+from pymongo.monitoring import ConnectionPoolListener
+
+from dal.db_settings import DBSettings
 
 
 class Alias(BaseModel):
@@ -27,6 +32,7 @@ class Variant(Document):
 
     class Collection:
         name = "variant"
+        indexes = ["aliases.name", "aliases.org", "effects", "org_2_aa_changes.changes", "org_2_nuc_changes.changes"]
 
 
 class Effect(Document):
@@ -38,6 +44,7 @@ class Effect(Document):
 
     class Collection:
         name = "effect"
+        indexes = ["aa_changes", "aa_change_groups"]
 
 
 class NUCChange(Document):
@@ -51,6 +58,7 @@ class NUCChange(Document):
 
     class Collection:
         name = "nuc_change"
+        indexes = ["change_id", "pos"]
 
 
 class AAChange(NUCChange):
@@ -58,6 +66,7 @@ class AAChange(NUCChange):
 
     class Collection:
         name = "aa_change"
+        indexes = ["change_id", [("protein", ASCENDING), ("pos", ASCENDING)], "pos"]
 
 
 class EffectSource(Document):
@@ -69,6 +78,7 @@ class EffectSource(Document):
 
     class Collection:
         name = "evidence"
+        indexes = ["effect_ids"]
 
 
 class ProteinCharacterization(BaseModel):
@@ -85,6 +95,7 @@ class Structure(Document):
 
     class Collection:
         name = "structure"
+        indexes = ["protein_characterization.protein_name"]
 
 
 class ProteinRegion(Document):
@@ -96,6 +107,7 @@ class ProteinRegion(Document):
 
     class Collection:
         name = "protein_region"
+        indexes = ["protein_name"]
 
 
 class GranthamDistance(BaseModel):
@@ -118,6 +130,7 @@ class AAResidue(Document):
 
     class Collection:
         name = "aa_residue"
+        indexes = ["residue"]
 
 
 class Rule(Document):
@@ -126,20 +139,120 @@ class Rule(Document):
 
     class Collection:
         name = "rule"
+        indexes = ["owner"]
+
+
+KB_DOCUMENT_MODELS = [Variant, Effect, NUCChange, AAChange, EffectSource, Structure, ProteinRegion, AAResidue, Rule]
+
+
+def declared_index_keys(document_model: Type[Document]) -> List[Tuple[Tuple[str, int], ...]]:
+    """
+    Returns the keys of the indexes declared in the Collection settings of document_model, each as a tuple of
+    (field, direction) pairs (a single field name declares an ascending index on that field).
+    """
+    keys = []
+    for index in getattr(document_model.Collection, "indexes", []):
+        if isinstance(index, str):
+            keys.append(((index, ASCENDING),))
+        else:
+            keys.append(tuple((field, direction) for field, direction in index))
+    return keys
+
+
+async def verify_kb_indexes() -> Dict[str, List[tuple]]:
+    """
+    Checks that the indexes declared on the KB models exist on the server (init_beanie creates the missing ones).
+    Returns the keys of the missing indexes by collection name, after logging them.
+    """
+    missing_indexes = dict()
+    for document_model in KB_DOCUMENT_MODELS:
+        collection = document_model.get_motor_collection()
+        existing_keys = {tuple((field, direction if isinstance(direction, str) else int(direction))
+                               for field, direction in index["key"])
+                         for index in (await collection.index_information()).values()}
+        missing = [keys for keys in declared_index_keys(document_model) if keys not in existing_keys]
+        if missing:
+            missing_indexes[collection.name] = missing
+            logger.warning(f"missing indexes on KB collection {collection.name}: {missing}")
+    if not missing_indexes:
+        logger.info("KB indexes verified")
+    return missing_indexes
+
+
+class MongoPoolListener(ConnectionPoolListener):
+    """
+    Keeps count of the connections of the Motor pools, by server address.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats_of_address = dict()
+
+    def _update(self, event, **deltas):
+        with self._lock:
+            stats = self._stats_of_address.setdefault(
+                f"{event.address[0]}:{event.address[1]}",
+                {"open_connections": 0, "checked_out": 0, "check_out_failures": 0})
+            for key, delta in deltas.items():
+                stats[key] += delta
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {address: dict(stats) for address, stats in self._stats_of_address.items()}
+
+    def connection_created(self, event):
+        self._update(event, open_connections=1)
+
+    def connection_closed(self, event):
+        self._update(event, open_connections=-1)
+
+    def connection_checked_out(self, event):
+        self._update(event, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._update(event, checked_out=-1)
+
+    def connection_check_out_failed(self, event):
+        self._update(event, check_out_failures=1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+mongo_pool_listener = MongoPoolListener()
 
 
 # Call this from within your event loop to get beanie setup.
-async def init_db_model(db_name: str):
+async def init_db_model(db_name: str, settings: Optional[DBSettings] = None, event_listeners: Sequence = ()):
+    settings = settings or DBSettings()
     # Crete Motor client
     client = motor.motor_asyncio.AsyncIOMotorClient(
-        "mongodb://localhost:27017"
+        settings.mongo_uri,
+        maxPoolSize=settings.mongo_max_pool_size,
+        minPoolSize=settings.mongo_min_pool_size,
+        readPreference=settings.mongo_read_preference,
+        event_listeners=[mongo_pool_listener, *event_listeners]
     )
 
     logger.info(f"Connecting to MONGO DB  {db_name}")
-    # Init beanie with the Product document class
-    await init_beanie(database=client[db_name],
-                      document_models=[Variant, Effect, NUCChange, AAChange, EffectSource, Structure, ProteinRegion,
-                                       AAResidue, Rule])
+    # Init beanie with the Product document class; it also creates the indexes declared on the models, if missing
+    await init_beanie(database=client[db_name], document_models=KB_DOCUMENT_MODELS)
+    await verify_kb_indexes()
 
 
 def read_mongodb_connection_parameters(file_path: str):
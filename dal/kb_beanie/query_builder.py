@@ -0,0 +1,60 @@
+from typing import *
+from beanie import Document
+from pydantic import BaseModel
+
+from dal.kb_beanie.raw_projection import find_raw, stream_raw
+
+
+class MongoQuery:
+    """
+    Composes the filters of a list endpoint into a single find() on one collection, i.e. one $match of the form
+        {'$and': [<condition>, <condition>, ...]}
+    with sort, skip and limit pushed down to MongoDB.
+    """
+
+    def __init__(self, document_class: Type[Document], projection_model: Type[BaseModel], *conditions: dict,
+                 sort_by: str = "_id"):
+        self.document_class = document_class
+        self.projection_model = projection_model
+        self.sort_by = sort_by
+        self.conditions: List[dict] = list(conditions)
+        self._filters_count = 0
+
+    def where(self, condition: dict):
+        """
+        Adds a filter condition to the conjunction.
+        """
+        self.conditions.append(condition)
+        self._filters_count += 1
+        return self
+
+    def has_filters(self) -> bool:
+        """
+        Returns True if at least one filter was added with where() (conditions given to the constructor don't count).
+        """
+        return self._filters_count > 0
+
+    def match(self) -> dict:
+        if len(self.conditions) == 0:
+            return {}
+        elif len(self.conditions) == 1:
+            return self.conditions[0]
+        else:
+            return {'$and': self.conditions}
+
+    async def to_list(self, pagination=None) -> list:
+        """
+        Runs the query and returns the projected documents as dicts (sorted by sort_by when pagination is set).
+        :param pagination: an object exposing is_set, limit and skip (i.e. queries.OptionalPagination) or None.
+        """
+        if pagination:
+            return await find_raw(self.document_class, self.projection_model, self.match(),
+                                  sort=self.sort_by, skip=pagination.skip, limit=pagination.limit)
+        return await find_raw(self.document_class, self.projection_model, self.match())
+
+    async def stream(self) -> AsyncIterator[dict]:
+        """
+        Yields the projected documents of the whole result one at a time, as they are read from the Motor cursor.
+        """
+        async for document in stream_raw(self.document_class, self.projection_model, self.match()):
+            yield document
@@ -0,0 +1,93 @@
+from typing import *
+
+from beanie import Document
+from bson import ObjectId
+from pydantic import BaseModel
+
+
+class RawProjection:
+    """
+    Reads the documents of a query as plain dicts shaped like a projection model (see projections.py), without
+    building a Pydantic object for each of them.
+    The projection model stays the schema of the result: the documents are projected with its Settings.projection
+    (or on its fields, if it has no Settings), every dict has exactly its fields in the same order (None if missing),
+    and the values of the fields annotated as str, ObjectId, int or float are converted to that type, one column at a
+    time (ObjectIds are converted to str).
+    """
+
+    _instances: Dict[type, 'RawProjection'] = dict()
+
+    def __init__(self, projection_model: Type[BaseModel]):
+        type_hints = get_type_hints(projection_model)
+        type_of_field = {field: type_hints[field] for field in projection_model.__fields__}
+        self.fields = tuple(type_of_field)
+        settings = getattr(projection_model, "Settings", None)
+        self.projection = getattr(settings, "projection", None) or {field: 1 for field in self.fields}
+        self.converters = []
+        for field, annotation in type_of_field.items():
+            target_type = self._target_type(annotation)
+            if target_type is not None:
+                self.converters.append((field, target_type))
+
+    @staticmethod
+    def _target_type(annotation) -> Optional[type]:
+        types = [x for x in (get_args(annotation) or (annotation,)) if x is not type(None)]
+        if all(x is str or (isinstance(x, type) and issubclass(x, ObjectId)) for x in types):
+            return str
+        if types in ([int], [float]):
+            return types[0]
+        return None
+
+    @classmethod
+    def of(cls, projection_model: Type[BaseModel]) -> 'RawProjection':
+        instance = cls._instances.get(projection_model)
+        if instance is None:
+            instance = cls._instances[projection_model] = cls(projection_model)
+        return instance
+
+    def rows(self, documents: Iterable[dict]) -> List[dict]:
+        fields = self.fields
+        rows = [{field: document.get(field) for field in fields} for document in documents]
+        for field, target_type in self.converters:
+            for row in rows:
+                value = row[field]
+                if value is not None and type(value) is not target_type:
+                    row[field] = target_type(value)
+        return rows
+
+    def row(self, document: dict) -> dict:
+        return self.rows((document,))[0]
+
+
+async def find_raw(document_class: Type[Document], projection_model: Type[BaseModel], query: dict,
+                   sort: Optional[str] = None, skip: int = 0, limit: int = 0) -> List[dict]:
+    """
+    Same as document_class.find(query, projection_model=projection_model).to_list(), but returns plain dicts.
+    """
+    raw_projection = RawProjection.of(projection_model)
+    cursor = document_class.get_motor_collection().find(query, raw_projection.projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    cursor = cursor.skip(skip).limit(limit)
+    return raw_projection.rows(await cursor.to_list(length=None))
+
+
+async def stream_raw(document_class: Type[Document], projection_model: Type[BaseModel], query: dict) \
+        -> AsyncIterator[dict]:
+    """
+    Yields the documents of find_raw(document_class, projection_model, query) one at a time, as they are read from
+    the Motor cursor.
+    """
+    raw_projection = RawProjection.of(projection_model)
+    async for document in document_class.get_motor_collection().find(query, raw_projection.projection):
+        yield raw_projection.row(document)
+
+
+async def aggregate_raw(document_class: Type[Document], projection_model: Type[BaseModel], pipeline: List[dict]) \
+        -> List[dict]:
+    """
+    Same as document_class.aggregate(pipeline, projection_model=projection_model).to_list(), but returns plain dicts.
+    """
+    raw_projection = RawProjection.of(projection_model)
+    cursor = document_class.get_motor_collection().aggregate(pipeline + [{"$project": raw_projection.projection}])
+    return raw_projection.rows(await cursor.to_list(length=None))
@@ -0,0 +1,59 @@
+from collections import defaultdict
+from typing import *
+
+# n-grams shorter than this are indexed too, so that queries of one or two characters are answered by a single lookup
+_N = 3
+
+
+class TrigramIndex:
+    """
+    Case-insensitive substring search over a list of texts. Every n-gram of 1 to 3 characters of each text is mapped
+    to the positions of the texts containing it: the candidates of a query are the intersection of the postings of its
+    trigrams (smallest first), and only the candidates are compared with the query. The query is literal text, not a
+    pattern.
+    """
+
+    def __init__(self, texts: Iterable[Optional[str]]):
+        self._texts: List[str] = [(text or "").lower() for text in texts]
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        for i, text in enumerate(self._texts):
+            for n in range(1, _N + 1):
+                for start in range(len(text) - n + 1):
+                    self._postings[text[start:start + n]].add(i)
+
+    def __len__(self):
+        return len(self._texts)
+
+    def search(self, query: str) -> Dict[int, Tuple[int, int, int]]:
+        """
+        Returns the positions of the texts containing query, each with its rank (lower is better): texts starting
+        with the query come first, then texts where the query starts a word, then the others; ties are broken by the
+        offset of the first occurrence and by the length of the text.
+        """
+        query = query.lower()
+        if not query:
+            return {i: (0, 0, len(text)) for i, text in enumerate(self._texts)}
+        if len(query) <= _N:
+            candidates = self._postings.get(query, set())
+        else:
+            trigrams = sorted({query[start:start + _N] for start in range(len(query) - _N + 1)},
+                              key=lambda x: len(self._postings.get(x, ())))
+            candidates = set(self._postings.get(trigrams[0], ()))
+            for trigram in trigrams[1:]:
+                if not candidates:
+                    break
+                candidates &= self._postings.get(trigram, set())
+        result = dict()
+        for i in candidates:
+            text = self._texts[i]
+            offset = text.find(query)
+            if offset < 0:
+                continue
+            if offset == 0:
+                kind = 0
+            elif not text[offset - 1].isalnum():
+                kind = 1
+            else:
+                kind = 2
+            result[i] = (kind, offset, len(text))
+        return result
@@ -0,0 +1,63 @@
+import functools
+import json
+from decimal import Decimal
+from types import MappingProxyType
+from typing import *
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+from starlette.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:     # optional dependency: fall back to the standard json module
+    orjson = None
+
+
+def _default(obj):
+    # types that the serializer doesn't know natively (PydanticObjectId is a subclass of ObjectId)
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, "_mapping"):    # SQLAlchemy rows
+        return dict(obj._mapping)
+    if isinstance(obj, MappingProxyType):   # rows of the KB cache
+        return dict(obj)
+    return jsonable_encoder(obj)
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":"))\
+        .encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse that serializes the content with orjson (or json if orjson is not installed) without running
+    jsonable_encoder on it first; types that neither serializer knows are converted one by one through _default.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class FastJSONRoute(APIRoute):
+    """
+    APIRoute that wraps the result of the endpoint in a FastJSONResponse. FastAPI passes the result of an endpoint
+    through jsonable_encoder unless it is already a Response, so wrapping it is what skips the encoder.
+    Endpoints returning a Response (e.g. StreamingResponse) are left untouched.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        @functools.wraps(endpoint)  # keeps the signature, from which FastAPI reads the parameters
+        async def endpoint_with_fast_json_response(*args, **kwargs):
+            result = await endpoint(*args, **kwargs)
+            if isinstance(result, Response):
+                return result
+            return FastJSONResponse(result)
+
+        super().__init__(path, endpoint_with_fast_json_response, **kwargs)
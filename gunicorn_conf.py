@@ -0,0 +1,35 @@
+# Gunicorn configuration of the production server (see start_api_server_beanie_production.sh).
+# Gunicorn supervises N independent uvicorn worker processes. Each worker runs startup() (DB connections, indexes and
+# KB cache warm-up) before it accepts requests, and keeps its own caches and connection pools (nothing is shared
+# between workers). The total number of DB connections is therefore workers * (pg_pool_size + pg_max_overflow) for
+# PostgreSQL and up to workers * mongo_max_pool_size for MongoDB (see dal/db_settings.py).
+# POST /admin/kb_refresh reaches one worker only: that worker writes a new token in kb_refresh_marker.txt, which every
+# worker polls (see poll_refresh_marker in main_beanie.py), so all of them refresh their caches within a few seconds.
+#
+# Graceful rolling restart (e.g. after a deploy): kill -HUP $(cat gunicorn.pid)
+# gunicorn starts a new set of workers with the new code and stops the old ones only after they completed their
+# in-flight requests (within graceful_timeout seconds).
+import multiprocessing
+import os
+
+bind = os.environ.get("COV2K_BIND", "localhost:8000")
+workers = int(os.environ.get("COV2K_WORKERS", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# the app is imported by each worker (not by the master), so that a HUP reloads the code and every worker opens its
+# own DB connections in its own event loop
+preload_app = False
+
+# startup() loads the epitope index and warms up the KB cache: give it time before the worker is considered dead
+timeout = int(os.environ.get("COV2K_WORKER_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("COV2K_GRACEFUL_TIMEOUT", 60))
+keepalive = 5
+
+# recycle each worker after a number of requests (with jitter, so that workers are not restarted all together)
+# to bound memory growth. 0 disables it.
+max_requests = int(os.environ.get("COV2K_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+
+pidfile = "gunicorn.pid"
+accesslog = "-"
+errorlog = "-"
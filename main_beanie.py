@@ -1,27 +1,47 @@
+import asyncio
 import base64
+import csv
+import hmac
 import inspect
+import io
+import json
+import os
 import pprint
 import re
+import sys
+import uuid
 import warnings
 from enum import Enum
-from typing import Optional, List, Callable
+from typing import Optional, List, Callable, Union
 
 import bson.errors
 import uvicorn
-from fastapi import FastAPI, Request, status, HTTPException, Depends, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, status, HTTPException, Depends, Query, Header
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
 from fastapi.routing import APIRoute, APIRouter
-from starlette.responses import PlainTextResponse
+from pydantic import BaseModel
+from starlette.responses import PlainTextResponse, Response
 
 from dal.kb_beanie.model import *
 from dal.kb_beanie.projections import *
+from dal.kb_beanie.cache import kb_cache
+from dal.kb_beanie.grantham_matrix import load_grantham_matrix
+from dal.kb_beanie.annotation_index import load_nuc_annotation_index
+from dal.kb_beanie.context_index import load_context_index
+from dal.kb_beanie.kb_graph import load_kb_graph, get_kb_graph
+from dal.data_sqlalchemy.epitope_index import load_epitope_index
+from dal.data_sqlalchemy.summary_tables import check_summary_tables
+from dal.data_sqlalchemy.sequence_index import load_sequence_index, SEQUENCE_INDEX_FILE
+from dal.db_settings import read_db_settings
 from dal.data_sqlalchemy.model import *
 from dal.data_sqlalchemy.convert_prot_names import *
 from api_exceptions import MyExceptions
 from loguru import logger
 from os.path import sep
 from api_docs import custom_openapi_doc
+from response_cache import ResponseCache
+from fast_json import FastJSONRoute
 from dal.data_sqlalchemy.model import _session_factory
 
 import queries
@@ -38,32 +58,92 @@ def read_root_path():
         return None
 
 
+def read_admin_token():
+    try:
+        with open("admin_token.txt", "r") as at:
+            token = at.readline().rstrip()
+            logger.info("admin token set")
+            return token or None
+    except FileNotFoundError:
+        logger.info("admin token not set: admin endpoints are disabled")
+        return None
+
+
 root_path = read_root_path()
+admin_token = read_admin_token()
 app = FastAPI(docs_url=None, root_path=root_path)
 
+# opt-in (COV2K_FAST_JSON=true): serialize the results of the endpoints with orjson, skipping jsonable_encoder
+FAST_JSON_RESPONSES = os.environ.get("COV2K_FAST_JSON", "false").lower() == "true"
+if FAST_JSON_RESPONSES:
+    app.router.route_class = FastJSONRoute
+
+# seconds between two checks of the KB and VCM versions (0 disables polling; the caches can still be refreshed
+# through /admin/kb_refresh)
+KB_CACHE_POLL_SECONDS = 300
+# /admin/kb_refresh is served by a single worker process: it writes a new token in this file, and every worker
+# refreshes its own caches when it sees the token change (checked every REFRESH_MARKER_POLL_SECONDS)
+REFRESH_MARKER_FILE = f".{sep}kb_refresh_marker.txt"
+REFRESH_MARKER_POLL_SECONDS = 5
+seen_refresh_marker: Optional[str] = None
+background_tasks = set()
+
+# serialized responses of the GET requests to the entity endpoints and to /combine
+response_cache = ResponseCache(max_entries=4096, max_bytes=64 * 1024 * 1024, ttl_seconds=600)
+
+
+# pairs of query parameters that express the bounds of a single range filter
+range_query_params = [("min_grantham_distance", "max_grantham_distance")]
+
 
 # Fixes MAX query parameter num to 1
 # Logs and handles unexpected errors
 @app.middleware("http")
 async def main_middleware(request, call_next):
     # detect unrecognized query parameters
-    endpoint_name = request.url.path.lstrip('/').lstrip(app.root_path)
-    function_name = Entity2Request._endpoint_of_entity.get(endpoint_name)
-    if function_name is not None:
-        accepted_q_params = inspect.getfullargspec(eval(function_name)).args
+    endpoint_name = request.url.path
+    if app.root_path and endpoint_name.startswith(app.root_path):
+        endpoint_name = endpoint_name[len(app.root_path):]
+    endpoint_name = endpoint_name.lstrip('/')
+    route = Entity2Request.route_of(endpoint_name)
+    if route is not None:
         for param in request.query_params.keys():
-            if param not in accepted_q_params:
+            if param not in route.accepted_query_params:
                 return MyExceptions.response_from_exception(MyExceptions.compose_request_unrecognised_query_parameter)
 
-    # detect requests receiving > 1 query parameter more than limit and page
+    # detect requests receiving > 1 query parameter more than limit, page, cursor (and format for exports)
     ignored_params = 1 if request.query_params.get("page") is not None else 0
     ignored_params += 1 if request.query_params.get("limit") is not None else 0
+    ignored_params += 1 if request.query_params.get("cursor") is not None else 0
+    if endpoint_name.startswith('export/'):
+        ignored_params += 1 if request.query_params.get("format") is not None else 0
+    if endpoint_name.startswith('stats/'):
+        ignored_params += 1 if request.query_params.get("group_by") is not None else 0
+    # the bounds of a range count as one parameter
+    for lower_bound, upper_bound in range_query_params:
+        if request.query_params.get(lower_bound) is not None and request.query_params.get(upper_bound) is not None:
+            ignored_params += 1
     if len(request.query_params) - ignored_params > 1:
         return PlainTextResponse(status_code=status.HTTP_400_BAD_REQUEST
                                  , content=f"The API accepts only one query parameter at a time")
+    # answer from the response cache if possible
+    cache_key = None
+    if request.method == "GET" and endpoint_name.split('/')[0] in cacheable_endpoints:
+        cache_key = ResponseCache.key_of(endpoint_name, request.query_params.multi_items())
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            return cached_response.response_to(request.headers.get("if-none-match"))
+        data_version = response_cache.data_version
     # answer and catch errors
     try:
-        return await call_next(request)
+        response = await call_next(request)
+        if cache_key is None or response.status_code != status.HTTP_200_OK:
+            return response
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        cached_response = response_cache.put(cache_key, body, response.headers.get("content-type"), data_version)
+        if cached_response is None:
+            return Response(content=body, status_code=response.status_code, headers=dict(response.headers))
+        return cached_response.response_to(request.headers.get("if-none-match"))
     except Exception:
         logger.exception("")
         return PlainTextResponse("Something went wrong", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -96,6 +176,9 @@ all_available_entities = {'variants', 'namings', 'contexts', 'effects', 'evidenc
                           'sequences', 'host_samples', 'nuc_mutations', 'aa_changes', 'epitopes', 'assays'}
 
 
+cacheable_endpoints = all_available_entities | {'combine', 'stats'}
+
+
 class QueryTypes(Enum):
     PATH_PARM = 1
     QUERY_PARAM = 2
@@ -110,7 +193,10 @@ extracts the evidences reporting effects on the Spike mutation L452R.\n
 Pagination applies to the combination result and is mandatory
 if the combination result refers to a data entity.\n
 A basic error handling mechanism prohibits users to build combinations with cycles
-(i.e., strings with repeated entities are illegal)."""
+(i.e., strings with repeated entities are illegal).\n
+Combinations of sequences, host_samples, nuc_mutations, aa_changes, epitopes and assays filtered by at most one query
+parameter (e.g., /combine/host_samples/sequences/nuc_mutations?position=23403) are answered by a single query,
+whose intermediate results have no size limit."""
     # clean full_path
     while len(full_path) > 0 and full_path[-1] == '/':
         full_path = full_path[:-1]
@@ -148,6 +234,18 @@ A basic error handling mechanism prohibits users to build combinations with cycl
     if len(call_list) > len(set(call_list)):
         raise MyExceptions.compose_request_path_cycle_detected
 
+    # chains of VCM entities are compiled into a single query, paginated by the database
+    if query_type != QueryTypes.PATH_PARM:
+        vcm_chain_query = queries.vcm_chain_query(call_list, [(k, v) for k, v in request.query_params.multi_items()
+                                                              if k not in ('limit', 'page')])
+        if vcm_chain_query is not None:
+            try:
+                return await queries.get_vcm_chain(vcm_chain_query, queries.OptionalPagination(limit, page))
+            except HTTPException:
+                raise
+            except:
+                log_and_raise_http_bad_request()
+
     # description = {
     #     "cleaned path": full_path,
     #     "entities requested": split_entities,
@@ -159,7 +257,22 @@ A basic error handling mechanism prohibits users to build combinations with cycl
 
     async def make_request(entity_name, path_param, query_params):
         try:
-            return await Entity2Request.make_function_call(entity_name, path_param, query_params)
+            return await Entity2Request.bounded_function_call(entity_name, path_param, query_params)
+        except TypeError as e:
+            logger.exception("")
+            if 'unexpected keyword argument' in e.args[0]:
+                raise MyExceptions.compose_request_unrecognised_query_parameter
+            else:
+                log_and_raise_http_bad_request()
+        except bson.errors.InvalidId:
+            raise MyExceptions.invalid_object_id
+        except:
+            logger.exception("")
+            log_and_raise_http_bad_request()
+
+    async def make_related_ids_request(entity_name, query_param_keyword, query_param_values):
+        try:
+            return await Entity2Request.related_ids(entity_name, query_param_keyword, query_param_values)
         except TypeError as e:
             logger.exception("")
             if 'unexpected keyword argument' in e.args[0]:
@@ -198,25 +311,34 @@ A basic error handling mechanism prohibits users to build combinations with cycl
               f"\tquery_param_values {query_param_values}\n")
 
         if query_param_values:
-            # repeated queries at the last stage can bypass the limit on the cardinality of the result ==> we
-            # mimic paging in python
-            for qpv in query_param_values:
-                single_call_result: list = await make_request(this_call, path_param, {query_param_keyword: qpv})
-
-                if len(call_list) == 0:     # build result
-                    # make distinct of result
-                    try:
-                        single_call_result = [frozenset(x.items()) for x in single_call_result]
-                    except:
-                        logger.exception("")
-                    final_result.update(single_call_result)
-
-                    # if reached pagination limit limit, stop it
-                    if len(final_result) > in_code_pagination.last_idx:
+            if len(call_list) == 0:     # build result
+                # repeated queries at the last stage can bypass the limit on the cardinality of the result ==> we
+                # mimic paging in python. Requests run concurrently in chunks, but results are merged in the
+                # order of query_param_values, so that we stop exactly where a sequential loop would stop
+                pagination_limit_reached = False
+                chunk_size = Entity2Request.MAX_CONCURRENT_CALLS
+                for chunk_start in range(0, len(query_param_values), chunk_size):
+                    chunk_results = await asyncio.gather(*[
+                        make_request(this_call, path_param, {query_param_keyword: qpv})
+                        for qpv in query_param_values[chunk_start:chunk_start + chunk_size]])
+                    for single_call_result in chunk_results:
+                        # make distinct of result
+                        try:
+                            single_call_result = [frozenset(x.items()) for x in single_call_result]
+                        except:
+                            logger.exception("")
+                        final_result.update(single_call_result)
+
+                        # if reached pagination limit limit, stop it
+                        if len(final_result) > in_code_pagination.last_idx:
+                            pagination_limit_reached = True
+                            break
+                    if pagination_limit_reached:
                         break
-                else:
-                    next_call_query_parameter_values.update([x[next_call_query_parameter_keyword]
-                                                             for x in single_call_result])
+            else:
+                # intermediate stages only need the union of the IDs => resolve all the values at once
+                next_call_query_parameter_values.update(
+                    await make_related_ids_request(this_call, query_param_keyword, query_param_values))
         else:  # only the first call can be path parameter or no-parameter
             single_call_result: list = await make_request(this_call, path_param, dict())
             path_param = None
@@ -255,20 +377,230 @@ A basic error handling mechanism prohibits users to build combinations with cycl
     return final_result
 
 
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+@app.get("/export/{entity}")
+async def export(entity: str, request: Request, format: ExportFormat = ExportFormat.ndjson):
+    """The /export endpoint streams all the instances of an entity (e.g., /export/sequences) as newline-delimited JSON
+(format=ndjson, default) or CSV (format=csv), without pagination.\n
+The same query parameters of the corresponding entity endpoint can be used to filter the exported instances, e.g.,
+/export/sequences?host_sample_id=1.\n
+Exportable entities are sequences, host_samples, nuc_mutations, aa_changes, epitopes, assays, evidences,
+aa_change_groups, protein_regions and aa_residues (with aliases aa_residues_ref and aa_residues_alt)."""
+    query_params = {k: v for k, v in request.query_params.items() if k != 'format'}
+    # parameters are validated before the response begins
+    query = queries.export_query(entity, query_params)
+    instances = queries.stream_export(query)
+    if format == ExportFormat.csv:
+        return StreamingResponse(csv_lines(instances), media_type="text/csv")
+    else:
+        return StreamingResponse(ndjson_lines(instances), media_type="application/x-ndjson")
+
+
+class BatchRequest(BaseModel):
+    ids: List[Union[int, str]]
+
+
+@app.post("/{entity}/_batch")
+async def batch(entity: str, batch_request: BatchRequest):
+    """The /_batch endpoints retrieve many instances of an entity at once, given their identifiers in the JSON body,
+e.g., POST /sequences/_batch with {"ids": [1, 2, 3]}. They replace one request per identifier to the corresponding
+single-instance endpoint (e.g., /sequences/{sequence_id}) and are resolved with a single query.
+
+The response lists one element for each requested id, in the same order: {"id": ..., "found": true, "result": {...}}
+or, if the id doesn't identify any instance (or is badly formatted), {"id": ..., "found": false, "result": null}.
+
+Available for variants, effects, sequences, nuc_mutations, aa_changes and epitopes, with at most 10000 ids per
+request."""
+    return await queries.batch_lookup(entity, batch_request.ids)
+
+
+class StatsDimension(str, Enum):
+    nuc_mutation = "nuc_mutation"
+    aa_change = "aa_change"
+    continent = "continent"
+    country = "country"
+    collection_month = "collection_month"
+
+
+@app.get("/stats/{entity}")
+async def stats(entity: str, request: Request, group_by: StatsDimension):
+    """The /stats endpoint counts the instances of an entity grouped by a dimension, e.g.,
+/stats/sequences?group_by=country returns the number of sequences collected in each country, from the largest group.
+
+The dimensions are nuc_mutation, aa_change, continent, country and collection_month (YYYY-MM; dates without the month
+are counted under null). Host samples (/stats/host_samples) can be grouped by continent, country and
+collection_month.
+
+The same query parameters of the corresponding entity endpoint can be used to filter the counted instances, e.g.,
+/stats/sequences?group_by=collection_month&aa_change_id=S:L452R.
+
+The counts are computed by the database with a single aggregation and are cached until the data change."""
+    query_params = {k: v for k, v in request.query_params.items() if k != 'group_by'}
+    return await queries.get_stats(entity, group_by.value, query_params)
+
+
+# size (in characters) of the chunks written to the client by the export
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+async def ndjson_lines(instances):
+    chunk = []
+    chunk_size = 0
+    async for instance in instances:
+        line = json.dumps(instance, default=str) + "\n"
+        chunk.append(line)
+        chunk_size += len(line)
+        if chunk_size >= EXPORT_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+            chunk_size = 0
+    if chunk:
+        yield "".join(chunk)
+
+
+async def csv_lines(instances):
+    buffer = io.StringIO()
+    writer = None
+    async for instance in instances:
+        if writer is None:  # header is taken from the first instance
+            writer = csv.DictWriter(buffer, fieldnames=list(instance.keys()))
+            writer.writeheader()
+        writer.writerow(instance)
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell() > 0:
+        yield buffer.getvalue()
+
+
 @app.on_event("startup")
 async def startup():
     db_name, db_user, db_psw, db_port = read_postgres_connection_parameters_csv(f".{sep}postgresql_db_conn_params.csv")
-    config_db_engine(db_name, db_user, db_psw, db_port)
+    db_settings = read_db_settings(f".{sep}db_settings.csv")
+    config_db_engine(db_name, db_user, db_psw, db_port, db_settings)
+    Entity2Request.limit_concurrent_calls(db_settings.pg_pool_size + db_settings.pg_max_overflow)
+    await check_summary_tables()
     app.openapi = custom_openapi_doc(app)
     kb_db_name = read_mongodb_connection_parameters(f".{sep}mongodb_conn_params.csv")
-    await init_db_model(kb_db_name)
+    await init_db_model(kb_db_name, db_settings)
+    load_grantham_matrix(f".{sep}assets{sep}grantham_distance.csv")
+    kb_cache.on_refresh(load_nuc_annotation_index)
+    kb_cache.on_refresh(load_context_index)
+    kb_cache.on_refresh(load_kb_graph)
+    global seen_refresh_marker
+    seen_refresh_marker = read_refresh_marker()
+    await refresh_data_versions(force=True)
+    await queries.warm_up_kb_cache()
+    if KB_CACHE_POLL_SECONDS > 0:
+        background_tasks.add(asyncio.create_task(poll_data_versions(KB_CACHE_POLL_SECONDS)))
+    background_tasks.add(asyncio.create_task(poll_refresh_marker(REFRESH_MARKER_POLL_SECONDS)))
+
+
+async def refresh_data_versions(force: bool = False):
+    """
+    Reads the current versions of the KB and of the VCM database: the KB cache is reset if the KB changed (or force is
+    True), the response cache if any of them changed (or force is True). Also notices VCM summary tables built after
+    the startup, (re)loads the sequence index if it matches the VCM version and rebuilds the epitope index if the
+    VCM version changed.
+    """
+    await kb_cache.refresh(force=force)
+    await check_summary_tables()
+    vcm_version = await read_vcm_version()
+    load_sequence_index(SEQUENCE_INDEX_FILE, vcm_version)
+    await load_epitope_index(vcm_version)
+    if force:
+        response_cache.clear()
+    response_cache.set_data_version((kb_cache.version, vcm_version))
+
+
+async def poll_data_versions(interval_seconds: float):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await refresh_data_versions()
+        except Exception:
+            logger.exception("data version poll failed")
+
+
+def read_refresh_marker() -> Optional[str]:
+    try:
+        with open(REFRESH_MARKER_FILE, "r") as rm:
+            return rm.readline().rstrip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_refresh_marker() -> str:
+    marker = uuid.uuid4().hex
+    # written aside and renamed, so that the other workers never read a partial token
+    with open(f"{REFRESH_MARKER_FILE}.tmp", "w") as rm:
+        rm.write(marker)
+    os.replace(f"{REFRESH_MARKER_FILE}.tmp", REFRESH_MARKER_FILE)
+    return marker
+
+
+async def poll_refresh_marker(interval_seconds: float):
+    """
+    Refreshes the caches of this worker whenever another worker served /admin/kb_refresh.
+    """
+    global seen_refresh_marker
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            marker = read_refresh_marker()
+            if marker != seen_refresh_marker:
+                seen_refresh_marker = marker
+                await refresh_data_versions(force=True)
+                await queries.warm_up_kb_cache()
+        except Exception:
+            logger.exception("refresh marker poll failed")
 
 
 @app.on_event("shutdown")
 async def shutdown():
+    for task in background_tasks:
+        task.cancel()
     await dispose_db_engine()
 
 
+@app.post("/admin/kb_refresh", include_in_schema=False)
+async def refresh_kb_cache(x_admin_token: Optional[str] = Header(None)):
+    """
+    Drops the cached results of the KB queries and the cached responses, and reloads the KB cache. The other worker
+    processes do the same within REFRESH_MARKER_POLL_SECONDS (see poll_refresh_marker); the returned stats are the
+    ones of the worker that served the request.
+    """
+    global seen_refresh_marker
+    check_admin_token(x_admin_token)
+    seen_refresh_marker = write_refresh_marker()
+    await refresh_data_versions(force=True)
+    await queries.warm_up_kb_cache()
+    return {
+        "kb_cache": kb_cache.stats(),
+        "response_cache": response_cache.stats()
+    }
+
+
+@app.get("/admin/pool_stats", include_in_schema=False)
+async def get_pool_stats(x_admin_token: Optional[str] = Header(None)):
+    """Returns the utilisation of the PostgreSQL and MongoDB connection pools."""
+    check_admin_token(x_admin_token)
+    return {
+        "postgresql": pool_stats(),
+        "mongodb": mongo_pool_listener.stats()
+    }
+
+
+def check_admin_token(x_admin_token: Optional[str]):
+    if admin_token is None or x_admin_token is None or not hmac.compare_digest(x_admin_token, admin_token):
+        raise MyExceptions.admin_forbidden
+
+
 @app.get("/variants")
 async def get_variants(naming_id: Optional[str] = None
                        , effect_id: Optional[str] = None
@@ -592,6 +924,8 @@ async def get_aa_residue_changes(aa_positional_change_id: Optional[str] = None
                                  , alternative: Optional[str] = None
                                  , grantham_distance: Optional[int] = None
                                  , type: Optional[str] = None
+                                 , min_grantham_distance: Optional[int] = None
+                                 , max_grantham_distance: Optional[int] = None
                                  , limit: Optional[int] = Query(None, ge=1), page: Optional[int] = Query(None, ge=1)):
     """Although the effects of amino acid changes significantly depend on their position on proteins, some characteristics depend just on the specific change - in particular,
 each substitution in Aa Positional Change is connected to the entity Aa Residue Change, which involves two residues (entity AA residue), respectively named as reference
@@ -599,10 +933,13 @@ and alternative, and is further characterized by the grantham_distance that meas
 molecules and determines the type of the change (i.e., radical or conservative, being 66 the threshold distance).\n
 The endpoint (without parameters) allows to retrieve the full list of distinct instances of the Aa Residue Change entity.\n
 Aa Residue Changes are connected to Aa Positional Changes, and Aa Residues.\n
-Different results can be obtained by exploiting the query parameters as described below.\n
+Different results can be obtained by exploiting the query parameters as described below.
+A range of grantham_distance values can be selected with min_grantham_distance and/or max_grantham_distance
+(the two bounds count as a single query parameter).\n
 Pagination is supported and optional (with limit and page parameters)."""
     return await queries.get_aa_residue_changes(aa_positional_change_id, aa_residue_id, reference, alternative, limit,
-                                                page, grantham_distance, type)
+                                                page, grantham_distance, type, min_grantham_distance,
+                                                max_grantham_distance)
 
 
 @app.get('/aa_residue_changes/{aa_residue_change_id}')
@@ -669,17 +1006,21 @@ async def get_sequences(nuc_mutation_id: Optional[str] = None
                         , length: Optional[int] = None
                         , n_percentage: Optional[float] = None
                         , gc_percentage: Optional[float] = None
-                        , limit: int = Query(200, ge=1), page: int = Query(1, ge=1)):
+                        , limit: int = Query(200, ge=1), page: int = Query(1, ge=1)
+                        , cursor: Optional[str] = None):
     """The viral Sequence entity contains metadata about
 its origin (accession_id in the source_database),
 its sequencing characteristics - such as length and percentages of unknown or GC bases (n_percentage and gc_percentage).\n
 The endpoint (without parameters) allows to retrieve the full list of distinct instances of the Sequence entity.\n
 Sequences are linked to their Nuc Mutations, Aa Changes, and Host Samples.\n
 Different results can be obtained by exploiting the query parameters as described below.\n
-Pagination is mandatory (with limit and page parameters).
+Pagination is mandatory (with limit and page parameters).\n
+Deep pages can be retrieved efficiently with cursor pagination: request cursor=first (together with limit) to get
+the first page and then pass the returned next_cursor to get the following one (page is ignored); the last page
+has next_cursor null.
 """
     return await queries.get_sequences(nuc_mutation_id, aa_change_id, host_sample_id, limit, page
-                                       , accession_id, source_database, length, n_percentage, gc_percentage)
+                                       , accession_id, source_database, length, n_percentage, gc_percentage, cursor)
 
 
 @app.get('/sequences/{sequence_id}')
@@ -688,6 +1029,30 @@ async def get_sequence(sequence_id: int):
     return await queries.get_sequence(sequence_id)
 
 
+class CoOccurrenceRequest(BaseModel):
+    all_of: List[str] = []
+    any_of: List[str] = []
+    none_of: List[str] = []
+    count_only: bool = False
+
+
+@app.post('/sequences/_co_occurrence')
+async def sequences_co_occurrence(co_occurrence_request: CoOccurrenceRequest
+                                  , limit: int = Query(1000, ge=1, le=10000), page: int = Query(1, ge=1)):
+    """The endpoint finds the Sequences carrying a combination of mutations, given as nuc_mutation_ids
+(e.g., A23403G) or aa_change_ids (e.g., S:L452R) in the JSON body:\n
+- all_of: the sequences must carry all these mutations;\n
+- any_of: the sequences must carry at least one of these mutations;\n
+- none_of: the sequences must carry none of these mutations.\n
+At least one mutation in all_of or any_of is required, and at most 100 mutations overall.
+The response contains the number of matching sequences (count) and one page of their sorted sequence_ids (with the
+limit and page query parameters, at most 10000 per page), which are omitted if count_only is true.
+E.g., {"all_of": ["S:L452R", "S:T478K", "S:P681R"], "count_only": true}."""
+    return await queries.get_sequences_co_occurrence(co_occurrence_request.all_of, co_occurrence_request.any_of,
+                                                     co_occurrence_request.none_of, co_occurrence_request.count_only,
+                                                     limit, page)
+
+
 @app.get('/host_samples')
 async def get_host_samples(sequence_id: Optional[int] = None
                            , continent: Optional[str] = None
@@ -719,14 +1084,18 @@ async def get_nuc_mutations(sequence_id: Optional[int] = None
                             , alternative: Optional[str] = None
                             , type: Optional[str] = None
                             , length: Optional[int] = None
-                            , limit: int = Query(200, ge=1), page: int = Query(1, ge=1)):
+                            , limit: int = Query(200, ge=1), page: int = Query(1, ge=1)
+                            , cursor: Optional[str] = None):
     """Sequences undergo variant calling pipelines; we represent their nucleotide-level mutations in the Nuc. Mutation entity.\n
 The endpoint (without parameters) allows to retrieve the full list of distinct instances of the Nuc Mutation entity.\n
 Nuc. Mutations are linked to Sequences and to Nuc Positional Mutations.\n
 Different results can be obtained by exploiting the query parameters as described below.\n
-Pagination is mandatory (with limit and page parameters)."""
+Pagination is mandatory (with limit and page parameters).\n
+Deep pages can be retrieved efficiently with cursor pagination: request cursor=first (together with limit) to get
+the first page and then pass the returned next_cursor to get the following one (page is ignored); the last page
+has next_cursor null."""
     return await queries.get_nuc_mutations(sequence_id, nuc_positional_mutation_id, limit, page
-                                           , reference, position, alternative, type, length)
+                                           , reference, position, alternative, type, length, cursor)
 
 
 @app.get('/nuc_mutations/{nuc_mutation_id}')
@@ -744,14 +1113,18 @@ async def get_aa_changes(sequence_id: Optional[int] = None
                          , alternative: Optional[str] = None
                          , type: Optional[str] = None
                          , length: Optional[int] = None
-                         , limit: int = Query(200, ge=1), page: int = Query(1, ge=1)):
+                         , limit: int = Query(200, ge=1), page: int = Query(1, ge=1)
+                         , cursor: Optional[str] = None):
     """Sequences undergo variant calling pipelines; we represent their amino acid-level changes in the AA Changes entity.\n
 The endpoint (without parameters) allows to retrieve the full list of distinct instances of the Aa Change entity.\n
 Aa Changes are linked to Sequences, Proteins, and Aa Positional Changes.\n
 Different results can be obtained by exploiting the query parameters as described below.\n
-Pagination is mandatory (with limit and page parameters)."""
+Pagination is mandatory (with limit and page parameters).\n
+Deep pages can be retrieved efficiently with cursor pagination: request cursor=first (together with limit) to get
+the first page and then pass the returned next_cursor to get the following one (page is ignored); the last page
+has next_cursor null."""
     return await queries.get_aa_changes(sequence_id, protein_id, aa_positional_change_id, limit, page
-                                        , reference, position, alternative, type, length)
+                                        , reference, position, alternative, type, length, cursor)
 
 
 @app.get('/aa_changes/{aa_change_id}')
@@ -880,12 +1253,33 @@ class Entity2Request:
         'assays': 'assay_id',
     }
 
-    # @classmethod
-    # def function_name_for_entity(cls, entity_name: str, path_params, query_params, header_params):
-    #     function_name = cls._endpoint_of_entity[entity_name]     # default
-    #     if path_params:
-    #         function_name = function_name[:-1]
-    #     return eval(function_name)
+    # (entity, query parameter) pairs that can be resolved for many parameter values with a single query
+    _batch_function_of_entity_and_param = {
+        ('variants', 'naming_id'): 'get_variants_by_naming_ids',
+        ('variants', 'effect_id'): 'get_variants_by_effect_ids',
+        ('effects', 'variant_id'): 'get_effects_by_variant_ids',
+        ('effects', 'evidence_id'): 'get_effects_by_evidence_ids',
+        ('evidences', 'effect_id'): 'get_evidences_by_effect_ids',
+        ('nuc_positional_mutations', 'nuc_mutation_id'): 'get_nuc_positional_mutations_by_nuc_mutation_ids',
+        ('aa_positional_changes', 'aa_change_id'): 'get_aa_positional_changes_by_aa_change_ids',
+        ('aa_positional_changes', 'protein_id'): 'get_aa_positional_changes_by_protein_ids',
+        ('nuc_annotations', 'nuc_positional_mutation_id'): 'get_nuc_annotations_by_nuc_positional_mutation_ids',
+        ('sequences', 'host_sample_id'): 'get_sequences_by_host_sample_ids',
+        ('sequences', 'nuc_mutation_id'): 'get_sequences_by_nuc_mutation_ids',
+        ('sequences', 'aa_change_id'): 'get_sequences_by_aa_change_ids',
+        ('host_samples', 'sequence_id'): 'get_host_samples_by_sequence_ids',
+        ('nuc_mutations', 'sequence_id'): 'get_nuc_mutations_by_sequence_ids',
+        ('nuc_mutations', 'nuc_positional_mutation_id'): 'get_nuc_mutations_by_nuc_positional_mutation_ids',
+        ('aa_changes', 'sequence_id'): 'get_aa_changes_by_sequence_ids',
+        ('aa_changes', 'aa_positional_change_id'): 'get_aa_changes_by_aa_positional_change_ids',
+        ('epitopes', 'aa_positional_change_id'): 'get_epitopes_by_aa_positional_change_ids',
+    }
+
+    # max number of single-value requests of /combine running concurrently, across all the requests served by this
+    # worker: each of them may hold a PostgreSQL connection, so at startup it is set to the size of the connection pool
+    # (see limit_concurrent_calls)
+    MAX_CONCURRENT_CALLS = 16
+    _call_slots = asyncio.Semaphore(MAX_CONCURRENT_CALLS)
 
     class FakeRequest:
         class FakeURL:
@@ -895,30 +1289,123 @@ class Entity2Request:
         def __init__(self, fake_path):
             self.url = self.FakeURL(fake_path)
 
+    class Route:
+        """
+        Everything needed to dispatch a request to an entity, resolved once at import time: the query parameters
+        accepted by its endpoint, the query functions answering the list and the single-instance requests, the name of
+        its ID and the batch functions available for its query parameters.
+        """
+
+        def __init__(self, entity_name: str, endpoint_function: Callable, list_function: Callable,
+                     item_function: Callable, id_param: str, batch_function_of_param: dict):
+            self.entity_name = entity_name
+            self.accepted_query_params = frozenset(inspect.getfullargspec(endpoint_function).args)
+            self.list_function = list_function
+            self.item_function = item_function
+            self.id_param = id_param
+            self.batch_function_of_param = batch_function_of_param
+            # aa_residues, aa_residues_ref and aa_residues_alt share the same query function, which tells them apart
+            # by the path of the request
+            if 'request' in inspect.signature(list_function).parameters:
+                self.request = Entity2Request.FakeRequest(entity_name)
+            else:
+                self.request = None
+
+        def call_list(self, query_params: dict):
+            if self.request is not None:
+                return self.list_function(self.request, **query_params)
+            else:
+                return self.list_function(**query_params)
+
+        def call_item(self, path_param):
+            return self.item_function(path_param)
+
+    _route_of_entity = dict()
+
+    @classmethod
+    def build_routes(cls, endpoint_module):
+        """
+        Call this method once, after all the endpoints of endpoint_module have been defined.
+        """
+        for entity_name, function_name in cls._endpoint_of_entity.items():
+            cls._route_of_entity[entity_name] = cls.Route(
+                entity_name,
+                endpoint_function=getattr(endpoint_module, function_name),
+                list_function=getattr(queries, function_name),
+                item_function=getattr(queries, function_name[:-1]),
+                id_param=cls._ID_of_entity[entity_name],
+                batch_function_of_param={param: getattr(queries, batch_function_name)
+                                         for (entity, param), batch_function_name
+                                         in cls._batch_function_of_entity_and_param.items()
+                                         if entity == entity_name})
+
+    @classmethod
+    def route_of(cls, entity_name: str) -> Optional['Entity2Request.Route']:
+        return cls._route_of_entity.get(entity_name)
+
     @classmethod
     def make_function_call(cls, entity_name: str, path_params, query_params: dict):
-        function_name = "queries." + cls._endpoint_of_entity[entity_name]  # default
-        if path_params:
-            function_name = function_name[:-1]
+        route = cls._route_of_entity[entity_name]
         if query_params:
             # replace "type" with "_type" in query parameters
             value_of_query_parameter_type = query_params.pop('type', None)
             if value_of_query_parameter_type is not None:
                 query_params["_type"] = value_of_query_parameter_type
 
-        if function_name == 'get_aa_residues':      # endpoint /aa_residues with query parameters
-            custom_request = cls.FakeRequest(entity_name)
-            return eval(function_name)(custom_request, **query_params)
-        elif function_name == 'get_aa_residue':     # endpoint /aa_residues with path parameter
-            custom_request = cls.FakeRequest(entity_name)
-            return eval(function_name)(custom_request, path_params)
-
-        elif path_params:
-            return eval(function_name)(path_params)
+        if path_params:
+            return route.call_item(path_params)
         else:
-            return eval(function_name)(**query_params)
+            return route.call_list(query_params)
+
+    @classmethod
+    def limit_concurrent_calls(cls, max_calls: int):
+        """
+        Call this method once at startup, before serving any request.
+        """
+        cls.MAX_CONCURRENT_CALLS = max_calls
+        cls._call_slots = asyncio.Semaphore(max_calls)
+
+    @classmethod
+    async def bounded_function_call(cls, entity_name: str, path_params, query_params: dict):
+        """
+        Same as make_function_call, but waits while MAX_CONCURRENT_CALLS calls are already running.
+        """
+        async with cls._call_slots:
+            return await cls.make_function_call(entity_name, path_params, query_params)
+
+    @classmethod
+    async def make_batch_function_call(cls, entity_name: str, query_param_keyword: str, query_param_values: list):
+        """
+        Returns the concatenation of the results of make_function_call(entity_name, None, {query_param_keyword: v})
+        for every v in query_param_values. When a batch query is available for the pair (entity_name,
+        query_param_keyword), the values are resolved with a single IN (...) / $in query, otherwise the single calls
+        run concurrently (see bounded_function_call).
+        """
+        batch_function = cls._route_of_entity[entity_name].batch_function_of_param.get(query_param_keyword)
+        if batch_function is not None:
+            return await batch_function(list(query_param_values))
+        results = await asyncio.gather(*[cls.bounded_function_call(entity_name, None, {query_param_keyword: x})
+                                         for x in query_param_values])
+        return [x for single_call_result in results for x in single_call_result]
+
+    @classmethod
+    async def related_ids(cls, entity_name: str, query_param_keyword: str, query_param_values: list) -> list:
+        """
+        Returns the IDs of the results of make_batch_function_call(entity_name, query_param_keyword,
+        query_param_values). Relationships of the KB graph are resolved in memory, the others with
+        make_batch_function_call.
+        """
+        kb_graph = get_kb_graph()
+        if kb_graph is not None and kb_graph.has_relationship(entity_name, query_param_keyword):
+            return kb_graph.related_ids(entity_name, query_param_keyword, query_param_values)
+        id_param = cls.get_id_of_entity(entity_name)
+        return [x[id_param] for x in
+                await cls.make_batch_function_call(entity_name, query_param_keyword, query_param_values)]
 
     @classmethod
     def get_id_of_entity(cls, entity_name: str) -> str:
-        return cls._ID_of_entity[entity_name]
+        return cls._route_of_entity[entity_name].id_param
+
+
+Entity2Request.build_routes(sys.modules[__name__])
 
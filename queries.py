@@ -1,11 +1,14 @@
 import base64
+import inspect
+import json
 import pprint
 import re
 import warnings
 from enum import Enum
-from typing import Optional, List, Callable
+from typing import Optional, List, Callable, AsyncIterator, Tuple, Set
 
 import bson
+from fastapi import HTTPException
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from fastapi.routing import Request
@@ -20,8 +23,20 @@ from loguru import logger
 from os.path import sep
 from api_docs import custom_openapi_doc
 from dal.data_sqlalchemy.model import _session_factory
-
-
+from dal.data_sqlalchemy.query_builder import SQLQuery, nullable_key
+from dal.data_sqlalchemy import statements
+from dal.kb_beanie.query_builder import MongoQuery
+from dal.kb_beanie.raw_projection import find_raw, aggregate_raw
+from dal.kb_beanie.cache import kb_cached
+from dal.kb_beanie.grantham_matrix import get_grantham_matrix
+from dal.kb_beanie.annotation_index import get_nuc_annotation_index
+from dal.kb_beanie.context_index import get_context_index
+from dal.data_sqlalchemy.epitope_index import get_epitope_index
+from dal.data_sqlalchemy.sequence_index import get_sequence_index, nuc_mutation_key, aa_change_key
+from dal.data_sqlalchemy.summary_tables import summary_tables_available, NUC_MUTATION_SUMMARY, AA_CHANGE_SUMMARY
+
+
+@kb_cached
 async def get_variants(naming_id: Optional[str] = None
                        , effect_id: Optional[str] = None
                        , context_id: Optional[str] = None
@@ -51,20 +66,38 @@ async def get_variants(naming_id: Optional[str] = None
                     ]
                 }]
         })
-    result = Variant.find(query, projection_model=VariantsProjection)
     if pagination:
-        result.sort("_id").skip(pagination.skip).limit(pagination.limit)
-    result = await result.to_list()
-    result = list(map(vars, result))
+        result = await find_raw(Variant, VariantsProjection, query,
+                                sort="_id", skip=pagination.skip, limit=pagination.limit)
+    else:
+        result = await find_raw(Variant, VariantsProjection, query)
     return result
 
 
+@kb_cached
 async def get_variant(variant_id: str):
     variant_id = upper_if_exists(variant_id)
-    result = await Variant.find_many({"_id": variant_id}, projection_model=VariantsProjection).to_list()
-    return list(map(vars, result))
+    result = await find_raw(Variant, VariantsProjection, {"_id": variant_id})
+    return result
+
+
+@kb_cached
+async def get_variants_by_naming_ids(naming_ids: List[str]):
+    """Same as get_variants(naming_id=...) repeated for every naming_id, but resolved with a single query."""
+    naming_ids = [upper_if_exists(x) for x in naming_ids]
+    result = await find_raw(Variant, VariantsProjection, {"aliases.name": {"$in": naming_ids}})
+    return result
+
+
+@kb_cached
+async def get_variants_by_effect_ids(effect_ids: List[str]):
+    """Same as get_variants(effect_id=...) repeated for every effect_id, but resolved with a single query."""
+    effect_ids = [PydanticObjectId(x) for x in effect_ids]
+    result = await find_raw(Variant, VariantsProjection, {"effects": {"$in": effect_ids}})
+    return result
 
 
+@kb_cached
 async def get_namings(variant_id: Optional[str] = None
                       , limit: Optional[int] = None, page: Optional[int] = None
                       , organization: Optional[str] = None
@@ -162,6 +195,7 @@ async def get_namings(variant_id: Optional[str] = None
     return result
 
 
+@kb_cached
 async def get_naming(naming_id: str):
     # '''
     # [{$match: {
@@ -227,785 +261,133 @@ async def get_contexts(variant_id: Optional[str] = None
     owner = upper_if_exists(owner)
     rule_description = lower_if_exists(rule_description)
     pagination = OptionalPagination(limit, page)
-    query_composer = FilterIntersection()
-    if variant_id:
-        #   PIPELINE FOR QUERYING VARIANT ID
-        '''
-        [{$match: {
-          _id: "B.1.621"
-        }}, {$project: {
-          characterization: {$concatArrays: ["$org_2_aa_changes", "$org_2_nuc_changes"]}
-        }}, {$project: {
-          org: "$characterization.org"
-        }}, {$unwind: {
-          path: "$org",
-          preserveNullAndEmptyArrays: false
-        }}, {$project: {
-          "context_id": {$concat: [{$toString: "$_id"}, "_" , "$org"]},
-          "owner": "$org"
-        }}, {$group: {
-          _id: {
-            context_id: "$context_id",
-            owner: "$owner"
-          }
-        }}, {$lookup: {
-          from: 'rule',
-          localField: '_id.owner',
-          foreignField: 'owner',
-          as: 'joined'
-        }}, {$unwind: {
-          path: "$joined",
-          preserveNullAndEmptyArrays: false
-        }}, {$project: {
-          context_id: "$_id.context_id",
-          owner: "$_id.owner",
-          rule_description: "$joined.rule",
-          _id: 0
-        }}]
-        '''
-        pipeline_4_variant_id = [
-            {
-                '$match': {
-                    '_id': variant_id
-                }
-            }, {
-                '$project': {
-                    'characterization': {
-                        '$concatArrays': [
-                            '$org_2_aa_changes', '$org_2_nuc_changes'
-                        ]
-                    }
-                }
-            }, {
-                '$project': {
-                    'org': '$characterization.org'
-                }
-            }, {
-                '$unwind': {
-                    'path': '$org',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$project': {
-                    'context_id': {
-                        '$concat': [
-                            {
-                                '$toString': '$_id'
-                            }, '_', '$org'
-                        ]
-                    },
-                    'owner': '$org'
-                }
-            }, {
-                '$group': {
-                    '_id': {
-                        'context_id': '$context_id',
-                        'owner': '$owner'
-                    }
-                }
-            }, {
-                '$lookup': {
-                    'from': 'rule',
-                    'localField': '_id.owner',
-                    'foreignField': 'owner',
-                    'as': 'joined'
-                }
-            }, {
-                '$unwind': {
-                    'path': '$joined',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$project': {
-                    'context_id': '$_id.context_id',
-                    'owner': '$_id.owner',
-                    'rule_description': '$joined.rule',
-                    '_id': 0
-                }
-            }]
-        result = await Variant.aggregate(pipeline_4_variant_id).to_list()
-        query_composer.add_filter(variant_id, result)
+    context_index = get_context_index()
+    context_ids = context_index.context_ids(variant_id, aa_positional_change_id, nuc_positional_mutation_id, owner)
+    result = context_index.contexts(context_ids, rule_description)
+    if pagination:
+        return result[pagination.first_idx:pagination.last_idx]
+    else:
+        return result
+
+
+async def get_context(context_id: str):
+    context_id = upper_if_exists(context_id)
+    context_index = get_context_index()
+    if context_id not in context_index:
+        return []
+    return [{"context_id": x["context_id"], "owner": x["owner"], "rule": x["rule_description"]}
+            for x in context_index.contexts([context_id])]
+
+
+@kb_cached
+async def get_effects(variant_id: Optional[str] = None
+                      , aa_positional_change_id: Optional[str] = None
+                      , evidence_id: Optional[str] = None
+                      , aa_change_group_id: Optional[str] = None
+                      , limit: Optional[int] = None, page: Optional[int] = None
+                      , _type: Optional[str] = None
+                      , lv: Optional[str] = None
+                      , method: Optional[str] = None):
+    variant_id = upper_if_exists(variant_id)
+    aa_positional_change_id = upper_if_exists(aa_positional_change_id)
+    _type = lower_if_exists(_type)
+    lv = lower_if_exists(lv)
+    method = lower_if_exists(method)
+    pagination = OptionalPagination(limit, page)
+    effects_of_aa_change = None
     if aa_positional_change_id:
-        #       PIPELINE FOR QUERYING BY NUC OR AA CHANGE ID
-        # [{$match: {
-        #   "org_2_aa_changes.changes": {"$elemMatch": {"$eq": "NSP5:K90R"}}
-        # }}, {$project: {
-        #   org_2_aa_changes: 1
-        # }}, {$unwind: {
-        #   path: "$org_2_aa_changes",
-        #   preserveNullAndEmptyArrays: false
-        # }}, {$match: {
-        #   "org_2_aa_changes.changes": {"$elemMatch": {"$eq": "NSP5:K90R"}}
-        # }}, {$project: {
-        #   org: "$org_2_aa_changes.org"
-        # }}, {$project: {
-        #   "context_id": {$concat: [{$toString: "$_id"}, "_" , "$org"]},
-        #   "owner": "$org"
-        # }}, {$group: {
-        #   _id: {
-        #     context_id: "$context_id",
-        #     owner: "$owner"
-        #   }
-        # }}, {$lookup: {
-        #   from: 'rule',
-        #   localField: '_id.owner',
-        #   foreignField: 'owner',
-        #   as: 'joined'
-        # }}, {$unwind: {
-        #   path: "$joined",
-        #   preserveNullAndEmptyArrays: false
-        # }}, {$project: {
-        #   context_id: "$_id.context_id",
-        #   owner: "$_id.owner",
-        #   rule_description: "$joined.rule",
-        #   _id: 0
-        # }}]
-        pipeline_4_aa_change = [
-            {
-                '$match': {
-                    'org_2_aa_changes.changes': {
-                        '$elemMatch': {
-                            '$eq': aa_positional_change_id
-                        }
+        effects_of_aa_change = await aggregate_raw(Effect, EffectProjection,
+            [
+                {
+                    '$match': {
+                        'aa_changes': [aa_positional_change_id]
                     }
-                }
-            }, {
+                }, {
                 '$project': {
-                    'org_2_aa_changes': 1
-                }
-            }, {
-                '$unwind': {
-                    'path': '$org_2_aa_changes',
-                    'preserveNullAndEmptyArrays': False
+                    'aa_changes': 0
                 }
-            }, {
+            }])
+    effects_of_var = None
+    if variant_id:
+        effects_of_var = await aggregate_raw(Variant, EffectProjection,
+            [{
                 '$match': {
-                    'org_2_aa_changes.changes': {
-                        '$elemMatch': {
-                            '$eq': aa_positional_change_id
-                        }
-                    }
-                }
-            }, {
-                '$project': {
-                    'org': '$org_2_aa_changes.org'
-                }
-            }, {
-                '$project': {
-                    'context_id': {
-                        '$concat': [
-                            {
-                                '$toString': '$_id'
-                            }, '_', '$org'
-                        ]
-                    },
-                    'owner': '$org'
-                }
-            }, {
-                '$group': {
-                    '_id': {
-                        'context_id': '$context_id',
-                        'owner': '$owner'
-                    }
+                    '_id': variant_id
                 }
             }, {
                 '$lookup': {
-                    'from': 'rule',
-                    'localField': '_id.owner',
-                    'foreignField': 'owner',
-                    'as': 'joined'
-                }
-            }, {
-                '$unwind': {
-                    'path': '$joined',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$project': {
-                    'context_id': '$_id.context_id',
-                    'owner': '$_id.owner',
-                    'rule_description': '$joined.rule',
-                    '_id': 0
-                }
-            }]
-        result = await Variant.aggregate(pipeline_4_aa_change).to_list()
-        query_composer.add_filter(aa_positional_change_id, result)
-    if nuc_positional_mutation_id:
-        '''
-              PIPELINE FOR QUERYING BY NUC OR AA CHANGE ID
-        [{$match: {
-          "org_2_nuc_changes.changes": {"$elemMatch": {"$eq": "G174T"}}
-        }}, {$project: {
-          org_2_nuc_changes: 1
-        }}, {$unwind: {
-          path: "$org_2_nuc_changes",
-          preserveNullAndEmptyArrays: false
-        }}, {$match: {
-          "org_2_nuc_changes.changes": {"$elemMatch": {"$eq": "G174T"}}
-        }}, {$project: {
-          org: "$org_2_nuc_changes.org"
-        }}, {$unwind: {
-          path: "$org",
-          preserveNullAndEmptyArrays: false
-        }}, {$project: {
-          "context_id": {$concat: [{$toString: "$_id"}, "_" , "$org"]},
-          "owner": "$org"
-        }}, {$group: {
-          _id: {
-            context_id: "$context_id",
-            owner: "$owner"
-          }
-        }}, {$lookup: {
-          from: 'rule',
-          localField: '_id.owner',
-          foreignField: 'owner',
-          as: 'joined'
-        }}, {$unwind: {
-          path: "$joined",
-          preserveNullAndEmptyArrays: false
-        }}, {$project: {
-          context_id: "$_id.context_id",
-          owner: "$_id.owner",
-          rule_description: "$joined.rule",
-          _id: 0
-        }}]
-        '''
-        pipeline_4_nuc_change_id = [
-            {
-                '$match': {
-                    'org_2_nuc_changes.changes': {
-                        '$elemMatch': {
-                            '$eq': nuc_positional_mutation_id
-                        }
-                    }
-                }
-            }, {
-                '$project': {
-                    'org_2_nuc_changes': 1
-                }
-            }, {
-                '$unwind': {
-                    'path': '$org_2_nuc_changes',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$match': {
-                    'org_2_nuc_changes.changes': {
-                        '$elemMatch': {
-                            '$eq': nuc_positional_mutation_id
-                        }
-                    }
+                    'from': Effect.Collection.name,
+                    'localField': 'effects',
+                    'foreignField': '_id',
+                    'as': 'joinedEffects'
                 }
             }, {
-                '$project': {
-                    'org': '$org_2_nuc_changes.org'
+                '$replaceWith': {
+                    'newRoot': '$joinedEffects'
                 }
             }, {
                 '$unwind': {
-                    'path': '$org',
+                    'path': '$newRoot',
                     'preserveNullAndEmptyArrays': False
                 }
             }, {
-                '$project': {
-                    'context_id': {
-                        '$concat': [
-                            {
-                                '$toString': '$_id'
-                            }, '_', '$org'
-                        ]
-                    },
-                    'owner': '$org'
-                }
-            }, {
-                '$group': {
-                    '_id': {
-                        'context_id': '$context_id',
-                        'owner': '$owner'
-                    }
-                }
-            }, {
-                '$lookup': {
-                    'from': 'rule',
-                    'localField': '_id.owner',
-                    'foreignField': 'owner',
-                    'as': 'joined'
+                '$replaceWith': {
+                    '_id': '$newRoot._id',
+                    'type': '$newRoot.type',
+                    'lv': '$newRoot.lv',
+                    'method': '$newRoot.method'
                 }
-            }, {
-                '$unwind': {
-                    'path': '$joined',
-                    'preserveNullAndEmptyArrays': False
+            }])
+    effects_of_source = None
+    if evidence_id:
+        effects_of_source = await aggregate_raw(EffectSource, EffectProjection,
+            [{
+                '$match': {
+                    '_id': PydanticObjectId(evidence_id)
                 }
             }, {
                 '$project': {
-                    'context_id': '$_id.context_id',
-                    'owner': '$_id.owner',
-                    'rule_description': '$joined.rule',
+                    'effect_ids': 1,
                     '_id': 0
                 }
-            }]
-        result = await Variant.aggregate(pipeline_4_nuc_change_id).to_list()
-        query_composer.add_filter(nuc_positional_mutation_id, result)
-    if owner:
-        '''
-        [{$project: {
-          characterization: {
-            $concatArrays: ["$org_2_aa_changes", "$org_2_nuc_changes"]
-          }
-        }}, {$project: {
-          org: "$characterization.org"
-        }}, {$unwind: {
-          path: "$org",
-          preserveNullAndEmptyArrays: false
-        }}, {$match: {
-          org: "phe"
-        }}, {$project: {
-          "context_id": {
-            $concat: [{
-              $toString: "$_id"
-            }, "_", "$org"]
-          },
-          "owner": "$org"
-        }}, {$group: {
-          _id: {
-            context_id: "$context_id",
-            owner: "$owner"
-          }
-        }}, {$lookup: {
-          from: 'rule',
-          localField: '_id.owner',
-          foreignField: 'owner',
-          as: 'joined'
-        }}, {$unwind: {
-          path: "$joined",
-          preserveNullAndEmptyArrays: false
-        }}, {$project: {
-          context_id: "$_id.context_id",
-          owner: "$_id.owner",
-          rule_description: "$joined.rule",
-          _id: 0
-        }}]
-        '''
-        pipeline_4_owner = [
-            {
-                '$project': {
-                    'characterization': {
-                        '$concatArrays': [
-                            '$org_2_aa_changes', '$org_2_nuc_changes'
-                        ]
-                    }
-                }
-            }, {
-                '$project': {
-                    'org': '$characterization.org'
-                }
             }, {
                 '$unwind': {
-                    'path': '$org',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$match': {
-                    'org': owner
-                }
-            }, {
-                '$project': {
-                    'context_id': {
-                        '$concat': [
-                            {
-                                '$toString': '$_id'
-                            }, '_', '$org'
-                        ]
-                    },
-                    'owner': '$org'
-                }
-            }, {
-                '$group': {
-                    '_id': {
-                        'context_id': '$context_id',
-                        'owner': '$owner'
-                    }
+                    'path': '$effect_ids'
                 }
             }, {
                 '$lookup': {
-                    'from': 'rule',
-                    'localField': '_id.owner',
-                    'foreignField': 'owner',
-                    'as': 'joined'
+                    'from': Effect.Collection.name,
+                    'localField': 'effect_ids',
+                    'foreignField': '_id',
+                    'as': 'effect'
                 }
             }, {
-                '$unwind': {
-                    'path': '$joined',
-                    'preserveNullAndEmptyArrays': False
+                '$replaceRoot': {
+                    'newRoot': {
+                        '$first': '$effect'
+                    }
                 }
-            }, {
-                '$project': {
-                    'context_id': '$_id.context_id',
-                    'owner': '$_id.owner',
-                    'rule_description': '$joined.rule',
-                    '_id': 0
-                }
-            }]
-        result = await Variant.aggregate(pipeline_4_owner).to_list()
-        query_composer.add_filter(owner, result)
-    if rule_description:
-        '''
-        [{$project: {
-          characterization: {
-            $concatArrays: ["$org_2_aa_changes", "$org_2_nuc_changes"]
-          }
-        }}, {$project: {
-          org: "$characterization.org"
-        }}, {$unwind: {
-          path: "$org",
-          preserveNullAndEmptyArrays: false
-        }}, {$project: {
-          "context_id": {
-            $concat: [{
-              $toString: "$_id"
-            }, "_", "$org"]
-          },
-          "owner": "$org"
-        }}, {$group: {
-          _id: {
-            context_id: "$context_id",
-            owner: "$owner"
-          }
-        }}, {$lookup: {
-          from: 'rule',
-          localField: '_id.owner',
-          foreignField: 'owner',
-          as: 'joined'
-        }}, {$unwind: {
-          path: "$joined",
-          preserveNullAndEmptyArrays: false
-        }}, {$project: {
-          context_id: "$_id.context_id",
-          owner: "$_id.owner",
-          rule_description: "$joined.rule",
-          _id: 0
-        }}, {$match: {
-          rule_description: /.*BOOOOOH.*/
-        }}]
-        '''
-        pipeline_4_rule_description = [
-            {
-                '$project': {
-                    'characterization': {
-                        '$concatArrays': [
-                            '$org_2_aa_changes', '$org_2_nuc_changes'
-                        ]
-                    }
-                }
-            }, {
-                '$project': {
-                    'org': '$characterization.org'
-                }
-            }, {
-                '$unwind': {
-                    'path': '$org',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$project': {
-                    'context_id': {
-                        '$concat': [
-                            {
-                                '$toString': '$_id'
-                            }, '_', '$org'
-                        ]
-                    },
-                    'owner': '$org'
-                }
-            }, {
-                '$group': {
-                    '_id': {
-                        'context_id': '$context_id',
-                        'owner': '$owner'
-                    }
-                }
-            }, {
-                '$lookup': {
-                    'from': 'rule',
-                    'localField': '_id.owner',
-                    'foreignField': 'owner',
-                    'as': 'joined'
-                }
-            }, {
-                '$unwind': {
-                    'path': '$joined',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$project': {
-                    'context_id': '$_id.context_id',
-                    'owner': '$_id.owner',
-                    'rule_description': '$joined.rule',
-                    '_id': 0
-                }
-            }, {
-                '$match': {
-                    'rule_description': re.compile(rf".*{rule_description}.*")
-                }
-            }]
-        result = await Variant.aggregate(pipeline_4_rule_description).to_list()
-        query_composer.add_filter(rule_description, result)
-
-    query_composer.intersect_results(lambda x: x["context_id"])
-    if query_composer.result() != query_composer.NO_FILTERS:
-        result = query_composer.result()
-    else:
-        '''
-        [{$project: {
-          characterization: {
-            $concatArrays: ["$org_2_aa_changes", "$org_2_nuc_changes"]
-          }
-        }}, {$project: {
-          org: "$characterization.org"
-        }}, {$unwind: {
-          path: "$org",
-          preserveNullAndEmptyArrays: false
-        }}, {$group: {
-          _id: {
-            _id: "$_id",
-            org: "$org"
-          }
-        }}, {$project: {
-          "context_id": {
-            $concat: [{
-              $toString: "$_id._id"
-            }, "_", "$_id.org"]
-          },
-          "owner": "$_id.org",
-          "_id": 0
-        }}, {$lookup: {
-          from: 'rule',
-          localField: 'owner',
-          foreignField: 'owner',
-          as: 'joined'
-        }}, {$unwind: {
-          path: "$joined",
-          preserveNullAndEmptyArrays: false
-        }}, {$project: {
-          context_id: "$context_id",
-          owner: "$owner",
-          rule_description: "$joined.rule",
-          _id: 0
-        }}]
-        '''
-        pipeline_no_filters = [
-            {
-                '$project': {
-                    'characterization': {
-                        '$concatArrays': [
-                            '$org_2_aa_changes', '$org_2_nuc_changes'
-                        ]
-                    }
-                }
-            }, {
-                '$project': {
-                    'org': '$characterization.org'
-                }
-            }, {
-                '$unwind': {
-                    'path': '$org',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$group': {
-                    '_id': {
-                        '_id': '$_id',
-                        'org': '$org'
-                    }
-                }
-            }, {
-                '$project': {
-                    'context_id': {
-                        '$concat': [
-                            {
-                                '$toString': '$_id._id'
-                            }, '_', '$_id.org'
-                        ]
-                    },
-                    'owner': '$_id.org',
-                    '_id': 0
-                }
-            }, {
-                '$lookup': {
-                    'from': 'rule',
-                    'localField': 'owner',
-                    'foreignField': 'owner',
-                    'as': 'joined'
-                }
-            }, {
-                '$unwind': {
-                    'path': '$joined',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$project': {
-                    'context_id': '$context_id',
-                    'owner': '$owner',
-                    'rule_description': '$joined.rule',
-                    '_id': 0
-                }
-            }
-        ]
-        result = await Variant.aggregate(pipeline_no_filters).to_list()
-    if pagination:
-        return sorted(result, key=lambda x: x["context_id"])[pagination.first_idx:pagination.last_idx]
-    else:
-        return result
-
-
-async def get_context(context_id: str):
-    context_id = upper_if_exists(context_id)
-    variant_id, owner = context_id.split("_", maxsplit=1)
-    context_exists = await Variant.find({
-        '_id': variant_id,
-        '$or': [
-            {
-                'org_2_aa_changes.org': owner
-            }, {
-                'org_2_nuc_changes.org': owner
-            }
-        ]
-    }).to_list()
-    if context_exists:
-        rules = await Rule.find({"owner": owner}, projection_model=RuleProjection).to_list()
-        rules = [{"context_id": context_id, "owner": x.owner, "rule": x.rule} for x in rules]
-        return rules
-    else:
-        return []
-
-
-async def get_effects(variant_id: Optional[str] = None
-                      , aa_positional_change_id: Optional[str] = None
-                      , evidence_id: Optional[str] = None
-                      , aa_change_group_id: Optional[str] = None
-                      , limit: Optional[int] = None, page: Optional[int] = None
-                      , _type: Optional[str] = None
-                      , lv: Optional[str] = None
-                      , method: Optional[str] = None):
-    variant_id = upper_if_exists(variant_id)
-    aa_positional_change_id = upper_if_exists(aa_positional_change_id)
-    _type = lower_if_exists(_type)
-    lv = lower_if_exists(lv)
-    method = lower_if_exists(method)
-    pagination = OptionalPagination(limit, page)
-    effects_of_aa_change = None
-    if aa_positional_change_id:
-        effects_of_aa_change = await Effect.aggregate(
-            [
-                {
-                    '$match': {
-                        'aa_changes': [aa_positional_change_id]
-                    }
-                }, {
-                '$project': {
-                    'aa_changes': 0
-                }
-            }], projection_model=EffectProjection).to_list()
-        effects_of_aa_change = list(map(vars, effects_of_aa_change))
-    effects_of_var = None
-    if variant_id:
-        effects_of_var = await Variant.aggregate(
-            [{
-                '$match': {
-                    '_id': variant_id
-                }
-            }, {
-                '$lookup': {
-                    'from': Effect.Collection.name,
-                    'localField': 'effects',
-                    'foreignField': '_id',
-                    'as': 'joinedEffects'
-                }
-            }, {
-                '$replaceWith': {
-                    'newRoot': '$joinedEffects'
-                }
-            }, {
-                '$unwind': {
-                    'path': '$newRoot',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$replaceWith': {
-                    '_id': '$newRoot._id',
-                    'type': '$newRoot.type',
-                    'lv': '$newRoot.lv',
-                    'method': '$newRoot.method'
-                }
-            }], projection_model=EffectProjection).to_list()
-        effects_of_var = list(map(vars, effects_of_var))
-    effects_of_source = None
-    if evidence_id:
-        effects_of_source = await EffectSource.aggregate(
-            [{
-                '$match': {
-                    '_id': PydanticObjectId(evidence_id)
-                }
-            }, {
-                '$project': {
-                    'effect_ids': 1,
-                    '_id': 0
-                }
-            }, {
-                '$unwind': {
-                    'path': '$effect_ids'
-                }
-            }, {
-                '$lookup': {
-                    'from': Effect.Collection.name,
-                    'localField': 'effect_ids',
-                    'foreignField': '_id',
-                    'as': 'effect'
-                }
-            }, {
-                '$replaceRoot': {
-                    'newRoot': {
-                        '$first': '$effect'
-                    }
-                }
-            }], projection_model=EffectProjection).to_list()
-        effects_of_source = list(map(vars, effects_of_source))
+            }])
     effects_of_aa_group = None
     if aa_change_group_id:
         # {
         #   _id: ObjectId('61708df43578fd55aa616923'),
         #   "aa_changes.1": {$exists: true}
         # }
-        effects_of_aa_group = await Effect.find(
+        effects_of_aa_group = await find_raw(Effect, EffectProjection,
             {
                 '_id': PydanticObjectId(aa_change_group_id),
                 'aa_changes.1': {'$exists': True}
-            }
-            , projection_model=EffectProjection).to_list()
-        effects_of_aa_group = list(map(vars, effects_of_aa_group))
+            })
     effects_of_type = None
     if _type:
-        effects_of_type = await Effect.find(
-            {
-                'type': _type
-            }
-            , projection_model=EffectProjection).to_list()
-        effects_of_type = list(map(vars, effects_of_type))
+        effects_of_type = await find_raw(Effect, EffectProjection, {'type': _type})
     effects_of_level = None
     if lv:
-        effects_of_level = await Effect.find(
-            {
-                'lv': lv
-            }
-            , projection_model=EffectProjection).to_list()
-        effects_of_level = list(map(vars, effects_of_level))
+        effects_of_level = await find_raw(Effect, EffectProjection, {'lv': lv})
     effects_of_method = None
     if method:
-        effects_of_method = await Effect.find(
-            {
-                'method': method
-            }
-            , projection_model=EffectProjection).to_list()
-        effects_of_method = list(map(vars, effects_of_method))
+        effects_of_method = await find_raw(Effect, EffectProjection, {'method': method})
 
     filter_intersection = FilterIntersection() \
         .add_filter(aa_positional_change_id, effects_of_aa_change) \
@@ -1015,73 +397,155 @@ async def get_effects(variant_id: Optional[str] = None
         .add_filter(_type, effects_of_type) \
         .add_filter(lv, effects_of_level) \
         .add_filter(method, effects_of_method) \
-        .intersect_results(lambda an_effect: an_effect.effect_id)
+        .intersect_results(lambda an_effect: an_effect["effect_id"])
     if filter_intersection.result() != FilterIntersection.NO_FILTERS:
         result = filter_intersection.result()
     else:
-        result = await Effect.find_all(projection_model=EffectProjection).to_list()
-        result = list(map(vars, result))
+        result = await find_raw(Effect, EffectProjection, {})
     if pagination:
         return sorted(result, key=lambda x: x["effect_id"])[pagination.first_idx:pagination.last_idx]
     else:
         return result
 
 
+@kb_cached
 async def get_effect(effect_id: Optional[str] = None):
-    result = await Effect.find({"_id": PydanticObjectId(effect_id)}, projection_model=EffectProjection).to_list()
-    return list(map(vars, result))
+    result = await find_raw(Effect, EffectProjection, {"_id": PydanticObjectId(effect_id)})
+    return result
 
 
-async def get_evidences(effect_id: Optional[str] = None
-                        , limit: Optional[int] = None, page: Optional[int] = None
-                        , citation: Optional[str] = None
-                        , _type: Optional[str] = None
-                        , uri: Optional[str] = None
-                        , publisher: Optional[str] = None):
+@kb_cached
+async def get_effects_by_variant_ids(variant_ids: List[str]):
+    """Same as get_effects(variant_id=...) repeated for every variant_id, but resolved with a single pipeline."""
+    variant_ids = [upper_if_exists(x) for x in variant_ids]
+    result = await aggregate_raw(Variant, EffectProjection,
+        [{
+            '$match': {
+                '_id': {'$in': variant_ids}
+            }
+        }, {
+            '$lookup': {
+                'from': Effect.Collection.name,
+                'localField': 'effects',
+                'foreignField': '_id',
+                'as': 'joinedEffects'
+            }
+        }, {
+            '$replaceWith': {
+                'newRoot': '$joinedEffects'
+            }
+        }, {
+            '$unwind': {
+                'path': '$newRoot',
+                'preserveNullAndEmptyArrays': False
+            }
+        }, {
+            '$replaceWith': {
+                '_id': '$newRoot._id',
+                'type': '$newRoot.type',
+                'lv': '$newRoot.lv',
+                'method': '$newRoot.method'
+            }
+        }])
+    return result
+
+
+@kb_cached
+async def get_effects_by_evidence_ids(evidence_ids: List[str]):
+    """Same as get_effects(evidence_id=...) repeated for every evidence_id, but resolved with a single pipeline."""
+    evidence_ids = [PydanticObjectId(x) for x in evidence_ids]
+    result = await aggregate_raw(EffectSource, EffectProjection,
+        [{
+            '$match': {
+                '_id': {'$in': evidence_ids}
+            }
+        }, {
+            '$project': {
+                'effect_ids': 1,
+                '_id': 0
+            }
+        }, {
+            '$unwind': {
+                'path': '$effect_ids'
+            }
+        }, {
+            '$lookup': {
+                'from': Effect.Collection.name,
+                'localField': 'effect_ids',
+                'foreignField': '_id',
+                'as': 'effect'
+            }
+        }, {
+            '$replaceRoot': {
+                'newRoot': {
+                    '$first': '$effect'
+                }
+            }
+        }])
+    return result
+
+
+def _evidences_query(effect_id: Optional[str] = None
+                     , citation: Optional[str] = None
+                     , _type: Optional[str] = None
+                     , uri: Optional[str] = None
+                     , publisher: Optional[str] = None) -> MongoQuery:
     citation = lower_if_exists(citation)
     _type = lower_if_exists(_type)
     publisher = lower_if_exists(publisher)
-    pagination = OptionalPagination(limit, page)
-    query_composer = FilterIntersection()
+    query = MongoQuery(EffectSource, EvidenceProjection)
     if effect_id:
-        result = await EffectSource.find({'effect_ids': {'$elemMatch': {'$eq': PydanticObjectId(effect_id)}}}
-                                         , projection_model=EvidenceProjection).to_list()
-        query_composer.add_filter(effect_id, result)
+        query.where({'effect_ids': {'$elemMatch': {'$eq': PydanticObjectId(effect_id)}}})
     if citation:
-        result = await EffectSource.find({'citation': citation}
-                                         , projection_model=EvidenceProjection).to_list()
-        query_composer.add_filter(citation, result)
+        query.where({'citation': citation})
     if _type:
-        result = await EffectSource.find({'type': _type}
-                                         , projection_model=EvidenceProjection).to_list()
-        query_composer.add_filter(_type, result)
+        query.where({'type': _type})
     if uri:
-        result = await EffectSource.find({'uri': uri}
-                                         , projection_model=EvidenceProjection).to_list()
-        query_composer.add_filter(uri, result)
+        query.where({'uri': uri})
     if publisher:
-        result = await EffectSource.find({'publisher': publisher}
-                                         , projection_model=EvidenceProjection).to_list()
-        query_composer.add_filter(publisher, result)
+        query.where({'publisher': publisher})
+    return query
 
-    query_composer.intersect_results(lambda x: x["evidence_id"])
-    if query_composer.result() != FilterIntersection.NO_FILTERS:
-        result = query_composer.result()
-    else:
-        result = await EffectSource.find_all(projection_model=EvidenceProjection).to_list()
-    result = list(map(vars, result))
-    if pagination:
-        return sorted(result, key=lambda x: x["evidence_id"])[pagination.first_idx:pagination.last_idx]
-    else:
-        return result
+
+@kb_cached
+async def get_evidences(effect_id: Optional[str] = None
+                        , limit: Optional[int] = None, page: Optional[int] = None
+                        , citation: Optional[str] = None
+                        , _type: Optional[str] = None
+                        , uri: Optional[str] = None
+                        , publisher: Optional[str] = None):
+    pagination = OptionalPagination(limit, page)
+    query = _evidences_query(effect_id, citation, _type, uri, publisher)
+    result = await query.to_list(pagination)
+    return result
 
 
+@kb_cached
 async def get_evidence(evidence_id: str):
-    result = await EffectSource.find({"_id": PydanticObjectId(evidence_id)},
-                                   projection_model=EvidenceProjection).to_list()
-    return list(map(vars, result))
+    result = await find_raw(EffectSource, EvidenceProjection, {"_id": PydanticObjectId(evidence_id)})
+    return result
+
+
+@kb_cached
+async def get_evidences_by_effect_ids(effect_ids: List[str]):
+    """Same as get_evidences(effect_id=...) repeated for every effect_id, but resolved with a single query."""
+    effect_ids = [PydanticObjectId(x) for x in effect_ids]
+    result = await find_raw(EffectSource, EvidenceProjection, {'effect_ids': {'$in': effect_ids}})
+    return result
+
 
+async def _changes_by_ids(document_class, projection_model, id_field: str, change_ids: List[str]) -> List[dict]:
+    """
+    Reads the NUCChange or AAChange documents with the given change_ids with a single query, in the order of
+    change_ids (ids without a document are skipped). id_field is the field of projection_model holding the change_id.
+    """
+    change_ids = list(dict.fromkeys(change_ids))
+    changes = await find_raw(document_class, projection_model, {"change_id": {"$in": change_ids}})
+    change_of_id = {x[id_field]: x for x in changes}
+    return [change_of_id[x] for x in change_ids if x in change_of_id]
 
+
+@kb_cached
 async def get_nuc_positional_mutations(context_id: Optional[str] = None
                                        , nuc_annotation_id: Optional[str] = None
                                        , nuc_mutation_id: Optional[str] = None
@@ -1100,186 +564,19 @@ async def get_nuc_positional_mutations(context_id: Optional[str] = None
     query_composer = FilterIntersection()
     mutations_of_context = None
     if context_id:
-        variant_id, owner = context_id.split("_", maxsplit=1)
-        '''
-        [{$match: {
-          _id: "B.1.351",
-          "org_2_nuc_changes.org": "phe"
-        }}, {$project: {
-          org_2_nuc_changes: 1
-        }}, {$unwind: {
-          path: "$org_2_nuc_changes",
-          preserveNullAndEmptyArrays: false
-        }}, {$match: {
-          "org_2_nuc_changes.org": "phe"
-        }}, {$project: {
-          change: "$org_2_nuc_changes.changes"
-        }}, {$unwind: {
-          path: "$change",
-          preserveNullAndEmptyArrays: false
-        }}, {$lookup: {
-          from: 'nuc_change',
-          localField: 'change',
-          foreignField: 'change_id',
-          as: 'joined'
-        }}, {$project: {
-          nuc_positional_mutation_id: {$first: "$joined.change_id"},
-          reference: {$first: "$joined.ref"},
-          position: {$first: "$joined.pos"},
-          alternative: {$first: "$joined.alt"},
-          type: {$first: "$joined.type"},
-          length: {$first: "$joined.length"},
-          _id: 0
-        }}]
-        '''
-        mutations_of_context = await Variant.aggregate([
-            {
-                '$match': {
-                    '_id': variant_id,
-                    'org_2_nuc_changes.org': owner
-                }
-            }, {
-                '$project': {
-                    'org_2_nuc_changes': 1
-                }
-            }, {
-                '$unwind': {
-                    'path': '$org_2_nuc_changes',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$match': {
-                    'org_2_nuc_changes.org': owner
-                }
-            }, {
-                '$project': {
-                    'change': '$org_2_nuc_changes.changes'
-                }
-            }, {
-                '$unwind': {
-                    'path': '$change',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$lookup': {
-                    'from': 'nuc_change',
-                    'localField': 'change',
-                    'foreignField': 'change_id',
-                    'as': 'joined'
-                }
-            }, {
-                '$project': {
-                    'nuc_positional_mutation_id': {
-                        '$first': '$joined.change_id'
-                    },
-                    'reference': {
-                        '$first': '$joined.ref'
-                    },
-                    'position': {
-                        '$first': '$joined.pos'
-                    },
-                    'alternative': {
-                        '$first': '$joined.alt'
-                    },
-                    'type': {
-                        '$first': '$joined.type'
-                    },
-                    'length': {
-                        '$first': '$joined.length'
-                    },
-                    '_id': 0
-                }
-            }]
-        ).to_list()
+        mutations_of_context = await _changes_by_ids(NUCChange, NUCPositionalMutationProjection,
+                                                     "nuc_positional_mutation_id",
+                                                     get_context_index().nuc_changes_of(context_id))
 
     mutations_in_annotation = None
     if nuc_annotation_id:
-        # [{$match: {
-        #   _id: ObjectId('617bca3a896e9264bab572cf')
-        # }}, {$lookup: {
-        #   from: 'nuc_change',
-        #   let: { start_on_ref: "$start_on_ref", stop_on_ref: "$stop_on_ref"},
-        #   pipeline: [
-        #       {
-        #         $match: {
-        #           $expr: {
-        #             $and: [
-        #               {$gte: ["$pos", "$$start_on_ref"]},
-        #               {$lte: ["$pos", "$$stop_on_ref"]}
-        #             ]
-        #           }
-        #         }
-        #       }
-        #     ],
-        #   as: "joined"
-        # }}, {$project: {
-        #   joined: "$joined"
-        # }}, {$unwind: {
-        #   path: "$joined",
-        #   preserveNullAndEmptyArrays: false
-        # }}, {$project: {
-        #   nuc_positional_mutation_id: "$joined.change_id",
-        #   reference: "$joined.ref",
-        #   position: "$joined.pos",
-        #   alternative: "$joined.alt",
-        #   type: "$joined.type",
-        #   length: "$joined.length",
-        #   _id: 0
-        # }}]
-        mutations_in_annotation = await Structure.aggregate([
-            {
-                '$match': {
-                    '_id': PydanticObjectId(nuc_annotation_id)
-                }
-            }, {
-                '$lookup': {
-                    'from': 'nuc_change',
-                    'let': {
-                        'start_on_ref': '$start_on_ref',
-                        'stop_on_ref': '$stop_on_ref'
-                    },
-                    'pipeline': [
-                        {
-                            '$match': {
-                                '$expr': {
-                                    '$and': [
-                                        {
-                                            '$gte': [
-                                                '$pos', '$$start_on_ref'
-                                            ]
-                                        }, {
-                                            '$lte': [
-                                                '$pos', '$$stop_on_ref'
-                                            ]
-                                        }
-                                    ]
-                                }
-                            }
-                        }
-                    ],
-                    'as': 'joined'
-                }
-            }, {
-                '$project': {
-                    'joined': '$joined'
-                }
-            }, {
-                '$unwind': {
-                    'path': '$joined',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$project': {
-                    'nuc_positional_mutation_id': '$joined.change_id',
-                    'reference': '$joined.ref',
-                    'position': '$joined.pos',
-                    'alternative': '$joined.alt',
-                    'type': '$joined.type',
-                    'length': '$joined.length',
-                    '_id': 0
-                }
-            }]
-        ).to_list()
+        # the index is keyed by the lowercase hex of the ObjectId, which the id may be given in any case
+        annotation = get_nuc_annotation_index().annotation(str(PydanticObjectId(nuc_annotation_id)))
+        if annotation:
+            mutations_in_annotation = await find_raw(NUCChange, NUCPositionalMutationProjection,
+                {"pos": {"$gte": annotation["start_on_ref"], "$lte": annotation["stop_on_ref"]}})
+        else:
+            mutations_in_annotation = []
 
     mutation_matching_nuc_mutation_id = None
     if nuc_mutation_id:
@@ -1288,33 +585,25 @@ async def get_nuc_positional_mutations(context_id: Optional[str] = None
 
     mutations_with_reference = None
     if reference:
-        mutations_with_reference = await NUCChange\
-            .find({"ref": reference.upper()}, projection_model=NUCPositionalMutationProjection).to_list()
-        mutations_with_reference = list(map(vars, mutations_with_reference))
+        mutations_with_reference = await find_raw(NUCChange, NUCPositionalMutationProjection,
+                                                  {"ref": reference.upper()})
 
     mutations_in_position = None
     if position is not None:
-        mutations_in_position = await NUCChange\
-            .find({"pos": position}, projection_model=NUCPositionalMutationProjection).to_list()
-        mutations_in_position = list(map(vars, mutations_in_position))
+        mutations_in_position = await find_raw(NUCChange, NUCPositionalMutationProjection, {"pos": position})
 
     mutations_with_alternative = None
     if alternative:
-        mutations_with_alternative = await NUCChange\
-            .find({"alt": alternative.upper()}, projection_model=NUCPositionalMutationProjection).to_list()
-        mutations_with_alternative = list(map(vars, mutations_with_alternative))
+        mutations_with_alternative = await find_raw(NUCChange, NUCPositionalMutationProjection,
+                                                    {"alt": alternative.upper()})
 
     mutations_of_type = None
     if _type:
-        mutations_of_type = await NUCChange\
-            .find({"type": _type.upper()}, projection_model=NUCPositionalMutationProjection).to_list()
-        mutations_of_type = list(map(vars, mutations_of_type))
+        mutations_of_type = await find_raw(NUCChange, NUCPositionalMutationProjection, {"type": _type.upper()})
 
     mutations_with_length = None
     if length is not None:
-        mutations_with_length = await NUCChange\
-            .find({"length": length}, projection_model=NUCPositionalMutationProjection).to_list()
-        mutations_with_length = list(map(vars, mutations_with_length))
+        mutations_with_length = await find_raw(NUCChange, NUCPositionalMutationProjection, {"length": length})
 
     query_composer \
         .add_filter(context_id, mutations_of_context) \
@@ -1330,19 +619,27 @@ async def get_nuc_positional_mutations(context_id: Optional[str] = None
     if query_composer.result() != FilterIntersection.NO_FILTERS:
         result = query_composer.result()
     else:
-        result = await NUCChange.find_all(projection_model=NUCPositionalMutationProjection).to_list()
-        result = list(map(vars, result))
+        result = await find_raw(NUCChange, NUCPositionalMutationProjection, {})
     if pagination:
         return sorted(result, key=lambda x: x["nuc_positional_mutation_id"])[pagination.first_idx:pagination.last_idx]
     else:
         return result
 
 
+@kb_cached
 async def get_nuc_positional_mutation(nuc_positional_mutation_id: str):
     nuc_positional_mutation_id = upper_if_exists(nuc_positional_mutation_id)
-    result = await NUCChange.find({"change_id": nuc_positional_mutation_id}
-                                , projection_model=NUCPositionalMutationProjection).to_list()
-    return list(map(vars, result))
+    result = await find_raw(NUCChange, NUCPositionalMutationProjection, {"change_id": nuc_positional_mutation_id})
+    return result
+
+
+@kb_cached
+async def get_nuc_positional_mutations_by_nuc_mutation_ids(nuc_mutation_ids: List[str]):
+    """Same as get_nuc_positional_mutations(nuc_mutation_id=...) repeated for every nuc_mutation_id, but resolved
+    with a single query."""
+    change_ids = [upper_if_exists(vcm_nuc_mut_2_kb_nuc_mut(x)) for x in nuc_mutation_ids]
+    result = await find_raw(NUCChange, NUCPositionalMutationProjection, {"change_id": {"$in": change_ids}})
+    return result
 
 
 async def get_aa_positional_changes(context_id: Optional[str] = None
@@ -1367,115 +664,9 @@ async def get_aa_positional_changes(context_id: Optional[str] = None
     pagination = OptionalPagination(limit, page)
     query_composer = FilterIntersection()
     if context_id:
-        variant_id, owner = context_id.split("_", maxsplit=1)
-        '''
-        [{$match: {
-          _id: "B.1.351",
-          "org_2_aa_changes.org": "phe"
-        }}, {$project: {
-          org_2_aa_changes: 1
-        }}, {$unwind: {
-          path: "$org_2_aa_changes",
-          preserveNullAndEmptyArrays: false
-        }}, {$match: {
-          "org_2_aa_changes.org": "phe"
-        }}, {$project: {
-          change: "$org_2_aa_changes.changes"
-        }}, {$unwind: {
-          path: "$change",
-          preserveNullAndEmptyArrays: false
-        }}, {$lookup: {
-          from: 'aa_change',
-          localField: 'change',
-          foreignField: 'change_id',
-          as: 'joined'
-        }}, {$project: {
-          aa_positional_change_id: {
-            $first: "$joined.change_id"
-          },
-          protein_id: {
-            $first: "$joined.protein"
-          },
-          reference: {
-            $first: "$joined.ref"
-          },
-          position: {
-            $first: "$joined.pos"
-          },
-          alternative: {
-            $first: "$joined.alt"
-          },
-          type: {
-            $first: "$joined.type"
-          },
-          length: {
-            $first: "$joined.length"
-          },
-          _id: 0
-        }}]
-        '''
-        aa_changes_of_context = await Variant.aggregate([
-            {
-                '$match': {
-                    '_id': variant_id,
-                    'org_2_aa_changes.org': owner
-                }
-            }, {
-                '$project': {
-                    'org_2_aa_changes': 1
-                }
-            }, {
-                '$unwind': {
-                    'path': '$org_2_aa_changes',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$match': {
-                    'org_2_aa_changes.org': owner
-                }
-            }, {
-                '$project': {
-                    'change': '$org_2_aa_changes.changes'
-                }
-            }, {
-                '$unwind': {
-                    'path': '$change',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$lookup': {
-                    'from': 'aa_change',
-                    'localField': 'change',
-                    'foreignField': 'change_id',
-                    'as': 'joined'
-                }
-            }, {
-                '$project': {
-                    'aa_positional_change_id': {
-                        '$first': '$joined.change_id'
-                    },
-                    'protein_id': {
-                        '$first': '$joined.protein'
-                    },
-                    'reference': {
-                        '$first': '$joined.ref'
-                    },
-                    'position': {
-                        '$first': '$joined.pos'
-                    },
-                    'alternative': {
-                        '$first': '$joined.alt'
-                    },
-                    'type': {
-                        '$first': '$joined.type'
-                    },
-                    'length': {
-                        '$first': '$joined.length'
-                    },
-                    '_id': 0
-                }
-            }]
-        ).to_list()
+        aa_changes_of_context = await _changes_by_ids(AAChange, AAPositionalChangeProjection,
+                                                      "aa_positional_change_id",
+                                                      get_context_index().aa_changes_of(context_id))
         query_composer.add_filter(context_id, aa_changes_of_context)
     if effect_id:
         '''
@@ -1551,10 +742,7 @@ async def get_aa_positional_changes(context_id: Optional[str] = None
             }]).to_list()
         query_composer.add_filter(effect_id, changes_of_effect)
     if protein_id:
-        changes_in_protein = await AAChange \
-            .find({"protein": protein_id}, projection_model=AAPositionalChangeProjection) \
-            .to_list()
-        changes_in_protein = list(map(vars, changes_in_protein))
+        changes_in_protein = await find_raw(AAChange, AAPositionalChangeProjection, {"protein": protein_id})
         query_composer.add_filter(protein_id, changes_in_protein)
 
     if aa_change_group_id:
@@ -1636,17 +824,12 @@ async def get_aa_positional_changes(context_id: Optional[str] = None
     if aa_residue_change_id:
         if len(aa_residue_change_id) != 2:
             raise MyExceptions.unrecognised_aa_residue_change_id
-        aa_changes_matching_residue_change = await AAChange.find(
-            {"ref": aa_residue_change_id[0], "alt": aa_residue_change_id[1]}
-            , projection_model=AAPositionalChangeProjection
-        ).to_list()
-        aa_changes_matching_residue_change = list(map(vars, aa_changes_matching_residue_change))
+        aa_changes_matching_residue_change = await find_raw(AAChange, AAPositionalChangeProjection,
+            {"ref": aa_residue_change_id[0], "alt": aa_residue_change_id[1]})
         query_composer.add_filter(aa_residue_change_id, aa_changes_matching_residue_change)
     if epitope_id:
         async with get_session() as session:
-            vcm_protein = await session.execute(
-                f"select protein_name from epitope natural join epitope_fragment "
-                f"where epi_fragment_id = {epitope_id} and virus_id = 1 limit 1;")
+            vcm_protein = await session.execute(statements.PROTEIN_OF_EPITOPE, {"epitope_id": int(epitope_id)})
             try:
                 vcm_protein = vcm_protein.fetchall()[0]["protein_name"]
             except IndexError:  # no proteins found (the epitope id is wrong)
@@ -1657,32 +840,24 @@ async def get_aa_positional_changes(context_id: Optional[str] = None
         except KeyError:
             return []
         else:
-            aa_changes_over_epitope = await AAChange.find(
-                {"protein": protein}
-                , projection_model=AAPositionalChangeProjection).to_list()
-            aa_changes_over_epitope = list(map(vars, aa_changes_over_epitope))
+            aa_changes_over_epitope = await find_raw(AAChange, AAPositionalChangeProjection, {"protein": protein})
             query_composer.add_filter(epitope_id, aa_changes_over_epitope)
     if aa_change_id:
         query_composer.add_filter(aa_change_id, await get_aa_positional_change(aa_change_id))
     if reference:
-        changes_with_ref = await AAChange\
-            .find({"ref": reference.upper()}, projection_model=AAPositionalChangeProjection).to_list()
+        changes_with_ref = await find_raw(AAChange, AAPositionalChangeProjection, {"ref": reference.upper()})
         query_composer.add_filter(reference, changes_with_ref)
     if position is not None:
-        changes_in_pos = await AAChange\
-            .find({"pos": position}, projection_model=AAPositionalChangeProjection).to_list()
+        changes_in_pos = await find_raw(AAChange, AAPositionalChangeProjection, {"pos": position})
         query_composer.add_filter(position, changes_in_pos)
     if alternative:
-        change_with_alt = await AAChange\
-            .find({"alt": alternative.upper()}, projection_model=AAPositionalChangeProjection).to_list()
+        change_with_alt = await find_raw(AAChange, AAPositionalChangeProjection, {"alt": alternative.upper()})
         query_composer.add_filter(alternative, change_with_alt)
     if _type:
-        changes_of_type = await AAChange\
-            .find({"type": _type.upper()}, projection_model=AAPositionalChangeProjection).to_list()
+        changes_of_type = await find_raw(AAChange, AAPositionalChangeProjection, {"type": _type.upper()})
         query_composer.add_filter(_type, changes_of_type)
     if length is not None:
-        changes_with_len = await AAChange\
-            .find({"length": length}, projection_model=AAPositionalChangeProjection).to_list()
+        changes_with_len = await find_raw(AAChange, AAPositionalChangeProjection, {"length": length})
         query_composer.add_filter(length, changes_with_len)
 
     # intersect results up to here
@@ -1690,62 +865,68 @@ async def get_aa_positional_changes(context_id: Optional[str] = None
     if query_composer.result() != FilterIntersection.NO_FILTERS:
         result = query_composer.result()
     else:
-        result = await AAChange.find_all(projection_model=AAPositionalChangeProjection).to_list()
-        result = list(map(vars, result))
+        result = await find_raw(AAChange, AAPositionalChangeProjection, {})
     if pagination:
         return sorted(result, key=lambda x: x["aa_positional_change_id"])[pagination.first_idx:pagination.last_idx]
     else:
         return result
 
 
+@kb_cached
 async def get_aa_positional_change(aa_positional_change_id: str):
     aa_positional_change_id = upper_if_exists(aa_positional_change_id)
-    result = await AAChange.find({"change_id": aa_positional_change_id}
-                               , projection_model=AAPositionalChangeProjection).to_list()
-    return list(map(vars, result))
+    result = await find_raw(AAChange, AAPositionalChangeProjection, {"change_id": aa_positional_change_id})
+    return result
+
+
+@kb_cached
+async def get_aa_positional_changes_by_aa_change_ids(aa_change_ids: List[str]):
+    """Same as get_aa_positional_changes(aa_change_id=...) repeated for every aa_change_id, but resolved with a single
+    query."""
+    change_ids = [upper_if_exists(x) for x in aa_change_ids]
+    result = await find_raw(AAChange, AAPositionalChangeProjection, {"change_id": {"$in": change_ids}})
+    return result
+
+
+@kb_cached
+async def get_aa_positional_changes_by_protein_ids(protein_ids: List[str]):
+    """Same as get_aa_positional_changes(protein_id=...) repeated for every protein_id, but resolved with a single
+    query."""
+    protein_ids = [upper_if_exists(x) for x in protein_ids]
+    result = await find_raw(AAChange, AAPositionalChangeProjection, {"protein": {"$in": protein_ids}})
+    return result
+
 
+def _aa_change_groups_query(aa_positional_change_id: Optional[str] = None
+                            , effect_id: Optional[str] = None) -> MongoQuery:
+    query = MongoQuery(Effect, AAChangeGroupProjection, {"aa_changes.1": {"$exists": True}})
+    if aa_positional_change_id:
+        query.where({"aa_changes": {"$elemMatch": {"$eq": aa_positional_change_id}}})
+    if effect_id:
+        query.where({"_id": PydanticObjectId(effect_id)})
+    return query
 
+
+@kb_cached
 async def get_aa_change_groups(aa_positional_change_id: Optional[str] = None
                                , effect_id: Optional[str] = None
                                , limit: Optional[int] = None, page: Optional[int] = None):
     pagination = OptionalPagination(limit, page)
-    query_composer = FilterIntersection()
-    if aa_positional_change_id:
-        groups_of_positional_change = await Effect.find({
-            "aa_changes.1": {"$exists": True}
-            , "aa_changes": {"$elemMatch": {"$eq": aa_positional_change_id}}
-        }, projection_model=AAChangeGroupProjection).to_list()
-        query_composer.add_filter(aa_positional_change_id, groups_of_positional_change)
-    if effect_id:
-        groups_of_effect_id = await Effect.find({
-            "_id": PydanticObjectId(effect_id),
-            "aa_changes.1": {"$exists": True}
-        }, projection_model=AAChangeGroupProjection).to_list()
-        query_composer.add_filter(effect_id, groups_of_effect_id)
-
-    query_composer.intersect_results(lambda x: x.aa_change_group_id)
-    if query_composer.result() != FilterIntersection.NO_FILTERS:
-        result = query_composer.result()
-    else:
-        result = await Effect.find(
-            {"aa_changes.1": {"$exists": True}}
-            , projection_model=AAChangeGroupProjection
-        ).to_list()
-    result = list(map(vars, result))
-    if pagination:
-        return sorted(result, key=lambda x: x["aa_change_group_id"])[pagination.first_idx:pagination.last_idx]
-    else:
-        return result
+    query = _aa_change_groups_query(aa_positional_change_id, effect_id)
+    result = await query.to_list(pagination)
+    return result
 
 
+@kb_cached
 async def get_aa_change_group(aa_change_group_id: str):
-    result = await Effect.find({
+    result = await find_raw(Effect, AAChangeGroupProjection, {
         "_id": PydanticObjectId(aa_change_group_id),
         "aa_changes.1": {"$exists": True}
-    }, projection_model=AAChangeGroupProjection).to_list()
-    return list(map(vars, result))
+    })
+    return result
 
 
+@kb_cached
 async def get_nuc_annotations(protein_id: Optional[str] = None
                               , nuc_positional_mutation_id: Optional[str] = None
                               , limit: Optional[int] = None, page: Optional[int] = None
@@ -1758,124 +939,54 @@ async def get_nuc_annotations(protein_id: Optional[str] = None
     name = upper_if_exists(name)
     pagination = OptionalPagination(limit, page)
     query_composer = FilterIntersection()
-    if protein_id:
-        genes_of_protein = await Structure.find({"protein_characterization.protein_name": protein_id},
-                                                projection_model=NucAnnotationProjection).to_list()
-        genes_of_protein = list(map(vars, genes_of_protein))
-        query_composer.add_filter(protein_id, genes_of_protein)
-    if nuc_positional_mutation_id:
-        # [{$match: {
-        #   change_id: "G13617A"
-        # }}, {$lookup: {
-        #   from: 'structure',
-        #   let: {pos: "$pos"},
-        #   pipeline: [
-        #     {
-        #       $match: {
-        #         $expr: {
-        #           $and: [
-        #             {$gte: ["$$pos", "$start_on_ref"]},
-        #             {$lte: ["$$pos", "$stop_on_ref"]}
-        #           ]
-        #         }
-        #       }
-        #     }
-        #   ],
-        #   as: "joined"
-        # }}, {$project: {
-        #   joined: 1
-        # }}, {$unwind: {
-        #   path: "$joined",
-        #   preserveNullAndEmptyArrays: false
-        # }}, {$project: {
-        #   _id: 0,
-        #   nuc_annotation_id: "$joined._id",
-        #   name: "$joined.annotation_id",
-        #   start_on_ref: "$joined.start_on_ref",
-        #   stop_on_ref: "$joined.stop_on_ref"
-        # }}]
-        annotations_of_positional_mutation = await NUCChange.aggregate([
-            {
-                '$match': {
-                    'change_id': nuc_positional_mutation_id
-                }
-            }, {
-                '$lookup': {
-                    'from': 'structure',
-                    'let': {
-                        'pos': '$pos'
-                    },
-                    'pipeline': [
-                        {
-                            '$match': {
-                                '$expr': {
-                                    '$and': [
-                                        {
-                                            '$gte': [
-                                                '$$pos', '$start_on_ref'
-                                            ]
-                                        }, {
-                                            '$lte': [
-                                                '$$pos', '$stop_on_ref'
-                                            ]
-                                        }
-                                    ]
-                                }
-                            }
-                        }
-                    ],
-                    'as': 'joined'
-                }
-            }, {
-                '$project': {
-                    'joined': 1
-                }
-            }, {
-                '$unwind': {
-                    'path': '$joined',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$project': {
-                    '_id': 0,
-                    'nuc_annotation_id': {'$toString': '$joined._id'},
-                    'name': '$joined.annotation_id',
-                    'start_on_ref': '$joined.start_on_ref',
-                    'stop_on_ref': '$joined.stop_on_ref'
-                }
-            }]
-        ).to_list()
+    if protein_id:
+        genes_of_protein = await find_raw(Structure, NucAnnotationProjection,
+                                          {"protein_characterization.protein_name": protein_id})
+        query_composer.add_filter(protein_id, genes_of_protein)
+    if nuc_positional_mutation_id:
+        positional_mutation = await get_nuc_positional_mutation(nuc_positional_mutation_id)
+        if positional_mutation:
+            annotations_of_positional_mutation = get_nuc_annotation_index()\
+                .containing(positional_mutation[0]["position"])
+        else:
+            annotations_of_positional_mutation = []
         query_composer.add_filter(nuc_positional_mutation_id, annotations_of_positional_mutation)
     if name:
-        genes_with_name = await Structure.find({"annotation_id": name}
-                                               , projection_model=NucAnnotationProjection).to_list()
+        genes_with_name = await find_raw(Structure, NucAnnotationProjection, {"annotation_id": name})
         query_composer.add_filter(name, genes_with_name)
     if start_on_ref:
-        genes_starting_at = await Structure.find({"start_on_ref": start_on_ref}
-                                                 , projection_model=NucAnnotationProjection).to_list()
+        genes_starting_at = await find_raw(Structure, NucAnnotationProjection, {"start_on_ref": start_on_ref})
         query_composer.add_filter(start_on_ref, genes_starting_at)
     if stop_on_ref:
-        genes_ending_at = await Structure.find({"stop_on_ref": stop_on_ref}
-                                               , projection_model=NucAnnotationProjection).to_list()
+        genes_ending_at = await find_raw(Structure, NucAnnotationProjection, {"stop_on_ref": stop_on_ref})
         query_composer.add_filter(stop_on_ref, genes_ending_at)
 
     query_composer.intersect_results(lambda x: x["nuc_annotation_id"])
     if query_composer.result() != FilterIntersection.NO_FILTERS:
         result = query_composer.result()
     else:
-        result = await Structure.find_all(projection_model=NucAnnotationProjection).to_list()
-        result = list(map(vars, result))
+        result = await find_raw(Structure, NucAnnotationProjection, {})
     if pagination:
         return sorted(result, key=lambda x: x["nuc_annotation_id"])[pagination.first_idx:pagination.last_idx]
     else:
         return result
 
 
+@kb_cached
+async def get_nuc_annotations_by_nuc_positional_mutation_ids(nuc_positional_mutation_ids: List[str]):
+    """Same as get_nuc_annotations(nuc_positional_mutation_id=...) repeated for every nuc_positional_mutation_id, but
+    resolved with a single query and a single sweep of the annotation index."""
+    change_ids = [upper_if_exists(x) for x in nuc_positional_mutation_ids]
+    positional_mutations = await find_raw(NUCChange, NUCPositionalMutationProjection,
+                                          {"change_id": {"$in": change_ids}})
+    return get_nuc_annotation_index().containing_any(x["position"] for x in positional_mutations)
+
+
+@kb_cached
 async def get_nuc_annotation(nuc_annotation_id):
     nuc_annotation_id = upper_if_exists(nuc_annotation_id)
-    result = await Structure.find({"_id": PydanticObjectId(nuc_annotation_id)}
-                                , projection_model=NucAnnotationProjection).to_list()
-    return list(map(vars, result))
+    result = await find_raw(Structure, NucAnnotationProjection, {"_id": PydanticObjectId(nuc_annotation_id)})
+    return result
 
 
 async def get_proteins(nuc_annotation_id: Optional[str] = None
@@ -1931,9 +1042,7 @@ async def get_proteins(nuc_annotation_id: Optional[str] = None
         query_composer.add_filter(nuc_annotation_id, proteins_of_nuc_annotation)
     if epitope_id:
         async with get_session() as session:
-            vcm_protein = await session.execute(
-                f"select protein_name from epitope natural join epitope_fragment "
-                f"where epi_fragment_id = {epitope_id} and virus_id = 1 limit 1;")
+            vcm_protein = await session.execute(statements.PROTEIN_OF_EPITOPE, {"epitope_id": int(epitope_id)})
             try:
                 vcm_protein = vcm_protein.fetchall()[0]["protein_name"]
             except IndexError:  # no proteins found (the epitope id is wrong)
@@ -2277,6 +1386,7 @@ async def get_proteins(nuc_annotation_id: Optional[str] = None
         return result
 
 
+@kb_cached
 async def get_protein(protein_id: str):
     # '''
     # [{$match: {
@@ -2338,65 +1448,50 @@ async def get_protein(protein_id: str):
         }]).to_list()
 
 
-async def get_protein_regions(protein_id: Optional[str] = None
-                              , limit: Optional[int] = None, page: Optional[int] = None
-                              , name: Optional[str] = None
-                              , _type: Optional[str] = None
-                              , category: Optional[str] = None
-                              , start_on_protein: Optional[int] = None
-                              , stop_on_protein: Optional[int] = None):
+def _protein_regions_query(protein_id: Optional[str] = None
+                           , name: Optional[str] = None
+                           , _type: Optional[str] = None
+                           , category: Optional[str] = None
+                           , start_on_protein: Optional[int] = None
+                           , stop_on_protein: Optional[int] = None) -> MongoQuery:
     protein_id = upper_if_exists(protein_id)
     name = lower_if_exists(name)
     _type = lower_if_exists(_type)
     category = lower_if_exists(category)
-    pagination = OptionalPagination(limit, page)
-    query_composer = FilterIntersection()
+    query = MongoQuery(ProteinRegion, ProteinRegionProjection)
     if protein_id:
-        regions_in_protein = await ProteinRegion.find({
-            "protein_name": protein_id
-        }, projection_model=ProteinRegionProjection).to_list()
-        query_composer.add_filter(protein_id, regions_in_protein)
+        query.where({"protein_name": protein_id})
     if name:
-        regions_with_name = await ProteinRegion.find({"description": name}
-                                                     , projection_model=ProteinRegionProjection).to_list()
-        query_composer.add_filter(name, regions_with_name)
+        query.where({"description": name})
     if _type:
-        regions_of_type = await ProteinRegion.find({
-            "type": _type
-        }, projection_model=ProteinRegionProjection).to_list()
-        query_composer.add_filter(_type, regions_of_type)
+        query.where({"type": _type})
     if category:
-        regions_of_cat = await ProteinRegion.find({
-            "category": category
-        }, projection_model=ProteinRegionProjection).to_list()
-        query_composer.add_filter(category, regions_of_cat)
+        query.where({"category": category})
     if start_on_protein is not None:
-        regions_starting_at = await ProteinRegion.find({
-            "start_on_prot": str(start_on_protein)
-        } , projection_model=ProteinRegionProjection).to_list()
-        query_composer.add_filter(start_on_protein, regions_starting_at)
+        query.where({"start_on_prot": str(start_on_protein)})
     if stop_on_protein is not None:
-        regions_ending_at = await ProteinRegion.find({
-            "stop_on_prot": str(stop_on_protein)
-        }, projection_model=ProteinRegionProjection).to_list()
-        query_composer.add_filter(stop_on_protein, regions_ending_at)
+        query.where({"stop_on_prot": str(stop_on_protein)})
+    return query
 
-    query_composer.intersect_results(lambda x: x.protein_region_id)
-    if query_composer.result() != FilterIntersection.NO_FILTERS:
-        result = query_composer.result()
-    else:
-        result = await ProteinRegion.find_all(projection_model=ProteinRegionProjection).to_list()
-    result = list(map(vars, result))
-    if pagination:
-        return sorted(result, key=lambda x: x["protein_region_id"])[pagination.first_idx:pagination.last_idx]
-    else:
-        return result
+
+@kb_cached
+async def get_protein_regions(protein_id: Optional[str] = None
+                              , limit: Optional[int] = None, page: Optional[int] = None
+                              , name: Optional[str] = None
+                              , _type: Optional[str] = None
+                              , category: Optional[str] = None
+                              , start_on_protein: Optional[int] = None
+                              , stop_on_protein: Optional[int] = None):
+    pagination = OptionalPagination(limit, page)
+    query = _protein_regions_query(protein_id, name, _type, category, start_on_protein, stop_on_protein)
+    result = await query.to_list(pagination)
+    return result
 
 
+@kb_cached
 async def get_protein_region(protein_region_id: str):
-    result = await ProteinRegion.find({"_id": PydanticObjectId(protein_region_id)}
-                                    , projection_model=ProteinRegionProjection).to_list()
-    return list(map(vars, result))
+    result = await find_raw(ProteinRegion, ProteinRegionProjection, {"_id": PydanticObjectId(protein_region_id)})
+    return result
 
 
 async def get_aa_residue_changes(aa_positional_change_id: Optional[str] = None
@@ -2405,515 +1500,50 @@ async def get_aa_residue_changes(aa_positional_change_id: Optional[str] = None
                                  , alternative: Optional[str] = None
                                  , limit: Optional[int] = None, page: Optional[int] = None
                                  , grantham_distance: Optional[int] = None
-                                 , _type: Optional[str] = None):
+                                 , _type: Optional[str] = None
+                                 , min_grantham_distance: Optional[int] = None
+                                 , max_grantham_distance: Optional[int] = None):
     aa_positional_change_id = upper_if_exists(aa_positional_change_id)
     aa_residue_id = upper_if_exists(aa_residue_id)
-    reference = upper_if_exists(reference)
-    alternative = upper_if_exists(alternative)
-    _type = lower_if_exists(_type)
-    pagination = OptionalPagination(limit, page)
-    query_composer = FilterIntersection()
-    if aa_positional_change_id and reference and alternative \
-            or aa_positional_change_id and (reference or alternative):
-        return MyExceptions.illegal_parameters_combination
-    elif aa_positional_change_id or (reference and alternative):
-        if aa_positional_change_id:
-            ref_alt_aa_pos_change_regex = re.fullmatch(r'[a-zA-Z0-9]+:([a-zA-Z\-\*]*)[\d/]+([a-zA-Z\-\*]+)'
-                                                       , aa_positional_change_id)
-            if not ref_alt_aa_pos_change_regex:
-                raise MyExceptions.unrecognized_aa_positional_change_id
-            else:
-                ref, alt = ref_alt_aa_pos_change_regex.groups()
-        else:
-            ref, alt = reference, alternative
-        '''
-        [{$match: {
-          residue: "A"
-        }}, {$project: {
-          residue: 1,
-          grantham_distance: {$objectToArray: "$grantham_distance"}
-        }}, {$unwind: {
-          path: "$grantham_distance",
-          preserveNullAndEmptyArrays: false
-        }}, {$match: {
-          "grantham_distance.k": "H"
-        }}, {$project: {
-          aa_residue_change_id: {$concat: ["$residue", "$grantham_distance.k"]},
-          reference: "$residue",
-          alternative: "$grantham_distance.k",
-          grantham_distance: {$toInt: "$grantham_distance.v"},
-          _id: 0
-        }}, {$addFields: {
-          type: {
-            $cond: [
-              {$gte: ["$grantham_distance", 66]}, 
-              "radical", 
-              "conservative"
-            ]
-          }
-        }}]
-        '''
-        residue_changes_of_aa_change = await AAResidue.aggregate([
-            {
-                '$match': {
-                    'residue': ref
-                }
-            }, {
-                '$project': {
-                    'residue': 1,
-                    'grantham_distance': {
-                        '$objectToArray': '$grantham_distance'
-                    }
-                }
-            }, {
-                '$unwind': {
-                    'path': '$grantham_distance',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$match': {
-                    'grantham_distance.k': alt
-                }
-            }, {
-                '$project': {
-                    'aa_residue_change_id': {
-                        '$concat': ['$residue', '$grantham_distance.k']
-                    },
-                    'reference': '$residue',
-                    'alternative': '$grantham_distance.k',
-                    'grantham_distance': {
-                        '$toInt': '$grantham_distance.v'
-                    },
-                    '_id': 0
-                }
-            }, {
-                '$addFields': {
-                    'type': {
-                        '$cond': [
-                            {
-                                '$gte': [
-                                    '$grantham_distance', 66
-                                ]
-                            }, 'radical', 'conservative'
-                        ]
-                    }
-                }
-            }
-        ]).to_list()
-        query_composer.add_filter(aa_positional_change_id, residue_changes_of_aa_change)
-    elif reference or alternative or aa_residue_id:
-        '''
-        [{$match: {
-          residue: "A"
-        }}, {$project: {
-          residue: 1,
-          grantham_distance: {$objectToArray: "$grantham_distance"}
-        }}, {$unwind: {
-          path: "$grantham_distance",
-          preserveNullAndEmptyArrays: false
-        }}, {$project: {
-          aa_residue_change_id: {$concat: ["$residue", "$grantham_distance.k"]},
-          reference: "$residue",
-          alternative: "$grantham_distance.k",
-          grantham_distance: {$toInt: "$grantham_distance.v"},
-          _id: 0
-        }}, {$addFields: {
-          type: {
-            $cond: [
-              {$gte: ["$grantham_distance", 66]}, 
-              "radical", 
-              "conservative"
-            ]
-          }
-        }}]
-        '''
-        if reference:
-            a_residue = reference
-        elif alternative:
-            a_residue = alternative
-        else:
-            a_residue = aa_residue_id
-        pipeline = [
-            {
-                '$match': {
-                    'residue': a_residue
-                }
-            }, {
-                '$project': {
-                    'residue': 1,
-                    'grantham_distance': {
-                        '$objectToArray': '$grantham_distance'
-                    }
-                }
-            }, {
-                '$unwind': {
-                    'path': '$grantham_distance',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }]
-        if reference or aa_residue_id:
-            pipeline.append(
-                {
-                    '$project': {
-                        'aa_residue_change_id': {
-                            '$concat': [
-                                '$residue', '$grantham_distance.k'
-                            ]
-                        },
-                        'reference': '$residue',
-                        'alternative': '$grantham_distance.k',
-                        'grantham_distance': {
-                            '$toInt': '$grantham_distance.v'
-                        },
-                        '_id': 0
-                    }
-                })
-        else:
-            pipeline.append(
-                {
-                    '$project': {
-                        'aa_residue_change_id': {
-                            '$concat': [
-                                '$grantham_distance.k', '$residue'
-                            ]
-                        },
-                        'reference': '$grantham_distance.k',
-                        'alternative': '$residue',
-                        'grantham_distance': {
-                            '$toInt': '$grantham_distance.v'
-                        },
-                        '_id': 0
-                    }
-                })
-        pipeline.append(
-            {
-                '$addFields': {
-                    'type': {
-                        '$cond': [
-                            {
-                                '$gte': [
-                                    '$grantham_distance', 66
-                                ]
-                            }, 'radical', 'conservative'
-                        ]
-                    }
-                }
-            })
-        residue_change_with_a_single_residue = await AAResidue.aggregate(pipeline).to_list()
-        query_composer.add_filter(a_residue, residue_change_with_a_single_residue)
-
-    if grantham_distance:
-        '''
-        [{$project: {
-          residue: 1,
-          grantham_distance: {
-            $objectToArray: "$grantham_distance"
-          }
-        }}, {$match: {
-          "grantham_distance.v": "112"
-        }}, {$unwind: {
-          path: "$grantham_distance",
-          preserveNullAndEmptyArrays: false
-        }}, {$match: {
-          "grantham_distance.v": "112"
-        }}, {$project: {
-          aa_residue_change_id: {
-            $concat: ["$residue", "$grantham_distance.k"]
-          },
-          reference: "$residue",
-          alternative: "$grantham_distance.k",
-          grantham_distance: {
-            $toInt: "$grantham_distance.v"
-          },
-          _id: 0
-        }}, {$addFields: {
-          type: {
-            $cond: [{
-              $gte: ["$grantham_distance", 66]
-            }, "radical", "conservative"]
-          }
-        }}]
-        '''
-        changes_w_gt = await AAResidue.aggregate([
-            {
-                '$project': {
-                    'residue': 1,
-                    'grantham_distance': {
-                        '$objectToArray': '$grantham_distance'
-                    }
-                }
-            }, {
-                '$match': {
-                    'grantham_distance.v': str(grantham_distance)
-                }
-            }, {
-                '$unwind': {
-                    'path': '$grantham_distance',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$match': {
-                    'grantham_distance.v': str(grantham_distance)
-                }
-            }, {
-                '$project': {
-                    'aa_residue_change_id': {
-                        '$concat': [
-                            '$residue', '$grantham_distance.k'
-                        ]
-                    },
-                    'reference': '$residue',
-                    'alternative': '$grantham_distance.k',
-                    'grantham_distance': {
-                        '$toInt': '$grantham_distance.v'
-                    },
-                    '_id': 0
-                }
-            }, {
-                '$addFields': {
-                    'type': {
-                        '$cond': [
-                            {
-                                '$gte': [
-                                    '$grantham_distance', 66
-                                ]
-                            }, 'radical', 'conservative'
-                        ]
-                    }
-                }
-            }
-        ]).to_list()
-        query_composer.add_filter(grantham_distance, changes_w_gt)
-    if _type:
-        if _type.lower() == "radical":
-            '''
-            [{$project: {
-              residue: 1,
-              grantham_distance: {
-                $objectToArray: "$grantham_distance"
-              }
-            }}, {$unwind: {
-              path: "$grantham_distance",
-              preserveNullAndEmptyArrays: false
-            }}, {$project: {
-              aa_residue_change_id: {
-                $concat: ["$residue", "$grantham_distance.k"]
-              },
-              reference: "$residue",
-              alternative: "$grantham_distance.k",
-              grantham_distance: {
-                $toInt: "$grantham_distance.v"
-              },
-              _id: 0
-            }}, {$match: {
-              grantham_distance: {$gte: 66}
-            }}, {$addFields: {
-              type: {
-                $cond: [{
-                  $gte: ["$grantham_distance", 66]
-                }, "radical", "conservative"]
-              }
-            }}]
-            '''
-            changes_radical = await AAResidue.aggregate([
-                {
-                    '$project': {
-                        'residue': 1,
-                        'grantham_distance': {
-                            '$objectToArray': '$grantham_distance'
-                        }
-                    }
-                }, {
-                    '$unwind': {
-                        'path': '$grantham_distance',
-                        'preserveNullAndEmptyArrays': False
-                    }
-                }, {
-                    '$project': {
-                        'aa_residue_change_id': {
-                            '$concat': [
-                                '$residue', '$grantham_distance.k'
-                            ]
-                        },
-                        'reference': '$residue',
-                        'alternative': '$grantham_distance.k',
-                        'grantham_distance': {
-                            '$toInt': '$grantham_distance.v'
-                        },
-                        '_id': 0
-                    }
-                }, {
-                    '$match': {
-                        'grantham_distance': {
-                            '$gte': 66
-                        }
-                    }
-                }, {
-                    '$addFields': {
-                        'type': {
-                            '$cond': [
-                                {
-                                    '$gte': [
-                                        '$grantham_distance', 66
-                                    ]
-                                }, 'radical', 'conservative'
-                            ]
-                        }
-                    }
-                }
-            ]).to_list()
-            query_composer.add_filter(_type, changes_radical)
-        elif _type.lower() == "conservative":
-            '''
-            [{$project: {
-              residue: 1,
-              grantham_distance: {
-                $objectToArray: "$grantham_distance"
-              }
-            }}, {$unwind: {
-              path: "$grantham_distance",
-              preserveNullAndEmptyArrays: false
-            }}, {$project: {
-              aa_residue_change_id: {
-                $concat: ["$residue", "$grantham_distance.k"]
-              },
-              reference: "$residue",
-              alternative: "$grantham_distance.k",
-              grantham_distance: {
-                $toInt: "$grantham_distance.v"
-              },
-              _id: 0
-            }}, {$match: {
-              grantham_distance: {$lt: 66}
-            }}, {$addFields: {
-              type: {
-                $cond: [{
-                  $gte: ["$grantham_distance", 66]
-                }, "radical", "conservative"]
-              }
-            }}]
-            '''
-            changes_conservative = await AAResidue.aggregate([
-                {
-                    '$project': {
-                        'residue': 1,
-                        'grantham_distance': {
-                            '$objectToArray': '$grantham_distance'
-                        }
-                    }
-                }, {
-                    '$unwind': {
-                        'path': '$grantham_distance',
-                        'preserveNullAndEmptyArrays': False
-                    }
-                }, {
-                    '$project': {
-                        'aa_residue_change_id': {
-                            '$concat': [
-                                '$residue', '$grantham_distance.k'
-                            ]
-                        },
-                        'reference': '$residue',
-                        'alternative': '$grantham_distance.k',
-                        'grantham_distance': {
-                            '$toInt': '$grantham_distance.v'
-                        },
-                        '_id': 0
-                    }
-                }, {
-                    '$match': {
-                        'grantham_distance': {
-                            '$lt': 66
-                        }
-                    }
-                }, {
-                    '$addFields': {
-                        'type': {
-                            '$cond': [
-                                {
-                                    '$gte': [
-                                        '$grantham_distance', 66
-                                    ]
-                                }, 'radical', 'conservative'
-                            ]
-                        }
-                    }
-                }
-            ]).to_list()
-            query_composer.add_filter(_type, changes_conservative)
-        else:
-            query_composer.add_filter(_type, [])
-
-    query_composer.intersect_results(lambda x: x["aa_residue_change_id"])
-    if query_composer.result() != FilterIntersection.NO_FILTERS:
-        result = query_composer.result()
-    else:
-        '''
-        [{$project: {
-          residue: 1,
-          grantham_distance: {$objectToArray: "$grantham_distance"}
-        }}, {$unwind: {
-          path: "$grantham_distance",
-          preserveNullAndEmptyArrays: false
-        }}, {$project: {
-          aa_residue_change_id: {$concat: ["$residue", "$grantham_distance.k"]},
-          reference: "$residue",
-          alternative: "$grantham_distance.k",
-          grantham_distance: {$toInt: "$grantham_distance.v"},
-          _id: 0
-        }}, {$addFields: {
-          type: {
-            $cond: [
-              {$gte: ["$grantham_distance", 66]}, 
-              "radical", 
-              "conservative"
-            ]
-          }
-        }}]
-        '''
-        result = await AAResidue.aggregate([
-            {
-                '$project': {
-                    'residue': 1,
-                    'grantham_distance': {
-                        '$objectToArray': '$grantham_distance'
-                    }
-                }
-            }, {
-                '$unwind': {
-                    'path': '$grantham_distance',
-                    'preserveNullAndEmptyArrays': False
-                }
-            }, {
-                '$project': {
-                    'aa_residue_change_id': {
-                        '$concat': [
-                            '$residue', '$grantham_distance.k'
-                        ]
-                    },
-                    'reference': '$residue',
-                    'alternative': '$grantham_distance.k',
-                    'grantham_distance': {
-                        '$toInt': '$grantham_distance.v'
-                    },
-                    '_id': 0
-                }
-            }, {
-                '$addFields': {
-                    'type': {
-                        '$cond': [
-                            {
-                                '$gte': [
-                                    '$grantham_distance', 66
-                                ]
-                            }, 'radical', 'conservative'
-                        ]
-                    }
-                }
-            }
-        ]).to_list()
+    reference = upper_if_exists(reference)
+    alternative = upper_if_exists(alternative)
+    _type = lower_if_exists(_type)
+    pagination = OptionalPagination(limit, page)
+    filters = dict()
+    if aa_positional_change_id and (reference or alternative):
+        raise MyExceptions.illegal_parameters_combination
+    elif aa_positional_change_id:
+        ref_alt_aa_pos_change_regex = re.fullmatch(r'[a-zA-Z0-9]+:([a-zA-Z\-\*]*)[\d/]+([a-zA-Z\-\*]+)'
+                                                   , aa_positional_change_id)
+        if not ref_alt_aa_pos_change_regex:
+            raise MyExceptions.unrecognized_aa_positional_change_id
+        filters["reference"], filters["alternative"] = ref_alt_aa_pos_change_regex.groups()
+    elif reference and alternative:
+        filters["reference"], filters["alternative"] = reference, alternative
+    elif reference:
+        filters["reference"] = reference
+    elif alternative:
+        filters["alternative"] = alternative
+    elif aa_residue_id:
+        filters["reference"] = aa_residue_id
+    if grantham_distance:
+        filters["grantham_distance"] = grantham_distance
+    if min_grantham_distance is not None:
+        filters["min_grantham_distance"] = min_grantham_distance
+    if max_grantham_distance is not None:
+        filters["max_grantham_distance"] = max_grantham_distance
+    if _type:
+        if _type == "radical":
+            filters["radical"] = True
+        elif _type == "conservative":
+            filters["radical"] = False
+        else:
+            return []
+
+    # changes are sorted by aa_residue_change_id
+    result = get_grantham_matrix().changes(**filters)
     if pagination:
-        return sorted(result, key=lambda x: x["aa_residue_change_id"])[pagination.first_idx:pagination.last_idx]
+        return result[pagination.first_idx:pagination.last_idx]
     else:
         return result
 
@@ -2922,64 +1552,22 @@ async def get_aa_residue_change(aa_residue_change_id: str):
     aa_residue_change_id = upper_if_exists(aa_residue_change_id)
     if len(aa_residue_change_id) != 2:
         raise MyExceptions.unrecognised_aa_residue_change_id
-    '''
-    [{$match: {
-      residue: "E"
-    }}, {$project: {
-      aa_residue_change_id: "EK",
-      reference: "$residue",
-      alternative: "K",
-      grantham_distance: {$toInt: "$grantham_distance.K"},
-      _id: 0
-    }}, {$addFields: {
-      type: {
-        $cond: [{
-          $gte: ["$grantham_distance", 66]
-        }, "radical", "conservative"]
-      }
-    }}]    
-    '''
-    return await AAResidue.aggregate([
-        {
-            '$match': {
-                'residue': aa_residue_change_id[0]
-            }
-        }, {
-            '$project': {
-                'aa_residue_change_id': aa_residue_change_id,
-                'reference': '$residue',
-                'alternative': aa_residue_change_id[1],
-                'grantham_distance': {'$toInt': f'$grantham_distance.{aa_residue_change_id[1]}'},
-                '_id': 0
-            }
-        }, {
-            '$addFields': {
-                'type': {
-                    '$cond': [
-                        {
-                            '$gte': [
-                                '$grantham_distance', 66
-                            ]
-                        }, 'radical', 'conservative'
-                    ]
-                }
-            }
-        }]).to_list()
-
-
-async def get_aa_residues(request: Request
-                          , aa_residue_change_id: Optional[str] = None
-                          , limit: Optional[int] = None, page: Optional[int] = None
-                          , molecular_weight: Optional[int] = None
-                          , isoelectric_point: Optional[float] = None
-                          , hydrophobicity: Optional[float] = None
-                          , potential_side_chain_h_bonds: Optional[int] = None
-                          , polarity: Optional[str] = None
-                          , r_group_structure: Optional[str] = None
-                          , charge: Optional[str] = None
-                          , essentiality: Optional[str] = None
-                          , side_chain_flexibility: Optional[str] = None
-                          , chemical_group_in_the_side_chain: Optional[str] = None):
+    residue_change = get_grantham_matrix().change(aa_residue_change_id)
+    return [residue_change] if residue_change else []
+
+
+def _aa_residues_query(request_path: str
+                       , aa_residue_change_id: Optional[str] = None
+                       , molecular_weight: Optional[int] = None
+                       , isoelectric_point: Optional[float] = None
+                       , hydrophobicity: Optional[float] = None
+                       , potential_side_chain_h_bonds: Optional[int] = None
+                       , polarity: Optional[str] = None
+                       , r_group_structure: Optional[str] = None
+                       , charge: Optional[str] = None
+                       , essentiality: Optional[str] = None
+                       , side_chain_flexibility: Optional[str] = None
+                       , chemical_group_in_the_side_chain: Optional[str] = None) -> MongoQuery:
     aa_residue_change_id = upper_if_exists(aa_residue_change_id)
     polarity = lower_if_exists(polarity)
     r_group_structure = lower_if_exists(r_group_structure)
@@ -2988,69 +1576,131 @@ async def get_aa_residues(request: Request
     side_chain_flexibility = lower_if_exists(side_chain_flexibility)
     chemical_group_in_the_side_chain = lower_if_exists(chemical_group_in_the_side_chain)
     #    :param aa_residue_change_id: a two letter string
-    pagination = OptionalPagination(limit, page)
-    query_composer = FilterIntersection()
+    query = MongoQuery(AAResidue, AAResidueProjection, sort_by="residue")
     if aa_residue_change_id:
         if len(aa_residue_change_id) != 2:
             raise MyExceptions.unrecognised_aa_residue_change_id
         # form query based on the request: aa_residues or aa_residues_alt or aa_residues_ref
         url_called = request.url.path
         if url_called.endswith("ref"):
-            query = {'residue': aa_residue_change_id[0]}
+            query.where({'residue': aa_residue_change_id[0]})
         elif url_called.endswith("alt"):
-            query = {'residue': aa_residue_change_id[1]}
+            query.where({'residue': aa_residue_change_id[1]})
         else:
-            query = {'$or': [{'residue': aa_residue_change_id[0]}, {'residue': aa_residue_change_id[1]}]}
-        # do the query
-        residues_of_residue_change_id = await AAResidue.find(query, projection_model=AAResidueProjection).to_list()
-        query_composer.add_filter(aa_residue_change_id, residues_of_residue_change_id)
+            query.where({'$or': [{'residue': aa_residue_change_id[0]}, {'residue': aa_residue_change_id[1]}]})
     if molecular_weight:
-        result = await AAResidue.find({"molecular_weight": molecular_weight}, projection_model=AAResidueProjection).to_list()
-        query_composer.add_filter(molecular_weight, result)
+        query.where({"molecular_weight": molecular_weight})
     if isoelectric_point:
-        result = await AAResidue.find({"isoelectric_point": isoelectric_point}, projection_model=AAResidueProjection).to_list()
-        query_composer.add_filter(isoelectric_point, result)
+        query.where({"isoelectric_point": isoelectric_point})
     if hydrophobicity:
-        result = await AAResidue.find({"hydrophobicity": hydrophobicity}, projection_model=AAResidueProjection).to_list()
-        query_composer.add_filter(hydrophobicity, result)
+        query.where({"hydrophobicity": hydrophobicity})
     if potential_side_chain_h_bonds:
-        result = await AAResidue.find({"potential_side_chain_h_bonds": potential_side_chain_h_bonds}, projection_model=AAResidueProjection).to_list()
-        query_composer.add_filter(potential_side_chain_h_bonds, result)
+        query.where({"potential_side_chain_h_bonds": potential_side_chain_h_bonds})
     if polarity:
-        result = await AAResidue.find({"polarity": polarity}, projection_model=AAResidueProjection).to_list()
-        query_composer.add_filter(polarity, result)
+        query.where({"polarity": polarity})
     if r_group_structure:
-        result = await AAResidue.find({"r_group_structure": r_group_structure}, projection_model=AAResidueProjection).to_list()
-        query_composer.add_filter(r_group_structure, result)
+        query.where({"r_group_structure": r_group_structure})
     if charge:
-        result = await AAResidue.find({"charge": charge}, projection_model=AAResidueProjection).to_list()
-        query_composer.add_filter(charge, result)
+        query.where({"charge": charge})
     if essentiality:
-        result = await AAResidue.find({"essentiality": essentiality}, projection_model=AAResidueProjection).to_list()
-        query_composer.add_filter(essentiality, result)
+        query.where({"essentiality": essentiality})
     if side_chain_flexibility:
-        result = await AAResidue.find({"side_chain_flexibility": side_chain_flexibility}, projection_model=AAResidueProjection).to_list()
-        query_composer.add_filter(side_chain_flexibility, result)
+        query.where({"side_chain_flexibility": side_chain_flexibility})
     if chemical_group_in_the_side_chain:
-        result = await AAResidue.find({"chemical_group_in_the_side_chain": chemical_group_in_the_side_chain}, projection_model=AAResidueProjection).to_list()
-        query_composer.add_filter(chemical_group_in_the_side_chain, result)
+        query.where({"chemical_group_in_the_side_chain": chemical_group_in_the_side_chain})
+    return query
 
-    query_composer.intersect_results(lambda x: x.aa_residue_id)
-    if query_composer.result() != FilterIntersection.NO_FILTERS:
-        result = query_composer.result()
-    else:
-        result = await AAResidue.find_all(projection_model=AAResidueProjection).to_list()
-    result = list(map(vars, result))
-    if pagination:
-        return sorted(result, key=lambda x: x["aa_residue_id"])[pagination.first_idx:pagination.last_idx]
-    else:
-        return result
+
+@kb_cached
+async def get_aa_residues(request: Request
+                          , aa_residue_change_id: Optional[str] = None
+                          , limit: Optional[int] = None, page: Optional[int] = None
+                          , molecular_weight: Optional[int] = None
+                          , isoelectric_point: Optional[float] = None
+                          , hydrophobicity: Optional[float] = None
+                          , potential_side_chain_h_bonds: Optional[int] = None
+                          , polarity: Optional[str] = None
+                          , r_group_structure: Optional[str] = None
+                          , charge: Optional[str] = None
+                          , essentiality: Optional[str] = None
+                          , side_chain_flexibility: Optional[str] = None
+                          , chemical_group_in_the_side_chain: Optional[str] = None):
+    pagination = OptionalPagination(limit, page)
+    query = _aa_residues_query(request.url.path, aa_residue_change_id, molecular_weight, isoelectric_point,
+                               hydrophobicity, potential_side_chain_h_bonds, polarity, r_group_structure, charge,
+                               essentiality, side_chain_flexibility, chemical_group_in_the_side_chain)
+    result = await query.to_list(pagination)
+    return result
 
 
+@kb_cached
 async def get_aa_residue(aa_residue_id: str):
     aa_residue_id = lower_if_exists(aa_residue_id)
-    result = await AAResidue.find({"residue": aa_residue_id}, projection_model=AAResidueProjection).to_list()
-    return list(map(vars, result))
+    result = await find_raw(AAResidue, AAResidueProjection, {"residue": aa_residue_id})
+    return result
+
+
+def _sequences_query(nuc_mutation_id: Optional[str] = None
+                     , aa_change_id: Optional[str] = None
+                     , host_sample_id: Optional[int] = None
+                     , accession_id: Optional[str] = None
+                     , source_database: Optional[str] = None
+                     , length: Optional[int] = None
+                     , n_percentage: Optional[float] = None
+                     , gc_percentage: Optional[float] = None) -> SQLQuery:
+    nuc_mutation_id = lower_if_exists(nuc_mutation_id)
+    aa_change_id = upper_if_exists(aa_change_id)
+    # for accession_id, source_database we do a ilike query as they can be both upper/lower case
+    query = SQLQuery("select sequence_id, accession_id, database_source as \"source_database\", length, "
+                     "n_percentage, gc_percentage "
+                     "from sequence natural join sequencing_project",
+                     "virus_id = 1",
+                     order_by="sequence_id",
+                     keyset=[("sequence_id", "sequence_id", int)])
+    # mutation filters: (condition, params) joining the variant tables and the equivalent keys of the sequence index
+    mutation_conditions = []
+    mutation_keys = []
+    if nuc_mutation_id:
+        nuc_change_re_match = re.fullmatch(r'([a-zA-Z\-\*]*)([\d/]+)([a-zA-Z\-\*]+)', nuc_mutation_id)
+        if not nuc_change_re_match or not nuc_change_re_match.group(2).isdigit():
+            raise MyExceptions.unrecognised_nuc_mutation_id
+        ref, pos, alt = nuc_change_re_match.groups()
+        mutation_conditions.append(("exists (select 1 from nucleotide_variant nv "
+                                    "        where nv.sequence_id = sequence.sequence_id "
+                                    "        and nv.sequence_original = :nv_ref "
+                                    "        and nv.start_original = :nv_pos "
+                                    "        and nv.sequence_alternative = :nv_alt)",
+                                    dict(nv_ref=ref, nv_pos=int(pos), nv_alt=alt)))
+        mutation_keys.append(nuc_mutation_key(ref, int(pos), alt))
+    if aa_change_id:
+        prot, ref, pos, alt = aa_change_id_2_vcm_aa_change(aa_change_id)
+        mutation_conditions.append(("exists (select 1 from annotation a natural join aminoacid_variant av "
+                                    "        where a.sequence_id = sequence.sequence_id "
+                                    "        and a.product = :av_prot "
+                                    "        and av.sequence_aa_original = :av_ref "
+                                    "        and av.start_aa_original = :av_pos "
+                                    "        and av.sequence_aa_alternative = :av_alt)",
+                                    dict(av_prot=prot, av_ref=ref, av_pos=pos, av_alt=alt)))
+        mutation_keys.append(aa_change_key(prot, ref, pos, alt))
+    sequence_ids = indexed_sequence_ids(lambda index: index.all_of(mutation_keys)) if mutation_keys else None
+    if sequence_ids is not None:
+        query.where("sequence_id = any(:indexed_sequence_ids)", indexed_sequence_ids=sequence_ids)
+    else:
+        for condition, params in mutation_conditions:
+            query.where(condition, **params)
+    if host_sample_id:
+        query.where("host_sample_id = :host_sample_id", host_sample_id=int(host_sample_id))
+    if accession_id:
+        query.where("accession_id ilike :accession_id", accession_id=accession_id)
+    if source_database:
+        query.where("database_source ilike :source_database", source_database=source_database)
+    if length:
+        query.where("length = :length", length=length)
+    if n_percentage:
+        query.where("n_percentage = :n_percentage", n_percentage=n_percentage)
+    if gc_percentage:
+        query.where("gc_percentage = :gc_percentage", gc_percentage=gc_percentage)
+    return query
 
 
 async def get_sequences(nuc_mutation_id: Optional[str] = None
@@ -3061,99 +1711,16 @@ async def get_sequences(nuc_mutation_id: Optional[str] = None
                         , source_database: Optional[str] = None
                         , length: Optional[int] = None
                         , n_percentage: Optional[float] = None
-                        , gc_percentage: Optional[float] = None):
-    nuc_mutation_id = lower_if_exists(nuc_mutation_id)
-    aa_change_id = upper_if_exists(aa_change_id)
-    # for accession_id, source_database we do a ilike query as they can be both upper/lower case
-    pagination = OptionalPagination(limit, page)
-    final_pagination_stmt = f'order by sequence_id {pagination.stmt}'
+                        , gc_percentage: Optional[float] = None
+                        , cursor: Optional[str] = None):
+    pagination = pagination_of(limit, page, cursor)
+    query = _sequences_query(nuc_mutation_id, aa_change_id, host_sample_id, accession_id, source_database, length,
+                             n_percentage, gc_percentage)
     async with get_session() as session:
-        query_composer = FilterIntersection()
-
-        select_query = "select sequence_id, accession_id, database_source as \"source_database\", length, " \
-                       "n_percentage, gc_percentage "
-        if nuc_mutation_id:
-            nuc_mutation_id = nuc_mutation_id.lower()
-            nuc_change_re_match = re.fullmatch(r'([a-zA-Z\-\*]*)([\d/]+)([a-zA-Z\-\*]+)', nuc_mutation_id)
-            if not nuc_change_re_match:
-                raise MyExceptions.unrecognised_nuc_mutation_id
-            else:
-                ref, pos, alt = nuc_change_re_match.groups()
-            query = f"{select_query} from sequence natural join sequencing_project natural join nucleotide_variant nv " \
-                    f"where nv.sequence_original = '{ref}' " \
-                    f"and nv.start_original = {pos} " \
-                    f"and nv.sequence_alternative = '{alt}' " \
-                    f"and virus_id = 1 " \
-                    f"{final_pagination_stmt};"
-            sequences_with_nuc_change = await session.execute(query)
-            sequences_with_nuc_change = sequences_with_nuc_change.fetchall()
-            query_composer.add_filter(nuc_mutation_id, sequences_with_nuc_change)
-        if aa_change_id:
-            prot, ref, pos, alt = aa_change_id_2_vcm_aa_change(aa_change_id)
-            query = f"{select_query} from sequence natural join sequencing_project natural join annotation a " \
-                    f"natural join aminoacid_variant av " \
-                    f"where a.product = '{prot}' " \
-                    f"and av.sequence_aa_original = '{ref}' " \
-                    f"and av.start_aa_original = {pos} " \
-                    f"and av.sequence_aa_alternative = '{alt}' " \
-                    f"and virus_id = 1" \
-                    f"{final_pagination_stmt};"
-            sequences_with_aa_change = await session.execute(query)
-            sequences_with_aa_change = sequences_with_aa_change.fetchall()
-            query_composer.add_filter(aa_change_id, sequences_with_aa_change)
-        if host_sample_id:
-            query = f"{select_query} from sequence natural join sequencing_project natural join host_sample hs " \
-                    f"where hs.host_sample_id = {host_sample_id} " \
-                    f"and virus_id = 1 " \
-                    f"{final_pagination_stmt};"
-            sequences_of_host_sample = await session.execute(query)
-            sequences_of_host_sample = sequences_of_host_sample.fetchall()
-            query_composer.add_filter(host_sample_id, sequences_of_host_sample)
-        if accession_id:
-            query = f"{select_query} from sequence natural join sequencing_project " \
-                    f"where accession_id ilike '{accession_id}' and virus_id = 1 " \
-                    f"{final_pagination_stmt};"
-            sequence_with_acc_id = await session.execute(query)
-            sequence_with_acc_id = sequence_with_acc_id.fetchall()
-            query_composer.add_filter(accession_id, sequence_with_acc_id)
-        if source_database:
-            query = f"{select_query} from sequence natural join sequencing_project " \
-                    f"where virus_id = 1 and database_source ilike '{source_database}' " \
-                    f"{final_pagination_stmt};"
-            sequences_of_source = await session.execute(query)
-            sequences_of_source = sequences_of_source.fetchall()
-            query_composer.add_filter(source_database, sequences_of_source)
-        if length:
-            query = f"{select_query} from sequence natural join sequencing_project " \
-                    f"where virus_id = 1 and length = {length} " \
-                    f"{final_pagination_stmt};"
-            sequences_w_length = await session.execute(query)
-            sequences_w_length = sequences_w_length.fetchall()
-            query_composer.add_filter(length, sequences_w_length)
-        if n_percentage:
-            query = f"{select_query} from sequence natural join sequencing_project " \
-                    f"where virus_id = 1 and n_percentage = {n_percentage} " \
-                    f"{final_pagination_stmt};"
-            sequences_w_Ns = await session.execute(query)
-            sequences_w_Ns = sequences_w_Ns.fetchall()
-            query_composer.add_filter(n_percentage, sequences_w_Ns)
-        if gc_percentage:
-            query = f"{select_query} from sequence natural join sequencing_project " \
-                    f"where virus_id = 1 and gc_percentage = {gc_percentage} " \
-                    f"{final_pagination_stmt};"
-            sequences_w_GCs = await session.execute(query)
-            sequences_w_GCs = sequences_w_GCs.fetchall()
-            query_composer.add_filter(gc_percentage, sequences_w_GCs)
-
-        query_composer.intersect_results(lambda x: x.sequence_id)
-        if query_composer.result() != FilterIntersection.NO_FILTERS:
-            return [dict(x) for x in query_composer.result()]
-        else:
-            query = f"{select_query} from sequence natural join sequencing_project " \
-                    f"where virus_id = 1 " \
-                    f"{final_pagination_stmt};"
-            all_sequences = await session.execute(query)
-            return [dict(x) for x in all_sequences.fetchall()]
+        result = await query.fetchall(session, pagination)
+        if pagination.is_keyset:
+            return pagination.page([dict(x) for x in result], query.key_of(result[-1]) if result else None)
+        return [dict(x) for x in result]
 
     # try:
     #     # stmt = select(Sequence).limit(10)
@@ -3175,16 +1742,269 @@ async def get_sequences(nuc_mutation_id: Optional[str] = None
 
 async def get_sequence(sequence_id: int):
     async with get_session() as session:
-        query = f"select sequence_id, accession_id, database_source as \"source_database\", length, " \
-                f"n_percentage, gc_percentage  " \
-                f"from sequence natural join sequencing_project " \
-                f"where sequence_id = {sequence_id} " \
-                f"limit 1;"
-        result = await session.execute(query)
+        result = await session.execute(statements.SEQUENCE_BY_ID, {"sequence_id": int(sequence_id)})
         result = [dict(x) for x in result.fetchall()]
         return result
 
 
+async def get_sequences_by_host_sample_ids(host_sample_ids: List[int]):
+    """Same as get_sequences(host_sample_id=...) repeated for every host_sample_id, but resolved with a single query."""
+    async with get_session() as session:
+        result = await session.execute(
+            statements.SEQUENCES_BY_HOST_SAMPLE_IDS,
+            {"host_sample_ids": [int(x) for x in host_sample_ids]})
+        return [dict(x) for x in result.fetchall()]
+
+
+# above this number of sequences, passing their ids to the database costs more than joining the variant tables
+MAX_INDEXED_SEQUENCE_IDS = 100000
+
+
+def indexed_sequence_ids(lookup: Callable) -> Optional[List[int]]:
+    """
+    Returns the sequence_ids computed by lookup(<sequence index>), or None if the sequence index is not available or
+    the result is too large to be passed to the database as a list (the caller must then join the variant tables).
+    """
+    sequence_index = get_sequence_index()
+    if sequence_index is None:
+        return None
+    sequence_ids = lookup(sequence_index)
+    if len(sequence_ids) > MAX_INDEXED_SEQUENCE_IDS:
+        return None
+    return list(sequence_ids)
+
+
+async def get_sequences_by_ids(sequence_ids: List[int]):
+    async with get_session() as session:
+        result = await session.execute(statements.SEQUENCES_BY_IDS, {"sequence_ids": sequence_ids})
+        return [dict(x) for x in result.fetchall()]
+
+
+async def get_sequences_by_nuc_mutation_ids(nuc_mutation_ids: List[str]):
+    """Same as get_sequences(nuc_mutation_id=...) repeated for every nuc_mutation_id, but resolved with a single query.
+    Mutations whose position is not a plain integer are resolved one by one as in get_sequences."""
+    refs, positions, alts = [], [], []
+    irregular_mutation_ids = []
+    for nuc_mutation_id in nuc_mutation_ids:
+        nuc_change_re_match = re.fullmatch(r'([a-zA-Z\-\*]*)([\d/]+)([a-zA-Z\-\*]+)', nuc_mutation_id.lower())
+        if not nuc_change_re_match:
+            raise MyExceptions.unrecognised_nuc_mutation_id
+        ref, pos, alt = nuc_change_re_match.groups()
+        if pos.isdigit():
+            refs.append(ref)
+            positions.append(int(pos))
+            alts.append(alt)
+        else:
+            irregular_mutation_ids.append(nuc_mutation_id)
+    result = []
+    sequence_ids = indexed_sequence_ids(
+        lambda index: index.any_of(map(nuc_mutation_key, refs, positions, alts))) if refs else None
+    if sequence_ids is not None:
+        result = await get_sequences_by_ids(sequence_ids)
+    elif refs:
+        async with get_session() as session:
+            sequences_with_nuc_changes = await session.execute(
+                statements.SEQUENCES_BY_ANY_NUC_REF_POS_ALT,
+                {"refs": refs, "positions": positions, "alts": alts})
+            result = [dict(x) for x in sequences_with_nuc_changes.fetchall()]
+    for nuc_mutation_id in irregular_mutation_ids:
+        result += await get_sequences(nuc_mutation_id=nuc_mutation_id)
+    return result
+
+
+async def get_sequences_by_aa_change_ids(aa_change_ids: List[str]):
+    """Same as get_sequences(aa_change_id=...) repeated for every aa_change_id, but resolved with a single query."""
+    prots, refs, positions, alts = [], [], [], []
+    for aa_change_id in aa_change_ids:
+        prot, ref, pos, alt = aa_change_id_2_vcm_aa_change(upper_if_exists(aa_change_id))
+        prots.append(prot)
+        refs.append(ref)
+        positions.append(pos)
+        alts.append(alt)
+    sequence_ids = indexed_sequence_ids(lambda index: index.any_of(map(aa_change_key, prots, refs, positions, alts)))
+    if sequence_ids is not None:
+        return await get_sequences_by_ids(sequence_ids)
+    async with get_session() as session:
+        result = await session.execute(
+            statements.SEQUENCES_BY_ANY_AA_PROT_REF_POS_ALT,
+            {"prots": prots, "refs": refs, "positions": positions, "alts": alts})
+        return [dict(x) for x in result.fetchall()]
+
+
+# max number of mutation ids in a co-occurrence request
+MAX_CO_OCCURRENCE_MUTATIONS = 100
+# max number of sequence ids passed as an array parameter to restrict a co-occurrence query: larger sets of sequences
+# are loaded in a temporary table (in chunks of this size) and joined
+MAX_CO_OCCURRENCE_AMONG_IDS = 10000
+
+
+def _vcm_mutation_of(mutation_id: str) -> Tuple[str, tuple]:
+    """
+    Returns ('aa', (prot, ref, pos, alt)) for an aa_change_id (e.g. S:D614G) or ('nuc', (ref, pos, alt)) for a
+    nuc_mutation_id (e.g. A23403G), in VCM syntax.
+    """
+    if ':' in mutation_id:
+        return 'aa', aa_change_id_2_vcm_aa_change(mutation_id.upper())
+    nuc_change_re_match = re.fullmatch(r'([a-zA-Z\-\*]*)([\d/]+)([a-zA-Z\-\*]+)', mutation_id.lower())
+    if not nuc_change_re_match or not nuc_change_re_match.group(2).isdigit():
+        raise MyExceptions.unrecognised_nuc_mutation_id
+    ref, pos, alt = nuc_change_re_match.groups()
+    return 'nuc', (ref, int(pos), alt)
+
+
+async def get_sequences_co_occurrence(all_of: List[str], any_of: List[str], none_of: List[str],
+                                      count_only: bool = False, limit: Optional[int] = None,
+                                      page: Optional[int] = None) -> dict:
+    """
+    Returns the number of the sequences carrying all the mutations in all_of, at least one of the mutations in any_of
+    (if any) and none of the mutations in none_of, and the requested page of their sorted ids. Mutations are
+    nuc_mutation_ids or aa_change_ids. The conjunction starts from the rarest mutation, so its cost depends on the
+    smallest set of sequences involved.
+    """
+    pagination = OptionalPagination(limit, page)
+    if not all_of and not any_of:
+        raise MyExceptions.co_occurrence_without_mutations
+    if len(all_of) + len(any_of) + len(none_of) > MAX_CO_OCCURRENCE_MUTATIONS:
+        raise MyExceptions.co_occurrence_too_many_mutations(MAX_CO_OCCURRENCE_MUTATIONS)
+    all_of = list(dict.fromkeys(map(_vcm_mutation_of, all_of)))
+    any_of = list(dict.fromkeys(map(_vcm_mutation_of, any_of)))
+    none_of = list(dict.fromkeys(map(_vcm_mutation_of, none_of)))
+
+    sequence_index = get_sequence_index()
+    if sequence_index is not None:
+        key_of = {'nuc': lambda m: nuc_mutation_key(*m), 'aa': lambda m: aa_change_key(*m)}
+        all_keys, any_keys, none_keys = ([key_of[kind](m) for kind, m in mutations]
+                                         for mutations in (all_of, any_of, none_of))
+        sequence_ids = sequence_index.all_of(all_keys) if all_keys else None
+        if any_keys and (sequence_ids is None or sequence_ids):
+            sequences_with_any = sequence_index.any_of(any_keys)
+            sequence_ids = sequences_with_any if sequence_ids is None else sequence_ids & sequences_with_any
+        if none_keys and sequence_ids:
+            sequence_ids = sequence_ids - sequence_index.any_of(none_keys)
+    else:
+        async with get_session() as session:
+            sequence_ids = None
+            for mutation in await _sort_by_sequence_count(session, all_of):
+                sequence_ids = await _sequence_ids_carrying_any(session, [mutation], sequence_ids)
+                if not sequence_ids:
+                    break
+            if any_of and (sequence_ids is None or sequence_ids):
+                sequence_ids = await _sequence_ids_carrying_any(session, any_of, sequence_ids)
+            if none_of and sequence_ids:
+                sequence_ids = sequence_ids - await _sequence_ids_carrying_any(session, none_of, sequence_ids)
+    result = {"count": len(sequence_ids)}
+    if not count_only:
+        # the bitmaps of the sequence index are sorted, and are sliced without listing the other ids
+        if isinstance(sequence_ids, set):
+            sequence_ids = sorted(sequence_ids)
+        if pagination:
+            sequence_ids = sequence_ids[pagination.first_idx:pagination.last_idx]
+        result["sequence_ids"] = list(sequence_ids)
+    return result
+
+
+async def _sequence_ids_carrying_any(session, mutations: List[Tuple[str, tuple]],
+                                     among: Optional[Set[int]] = None) -> Set[int]:
+    """
+    Returns the ids of the sequences carrying at least one of the given (kind, VCM mutation) pairs (see
+    _vcm_mutation_of), only among the given sequence ids if among is not None.
+    """
+    nuc_mutations = [m for kind, m in mutations if kind == 'nuc']
+    aa_changes = [m for kind, m in mutations if kind == 'aa']
+    queries_of_kind = []
+    if nuc_mutations:
+        refs, positions, alts = zip(*nuc_mutations)
+        queries_of_kind.append(
+            SQLQuery("select sequence_id from nucleotide_variant natural join sequence", "virus_id = 1")
+            .where("(sequence_original, start_original, sequence_alternative) in ("
+                   "  select * from unnest(cast(:refs as text[]), cast(:positions as integer[]), "
+                   "                      cast(:alts as text[])))",
+                   refs=list(refs), positions=list(positions), alts=list(alts)))
+    if aa_changes:
+        prots, refs, positions, alts = zip(*aa_changes)
+        queries_of_kind.append(
+            SQLQuery("select sequence_id from aminoacid_variant natural join annotation natural join sequence",
+                     "virus_id = 1")
+            .where("(product, sequence_aa_original, start_aa_original, sequence_aa_alternative) in ("
+                   "  select * from unnest(cast(:prots as text[]), cast(:refs as text[]), "
+                   "                      cast(:positions as integer[]), cast(:alts as text[])))",
+                   prots=list(prots), refs=list(refs), positions=list(positions), alts=list(alts)))
+    if among is not None and len(among) > MAX_CO_OCCURRENCE_AMONG_IDS:
+        await _load_co_occurrence_among(session, among)
+    sequence_ids = set()
+    for query in queries_of_kind:
+        if among is None:
+            pass
+        elif len(among) > MAX_CO_OCCURRENCE_AMONG_IDS:
+            query.where("sequence_id in (select sequence_id from co_occurrence_among)")
+        else:
+            query.where("sequence_id = any(:among)", among=list(among))
+        sequence_ids.update(x.sequence_id for x in await query.fetchall(session))
+    return sequence_ids
+
+
+async def _load_co_occurrence_among(session, sequence_ids: Set[int]):
+    """
+    Replaces the content of the temporary table co_occurrence_among (dropped at the end of the transaction of session)
+    with the given sequence ids.
+    """
+    await session.execute(statements.CREATE_CO_OCCURRENCE_AMONG)
+    await session.execute(statements.TRUNCATE_CO_OCCURRENCE_AMONG)
+    sequence_ids = sorted(sequence_ids)
+    for start in range(0, len(sequence_ids), MAX_CO_OCCURRENCE_AMONG_IDS):
+        await session.execute(statements.INSERT_CO_OCCURRENCE_AMONG,
+                              {"sequence_ids": sequence_ids[start:start + MAX_CO_OCCURRENCE_AMONG_IDS]})
+    await session.execute(statements.ANALYZE_CO_OCCURRENCE_AMONG)
+
+
+async def _sort_by_sequence_count(session, mutations: List[Tuple[str, tuple]]) -> List[Tuple[str, tuple]]:
+    """
+    Sorts the (kind, VCM mutation) pairs by the number of sequences carrying them, as recorded in the VCM summary
+    tables. If they are not available, the mutations are returned in the given order.
+    """
+    if len(mutations) < 2 or not summary_tables_available():
+        return mutations
+    count_of_mutation = dict()
+    for kind, mutation in mutations:
+        if kind == 'nuc':
+            ref, pos, alt = mutation
+            result = await session.execute(statements.NUC_MUTATION_SEQUENCE_COUNT,
+                                           {"ref": ref.upper(), "pos": pos, "alt": alt.upper()})
+        else:
+            prot, ref, pos, alt = mutation
+            result = await session.execute(statements.AA_CHANGE_SEQUENCE_COUNT,
+                                           {"prot": prot, "ref": ref, "pos": pos, "alt": alt})
+        count_of_mutation[(kind, mutation)] = result.scalar() or 0
+    return sorted(mutations, key=count_of_mutation.get)
+
+
+def _host_samples_query(sequence_id: Optional[int] = None
+                        , continent: Optional[str] = None
+                        , country: Optional[str] = None
+                        , region: Optional[str] = None
+                        , collection_date: Optional[str] = None
+                        , host_species: Optional[str] = None) -> SQLQuery:
+    host_species = lower_if_exists(host_species)
+    query = SQLQuery("select host_sample_id, geo_group as \"continent\", country, region, collection_date, "
+                     "host_taxon_name as \"host_species\" "
+                     "from host_sample natural join host_specie natural join sequence",
+                     "virus_id = 1",
+                     order_by="host_sample_id")
+    if sequence_id:
+        query.where("sequence_id = :sequence_id", sequence_id=int(sequence_id))
+    if continent:
+        query.where("geo_group ilike :continent", continent=continent)
+    if country:
+        query.where("country ilike :country", country=country)
+    if region:
+        query.where("region ilike :region", region=region)
+    if collection_date:
+        query.where("collection_date = :collection_date", collection_date=collection_date)
+    if host_species:
+        query.where("host_taxon_name = :host_species", host_species=host_species)
+    return query
+
+
 async def get_host_samples(sequence_id: Optional[int] = None
                            , limit: int = None, page: int = None
                            , continent: Optional[str] = None
@@ -3192,82 +2012,112 @@ async def get_host_samples(sequence_id: Optional[int] = None
                            , region: Optional[str] = None
                            , collection_date: Optional[str] = None
                            , host_species: Optional[str] = None):
-    host_species = lower_if_exists(host_species)
     pagination = OptionalPagination(limit, page)
-    pagination_stmt = f'order by host_sample_id {pagination.stmt}'
+    query = _host_samples_query(sequence_id, continent, country, region, collection_date, host_species)
     async with get_session() as session:
-        query_composer = FilterIntersection()
-        select_from_query = \
-            "select host_sample_id, geo_group as \"continent\", country, region, collection_date, " \
-            "host_taxon_name as \"host_species\" " \
-            "from host_sample natural join host_specie "
-
-        if sequence_id:
-            query = f"{select_from_query} natural join sequence s " \
-                    f"where s.sequence_id = {sequence_id} " \
-                    f"and s.virus_id = 1 " \
-                    f"{pagination_stmt};"
-            host_samples_of_sequence_id = await session.execute(query)
-            host_samples_of_sequence_id = host_samples_of_sequence_id.fetchall()
-            query_composer.add_filter(sequence_id, host_samples_of_sequence_id)
-        if continent:
-            query = f"{select_from_query} natural join sequence where virus_id = 1 " \
-                    f"and geo_group ilike '{continent}' " \
-                    f"{pagination_stmt};"
-            hosts_of_continent = await session.execute(query)
-            hosts_of_continent = hosts_of_continent.fetchall()
-            query_composer.add_filter(continent, hosts_of_continent)
-        if country:
-            query = f"{select_from_query} natural join sequence where virus_id = 1 " \
-                    f"and country ilike '{country}' " \
-                    f"{pagination_stmt};"
-            hosts_of_country = await session.execute(query)
-            hosts_of_country = hosts_of_country.fetchall()
-            query_composer.add_filter(country, hosts_of_country)
-        if region:
-            query = f"{select_from_query} natural join sequence where virus_id = 1 " \
-                    f"and region ilike '{region}' " \
-                    f"{pagination_stmt};"
-            hosts_of_region = await session.execute(query)
-            hosts_of_region = hosts_of_region.fetchall()
-            query_composer.add_filter(region, hosts_of_region)
-        if collection_date:
-            query = f"{select_from_query} natural join sequence where virus_id = 1 " \
-                    f"and collection_date = '{collection_date}' " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = result.fetchall()
-            query_composer.add_filter(collection_date, result)
-        if host_species:
-            query = f"{select_from_query} natural join sequence where virus_id = 1 " \
-                    f"and host_taxon_name '{host_species}' " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = result.fetchall()
-            query_composer.add_filter(host_species, result)
-
-        query_composer.intersect_results(lambda x: x.host_sample_id)
-        if query_composer.result() != FilterIntersection.NO_FILTERS:
-            return [dict(x) for x in query_composer.result()]
-        else:
-            query = f"{select_from_query} natural join sequence where virus_id = 1 {pagination_stmt};"
-            all_host_samples = await session.execute(query)
-            all_host_samples = [dict(x) for x in all_host_samples.fetchall()]
-            return all_host_samples
+        return [dict(x) for x in await query.fetchall(session, pagination)]
 
 
 async def get_host_sample(host_sample_id):
+    async with get_session() as session:
+        result = await session.execute(statements.HOST_SAMPLE_BY_ID, {"host_sample_id": int(host_sample_id)})
+        return [dict(x) for x in result.fetchall()]
+
+
+async def get_host_samples_by_sequence_ids(sequence_ids: List[int]):
+    """Same as get_host_samples(sequence_id=...) repeated for every sequence_id, but resolved with a single query."""
     async with get_session() as session:
         result = await session.execute(
-            "select host_sample_id, geo_group as \"continent\", country, region, collection_date, "
-            "host_taxon_name as \"host_species\" "
-            "from host_sample natural join host_specie "
-            f"where host_sample_id = {host_sample_id} "
-            f"limit 1;"
-        )
+            statements.HOST_SAMPLES_BY_SEQUENCE_IDS,
+            {"sequence_ids": [int(x) for x in sequence_ids]})
         return [dict(x) for x in result.fetchall()]
 
 
+def _nuc_mutations_query(sequence_id: Optional[int] = None
+                         , nuc_positional_mutation_id: Optional[str] = None
+                         , reference: Optional[str] = None
+                         , position: Optional[int] = None
+                         , alternative: Optional[str] = None
+                         , _type: Optional[str] = None
+                         , length: Optional[int] = None) -> SQLQuery:
+    if not sequence_id and summary_tables_available():
+        return _nuc_mutations_summary_query(nuc_positional_mutation_id, reference, position, alternative, _type,
+                                            length)
+    return _nuc_mutations_variants_query(sequence_id, nuc_positional_mutation_id, reference, position, alternative,
+                                         _type, length)
+
+
+def _nuc_mutations_variants_query(sequence_id: Optional[int] = None
+                                  , nuc_positional_mutation_id: Optional[str] = None
+                                  , reference: Optional[str] = None
+                                  , position: Optional[int] = None
+                                  , alternative: Optional[str] = None
+                                  , _type: Optional[str] = None
+                                  , length: Optional[int] = None) -> SQLQuery:
+    """Same as _nuc_mutations_query, but always de-duplicates the nucleotide_variant table (the summary table doesn't
+    record the sequences)."""
+    query = SQLQuery("select upper(concat(sequence_original, start_original, sequence_alternative)) "
+                     "as \"nuc_mutation_id\", "
+                     "upper(sequence_original) as \"reference\", "
+                     "start_original as \"position\", upper(sequence_alternative) as \"alternative\", "
+                     "variant_type as \"type\", variant_length as \"length\" "
+                     "from nucleotide_variant natural join sequence",
+                     "virus_id = 1",
+                     group_by="1, 2, 3, 4, 5, 6",
+                     order_by="reference, position, alternative",
+                     keyset=[("upper(sequence_original)", "reference", str),
+                             (nullable_key("start_original", int), "position", int),
+                             ("upper(sequence_alternative)", "alternative", str), ("variant_type", "type", str),
+                             ("variant_length", "length", int)])
+    if sequence_id:
+        query.where("sequence_id = :sequence_id", sequence_id=int(sequence_id))
+    if nuc_positional_mutation_id:
+        ref, pos, alt = kb_nuc_mut_2_vcm_nuc_mut(nuc_positional_mutation_id)
+        query.where("(sequence_original, start_original, sequence_alternative) = (:npm_ref, :npm_pos, :npm_alt)",
+                    npm_ref=ref, npm_pos=pos, npm_alt=alt)
+    if reference:
+        query.where("sequence_original = :reference", reference=reference.lower())
+    if position:
+        query.where("start_original = :position", position=position)
+    if alternative:
+        query.where("sequence_alternative = :alternative", alternative=alternative.lower())
+    if _type:
+        query.where("variant_type = :type", type=_type.upper())
+    if length:
+        query.where("variant_length = :length", length=length)
+    return query
+
+
+def _nuc_mutations_summary_query(nuc_positional_mutation_id: Optional[str] = None
+                                 , reference: Optional[str] = None
+                                 , position: Optional[int] = None
+                                 , alternative: Optional[str] = None
+                                 , _type: Optional[str] = None
+                                 , length: Optional[int] = None) -> SQLQuery:
+    """Same as _nuc_mutations_query without sequence_id, but reads the distinct nuc mutations from the summary table
+    (see dal/data_sqlalchemy/summary_tables.py)."""
+    query = SQLQuery("select nuc_mutation_id, reference, position, alternative, type, length "
+                     f"from {NUC_MUTATION_SUMMARY}",
+                     order_by="reference, position, alternative",
+                     keyset=[("reference", "reference", str), (nullable_key("position", int), "position", int),
+                             ("alternative", "alternative", str), ("type", "type", str), ("length", "length", int)])
+    if nuc_positional_mutation_id:
+        ref, pos, alt = kb_nuc_mut_2_vcm_nuc_mut(nuc_positional_mutation_id)
+        query.where("(reference, position, alternative) = (:npm_ref, :npm_pos, :npm_alt)",
+                    npm_ref=ref.upper(), npm_pos=pos, npm_alt=alt.upper())
+    if reference:
+        query.where("reference = :reference", reference=reference.upper())
+    if position:
+        query.where("position = :position", position=position)
+    if alternative:
+        query.where("alternative = :alternative", alternative=alternative.upper())
+    if _type:
+        query.where("type = :type", type=_type.upper())
+    if length:
+        query.where("length = :length", length=length)
+    return query
+
+
 async def get_nuc_mutations(sequence_id: Optional[int] = None
                             , nuc_positional_mutation_id: Optional[str] = None
                             , limit: int = None, page: int = None
@@ -3275,91 +2125,159 @@ async def get_nuc_mutations(sequence_id: Optional[int] = None
                             , position: Optional[int] = None
                             , alternative: Optional[str] = None
                             , _type: Optional[str] = None
-                            , length: Optional[int] = None):
-    pagination = OptionalPagination(limit, page)
-    pagination_stmt = f'order by reference, position, alternative ' \
-                      f'{pagination.stmt}'
+                            , length: Optional[int] = None
+                            , cursor: Optional[str] = None):
+    pagination = pagination_of(limit, page, cursor)
+    query = _nuc_mutations_query(sequence_id, nuc_positional_mutation_id, reference, position, alternative, _type,
+                                 length)
     async with get_session() as session:
-        query_composer = FilterIntersection()
-        select_from_where_query = \
-            "select distinct upper(concat(sequence_original, start_original, sequence_alternative)) as \"nuc_mutation_id\", " \
-            "upper(sequence_original) as \"reference\", " \
-            " start_original as \"position\", upper(sequence_alternative) as \"alternative\", " \
-            "variant_type as \"type\", variant_length as \"length\" " \
-            "from nucleotide_variant natural join sequence where virus_id = 1 "
-
-        if sequence_id:
-            query = f"{select_from_where_query} and sequence_id = {sequence_id} " \
-                    f"{pagination_stmt};"
-            nuc_mutations_of_sequence = await session.execute(query)
-            nuc_mutations_of_sequence = nuc_mutations_of_sequence.fetchall()
-            query_composer.add_filter(sequence_id, nuc_mutations_of_sequence)
-        if nuc_positional_mutation_id:
-            result = await get_nuc_mutation(nuc_positional_mutation_id)
-            query_composer.add_filter(nuc_positional_mutation_id, result)
-        if reference:
-            query = f"{select_from_where_query} " \
-                    f"and sequence_original = '{reference.lower()}' " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = result.fetchall()
-            query_composer.add_filter(reference, result)
-        if position:
-            query = f"{select_from_where_query} " \
-                    f"and start_original = {position} " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = result.fetchall()
-            query_composer.add_filter(position, result)
-        if alternative:
-            query = f"{select_from_where_query} " \
-                    f"and sequence_alternative = '{alternative.lower()}' " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = result.fetchall()
-            query_composer.add_filter(alternative, result)
-        if _type:
-            query = f"{select_from_where_query} " \
-                    f"and variant_type = '{_type.upper()}' " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = result.fetchall()
-            query_composer.add_filter(_type, result)
-        if length:
-            query = f"{select_from_where_query} " \
-                    f"and variant_length = {length} " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = result.fetchall()
-            query_composer.add_filter(length, result)
-
-        query_composer.intersect_results(lambda x: x.nuc_mutation_id)
-        if query_composer.result() != FilterIntersection.NO_FILTERS:
-            return [dict(x) for x in query_composer.result()]
-        else:
-            query = f"{select_from_where_query} {pagination_stmt};"
-            all_mutations = await session.execute(query)
-            all_mutations = [dict(x) for x in all_mutations.fetchall()]
-            return all_mutations
+        result = await query.fetchall(session, pagination)
+        if pagination.is_keyset:
+            return pagination.page([dict(x) for x in result], query.key_of(result[-1]) if result else None)
+        return [dict(x) for x in result]
 
 
 async def get_nuc_mutation(nuc_mutation_id: str):
     async with get_session() as session:
         ref, pos, alt = kb_nuc_mut_2_vcm_nuc_mut(nuc_mutation_id)
-        query = "select upper(concat(sequence_original, start_original, sequence_alternative)) as \"nuc_mutation_id\", " \
-                "upper(sequence_original) as \"reference\", " \
-                "start_original as \"position\", upper(sequence_alternative) as \"alternative\", " \
-                "variant_type as \"type\", variant_length as \"length\" " \
-                "from nucleotide_variant natural join sequence " \
-                "where virus_id = 1 " \
-                f"and sequence_original = '{ref}' " \
-                f"and start_original = {pos} " \
-                f"and sequence_alternative = '{alt}' " \
-                f"limit 1;"
-        mutations_equal_to_positional_mutation = await session.execute(query)
+        mutations_equal_to_positional_mutation = await session.execute(statements.NUC_MUTATION_BY_REF_POS_ALT,
+                                                                       {"ref": ref, "pos": pos, "alt": alt})
         return mutations_equal_to_positional_mutation.fetchall()
 
 
+async def get_nuc_mutations_by_sequence_ids(sequence_ids: List[int]):
+    """Same as get_nuc_mutations(sequence_id=...) repeated for every sequence_id, but resolved with a single query."""
+    async with get_session() as session:
+        result = await session.execute(
+            statements.NUC_MUTATIONS_BY_SEQUENCE_IDS,
+            {"sequence_ids": [int(x) for x in sequence_ids]})
+        return [dict(x) for x in result.fetchall()]
+
+
+async def get_nuc_mutations_by_nuc_positional_mutation_ids(nuc_positional_mutation_ids: List[str]):
+    """Same as get_nuc_mutations(nuc_positional_mutation_id=...) repeated for every nuc_positional_mutation_id, but
+    resolved with a single query (one row for each matching mutation, as in get_nuc_mutation)."""
+    refs, positions, alts = [], [], []
+    for nuc_positional_mutation_id in nuc_positional_mutation_ids:
+        ref, pos, alt = kb_nuc_mut_2_vcm_nuc_mut(nuc_positional_mutation_id)
+        refs.append(ref)
+        positions.append(pos)
+        alts.append(alt)
+    async with get_session() as session:
+        result = await session.execute(
+            statements.NUC_MUTATIONS_BY_ANY_REF_POS_ALT,
+            {"refs": refs, "positions": positions, "alts": alts})
+        return [dict(x) for x in result.fetchall()]
+
+
+def _aa_changes_query(sequence_id: Optional[int] = None
+                      , protein_id: Optional[str] = None
+                      , aa_positional_change_id: Optional[str] = None
+                      , reference: Optional[str] = None
+                      , position: Optional[int] = None
+                      , alternative: Optional[str] = None
+                      , _type: Optional[str] = None
+                      , length: Optional[int] = None) -> SQLQuery:
+    protein_id = upper_if_exists(protein_id)
+    if not sequence_id and summary_tables_available():
+        return _aa_changes_summary_query(protein_id, aa_positional_change_id, reference, position, alternative, _type,
+                                         length)
+    return _aa_changes_variants_query(sequence_id, protein_id, aa_positional_change_id, reference, position,
+                                      alternative, _type, length)
+
+
+def _aa_changes_variants_query(sequence_id: Optional[int] = None
+                               , protein_id: Optional[str] = None
+                               , aa_positional_change_id: Optional[str] = None
+                               , reference: Optional[str] = None
+                               , position: Optional[int] = None
+                               , alternative: Optional[str] = None
+                               , _type: Optional[str] = None
+                               , length: Optional[int] = None) -> SQLQuery:
+    """Same as _aa_changes_query, but always de-duplicates the aminoacid_variant table (the summary table doesn't
+    record the sequences)."""
+    protein_id = upper_if_exists(protein_id)
+    # aa_positional_change_id is made uppercase and converted to virusurf's syntax in vcm_aa_change_2_aa_change_id
+    # the following query omits the aa_change_id because it is built using the protein, but the protein name
+    # must be converted
+    query = SQLQuery("select product as \"protein\", sequence_aa_original as \"reference\", "
+                     "start_aa_original as \"position\", sequence_aa_alternative as \"alternative\", "
+                     "variant_aa_type as \"type\", variant_aa_length as \"length\" "
+                     "from aminoacid_variant natural join annotation natural join sequence",
+                     "virus_id = 1",
+                     group_by="1, 2, 3, 4, 5, 6",
+                     order_by="product, reference, position, alternative",
+                     keyset=[(nullable_key("product", str), "protein", str), ("sequence_aa_original", "reference", str),
+                             (nullable_key("start_aa_original", int), "position", int),
+                             ("sequence_aa_alternative", "alternative", str),
+                             ("variant_aa_type", "type", str), ("variant_aa_length", "length", int)],
+                     map_row=lambda row: vcm_aa_change_2_aa_change_id(row, protein_id))
+    if sequence_id:
+        query.where("sequence_id = :sequence_id", sequence_id=int(sequence_id))
+    if protein_id:
+        query.where("product = :protein", protein=short_protein_name_2_vcm_syntax.get(protein_id, '_'))
+    if aa_positional_change_id:
+        prot, ref, pos, alt = aa_change_id_2_vcm_aa_change(aa_positional_change_id)
+        query.where("(product, sequence_aa_original, start_aa_original, sequence_aa_alternative) = "
+                    "(:apc_prot, :apc_ref, :apc_pos, :apc_alt)",
+                    apc_prot=prot, apc_ref=ref, apc_pos=pos, apc_alt=alt)
+    if reference:
+        query.where("sequence_aa_original = :reference", reference=reference.upper())
+    if position:
+        query.where("start_aa_original = :position", position=position)
+    if alternative:
+        query.where("sequence_aa_alternative = :alternative", alternative=alternative.upper())
+    if _type:
+        query.where("variant_aa_type = :type", type=_type.upper())
+    if length:
+        query.where("variant_aa_length = :length", length=length)
+    return query
+
+
+def _aa_changes_summary_query(protein_id: Optional[str] = None
+                              , aa_positional_change_id: Optional[str] = None
+                              , reference: Optional[str] = None
+                              , position: Optional[int] = None
+                              , alternative: Optional[str] = None
+                              , _type: Optional[str] = None
+                              , length: Optional[int] = None) -> SQLQuery:
+    """Same as _aa_changes_query without sequence_id, but reads the distinct aa changes from the summary table
+    (see dal/data_sqlalchemy/summary_tables.py), where they are already converted to the KB syntax. Filters and
+    ordering still refer to the VCM syntax (vcm_protein, vcm_position)."""
+    if protein_id:
+        # the result is labelled with the requested protein, as in _aa_changes_query
+        map_row = lambda row: vcm_aa_change_2_aa_change_id(row, protein_id)
+    else:
+        map_row = lambda row: {"aa_change_id": row.aa_change_id, "protein_id": row.protein_id,
+                               "reference": row.reference, "position": row.kb_position,
+                               "alternative": row.alternative, "type": row.type, "length": row.length}
+    query = SQLQuery("select vcm_protein as \"protein\", reference, vcm_position as \"position\", alternative, "
+                     "type, length, aa_change_id, protein_id, position as \"kb_position\" "
+                     f"from {AA_CHANGE_SUMMARY}",
+                     order_by="vcm_protein, reference, vcm_position, alternative",
+                     keyset=[("vcm_protein", "protein", str), ("reference", "reference", str),
+                             (nullable_key("vcm_position", int), "position", int), ("alternative", "alternative", str),
+                             ("type", "type", str), ("length", "length", int)],
+                     map_row=map_row)
+    if protein_id:
+        query.where("vcm_protein = :protein", protein=short_protein_name_2_vcm_syntax.get(protein_id, '_'))
+    if aa_positional_change_id:
+        prot, ref, pos, alt = aa_change_id_2_vcm_aa_change(aa_positional_change_id)
+        query.where("(vcm_protein, reference, vcm_position, alternative) = (:apc_prot, :apc_ref, :apc_pos, :apc_alt)",
+                    apc_prot=prot, apc_ref=ref, apc_pos=pos, apc_alt=alt)
+    if reference:
+        query.where("reference = :reference", reference=reference.upper())
+    if position:
+        query.where("vcm_position = :position", position=position)
+    if alternative:
+        query.where("alternative = :alternative", alternative=alternative.upper())
+    if _type:
+        query.where("type = :type", type=_type.upper())
+    if length:
+        query.where("length = :length", length=length)
+    return query
+
+
 async def get_aa_changes(sequence_id: Optional[int] = None
                          , protein_id: Optional[str] = None
                          , aa_positional_change_id: Optional[str] = None
@@ -3368,99 +2286,91 @@ async def get_aa_changes(sequence_id: Optional[int] = None
                          , position: Optional[int] = None
                          , alternative: Optional[str] = None
                          , _type: Optional[str] = None
-                         , length: Optional[int] = None):
-    protein_id = upper_if_exists(protein_id)
-    # aa_positional_change_id is made uppercase and converted to virusurf's syntax in vcm_aa_change_2_aa_change_id
-    pagination = OptionalPagination(limit, page)
-    pagination_stmt = f'order by product, reference, position, alternative {pagination.stmt}'
+                         , length: Optional[int] = None
+                         , cursor: Optional[str] = None):
+    pagination = pagination_of(limit, page, cursor)
+    query = _aa_changes_query(sequence_id, protein_id, aa_positional_change_id, reference, position, alternative, _type,
+                              length)
     async with get_session() as session:
-        query_composer = FilterIntersection()
-        # the following query omits the aa_change_id because it is built using the protein, but the protein name
-        # must be converted
-        select_from_where_query = \
-            "select distinct product as \"protein\", sequence_aa_original as \"reference\", " \
-            "start_aa_original as \"position\", sequence_aa_alternative as \"alternative\", " \
-            "variant_aa_type as \"type\", variant_aa_length as \"length\" " \
-            "from aminoacid_variant natural join annotation natural join sequence where virus_id = 1 "
-
-        if sequence_id:
-            query = f"{select_from_where_query} and sequence_id = {sequence_id} {pagination_stmt};"
-            aa_changes_of_sequence = await session.execute(query)
-            aa_changes_of_sequence = [vcm_aa_change_2_aa_change_id(x) for x in aa_changes_of_sequence.fetchall()]
-            query_composer.add_filter(sequence_id, aa_changes_of_sequence)
-        if protein_id:
-            query = f"{select_from_where_query} and product = '{short_protein_name_2_vcm_syntax.get(protein_id, '_')}' " \
-                    f"{pagination_stmt};"
-            aa_changes_in_prot = await session.execute(query)
-            aa_changes_in_prot = [vcm_aa_change_2_aa_change_id(x, protein_id) for x in aa_changes_in_prot.fetchall()]
-            query_composer.add_filter(protein_id, aa_changes_in_prot)
-        if aa_positional_change_id:
-            result = await get_aa_change(aa_positional_change_id)
-            query_composer.add_filter(aa_positional_change_id, result)
-        if reference:
-            query = f"{select_from_where_query} " \
-                    f"and sequence_aa_original = '{reference.upper()}' " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = [vcm_aa_change_2_aa_change_id(x) for x in result.fetchall()]
-            query_composer.add_filter(reference, result)
-        if position:
-            query = f"{select_from_where_query} " \
-                    f"and start_aa_original = {position} " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = [vcm_aa_change_2_aa_change_id(x) for x in result.fetchall()]
-            query_composer.add_filter(position, result)
-        if alternative:
-            query = f"{select_from_where_query} " \
-                    f"and sequence_aa_alternative = '{alternative.upper()}' " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = [vcm_aa_change_2_aa_change_id(x) for x in result.fetchall()]
-            query_composer.add_filter(alternative, result)
-        if _type:
-            query = f"{select_from_where_query} " \
-                    f"and variant_aa_type = '{_type.upper()}' " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = [vcm_aa_change_2_aa_change_id(x) for x in result.fetchall()]
-            query_composer.add_filter(_type, result)
-        if length:
-            query = f"{select_from_where_query} " \
-                    f"and variant_aa_length = {length} " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = [vcm_aa_change_2_aa_change_id(x) for x in result.fetchall()]
-            query_composer.add_filter(length, result)
-
-        query_composer.intersect_results(lambda x: x["aa_change_id"])
-        if query_composer.result() != FilterIntersection.NO_FILTERS:
-            return query_composer.result()
-        else:
-            query = f"{select_from_where_query} {pagination_stmt};"
-            all_aa_changes = await session.execute(query)
-            all_aa_changes = [vcm_aa_change_2_aa_change_id(x) for x in all_aa_changes.fetchall()]
-            return all_aa_changes
+        result = await query.fetchall(session, pagination)
+        aa_changes = [query.map_row(x) for x in result]
+        if pagination.is_keyset:
+            return pagination.page(aa_changes, query.key_of(result[-1]) if result else None)
+        return aa_changes
 
 
 async def get_aa_change(aa_change_id: str):
     async with get_session() as session:
         prot, ref, pos, alt = aa_change_id_2_vcm_aa_change(aa_change_id)
-        result = await session.execute(
-            "select product as \"protein\", sequence_aa_original as \"reference\", "
-            "start_aa_original as \"position\", sequence_aa_alternative as \"alternative\", "
-            "variant_aa_type as \"type\", variant_aa_length as \"length\" "
-            "from aminoacid_variant natural join annotation natural join sequence where virus_id = 1 "
-            f"and product = '{prot}' "
-            f"and sequence_aa_original = '{ref}' "
-            f"and start_aa_original = {pos} "
-            f"and sequence_aa_alternative = '{alt}' "
-            f"limit 1;"
-        )
+        result = await session.execute(statements.AA_CHANGE_BY_PROT_REF_POS_ALT,
+                                       {"prot": prot, "ref": ref, "pos": pos, "alt": alt})
         result = [vcm_aa_change_2_aa_change_id(x) for x in result.fetchall()]
         return result
 
 
+async def get_aa_changes_by_sequence_ids(sequence_ids: List[int]):
+    """Same as get_aa_changes(sequence_id=...) repeated for every sequence_id, but resolved with a single query."""
+    async with get_session() as session:
+        result = await session.execute(
+            statements.AA_CHANGES_BY_SEQUENCE_IDS,
+            {"sequence_ids": [int(x) for x in sequence_ids]})
+        return vcm_aa_changes_2_aa_change_ids(result.fetchall())
+
+
+async def get_aa_changes_by_aa_positional_change_ids(aa_positional_change_ids: List[str]):
+    """Same as get_aa_changes(aa_positional_change_id=...) repeated for every aa_positional_change_id, but resolved
+    with a single query (one row for each matching change, as in get_aa_change)."""
+    prots, refs, positions, alts = [], [], [], []
+    for aa_positional_change_id in aa_positional_change_ids:
+        prot, ref, pos, alt = aa_change_id_2_vcm_aa_change(aa_positional_change_id)
+        prots.append(prot)
+        refs.append(ref)
+        positions.append(pos)
+        alts.append(alt)
+    async with get_session() as session:
+        result = await session.execute(
+            statements.AA_CHANGES_BY_ANY_PROT_REF_POS_ALT,
+            {"prots": prots, "refs": refs, "positions": positions, "alts": alts})
+        return vcm_aa_changes_2_aa_change_ids(result.fetchall())
+
+
+def _epitopes_query(assay_id: Optional[int] = None
+                    , protein_id: Optional[str] = None
+                    , aa_positional_change_id: Optional[str] = None
+                    , host_species: Optional[str] = None
+                    , epitope_start: Optional[int] = None
+                    , epitope_stop: Optional[int] = None) -> SQLQuery:
+    protein_id = upper_if_exists(protein_id)
+    # aa_positional_change_id is made uppercase and converted to virusurf's syntax in vcm_aa_change_2_aa_change_id
+    host_species = lower_if_exists(host_species)
+    query = SQLQuery("select epi_fragment_id as \"epitope_id\" , protein_name as \"protein_id\", "
+                     "host_taxon_name as \"host_species\", epi_frag_annotation_start as \"epitope_start\", "
+                     "epi_frag_annotation_stop as \"epitope_stop\" "
+                     "from epitope natural join epitope_fragment natural join host_specie",
+                     "virus_id = 1",
+                     order_by="epi_fragment_id",
+                     map_row=lambda row: epitope_protein_2_kb_protein(row, protein_id))
+    if assay_id:
+        query.where("(cell_type, mhc_allele, mhc_class) = ( "
+                    "   select cell_type, mhc_allele, mhc_class "
+                    "   from epitope "
+                    "   where epitope_id = :assay_id limit 1 )",
+                    assay_id=int(assay_id))
+    if protein_id:
+        query.where("protein_name = :protein", protein=short_protein_name_2_vcm_syntax.get(protein_id, "_"))
+    if aa_positional_change_id:
+        prot, ref, pos, alt = aa_change_id_2_vcm_aa_change(aa_positional_change_id)
+        query.where("epi_fragment_id = any(:apc_epitope_ids)",
+                    apc_epitope_ids=get_epitope_index().epitopes_over(prot, pos))
+    if host_species:
+        query.where("host_taxon_name = :host_species", host_species=host_species)
+    if epitope_start:
+        query.where("epi_frag_annotation_start = :epitope_start", epitope_start=epitope_start)
+    if epitope_stop:
+        query.where("epi_frag_annotation_stop = :epitope_stop", epitope_stop=epitope_stop)
+    return query
+
+
 async def get_epitopes(assay_id: Optional[int] = None
                        , protein_id: Optional[str] = None
                        , aa_positional_change_id: Optional[str] = None
@@ -3468,141 +2378,69 @@ async def get_epitopes(assay_id: Optional[int] = None
                        , host_species: Optional[str] = None
                        , epitope_start: Optional[int] = None
                        , epitope_stop: Optional[int] = None):
-    protein_id = upper_if_exists(protein_id)
-    # aa_positional_change_id is made uppercase and converted to virusurf's syntax in vcm_aa_change_2_aa_change_id
-    host_species = lower_if_exists(host_species)
     pagination = OptionalPagination(limit, page)
-    pagination_stmt = f'order by epi_fragment_id {pagination.stmt}'
-    query_composer = FilterIntersection()
-    select_from_where_query = f"select epi_fragment_id as \"epitope_id\" , protein_name as \"protein_id\", " \
-                              f"host_taxon_name as \"host_species\", epi_frag_annotation_start as \"epitope_start\", " \
-                              f"epi_frag_annotation_stop as \"epitope_stop\" " \
-                              f"from epitope natural join epitope_fragment natural join host_specie " \
-                              f"where virus_id = 1 "
+    query = _epitopes_query(assay_id, protein_id, aa_positional_change_id, host_species, epitope_start, epitope_stop)
     async with get_session() as session:
-        if assay_id:
-            query = f"{select_from_where_query} " \
-                    f"and (cell_type, mhc_allele, mhc_class) = ( " \
-                    "   select cell_type, mhc_allele, mhc_class " \
-                    "   from epitope " \
-                    f"  where epitope_id = {assay_id} limit 1 ) " \
-                    f"{pagination_stmt};"
-            epitopes_in_assay = await session.execute(query)
-            epitopes_in_assay = [epitope_protein_2_kb_protein(x) for x in epitopes_in_assay.fetchall()]
-            query_composer.add_filter(assay_id, epitopes_in_assay)
-        if protein_id:
-            vcm_protein = short_protein_name_2_vcm_syntax.get(protein_id, "_")
-            query = f"{select_from_where_query} " \
-                    f"and protein_name = '{vcm_protein}' {pagination_stmt};"
-            epitopes_in_protein = await session.execute(query)
-            epitopes_in_protein = [epitope_protein_2_kb_protein(x, protein_id) for x in epitopes_in_protein.fetchall()]
-            query_composer.add_filter(protein_id, epitopes_in_protein)
-        if aa_positional_change_id:
-            prot, ref, pos, alt = aa_change_id_2_vcm_aa_change(aa_positional_change_id)
-            query = f"{select_from_where_query} and protein_name = '{prot}' " \
-                    f"and epi_frag_annotation_start < {pos} and epi_frag_annotation_stop > {pos} " \
-                    f"{pagination_stmt};"
-            epitopes_over_aa_change = await session.execute(query)
-            epitopes_over_aa_change = [epitope_protein_2_kb_protein(x) for x in epitopes_over_aa_change.fetchall()]
-            query_composer.add_filter(aa_positional_change_id, epitopes_over_aa_change)
-        if host_species:
-            query = f"{select_from_where_query} " \
-                    f"and host_taxon_name = '{host_species}' {pagination_stmt};"
-            result = await session.execute(query)
-            result = [epitope_protein_2_kb_protein(x) for x in result.fetchall()]
-            query_composer.add_filter(host_species, result)
-        if epitope_start:
-            query = f"{select_from_where_query} " \
-                    f"and epi_frag_annotation_start = {epitope_start} {pagination_stmt};"
-            result = await session.execute(query)
-            result = [epitope_protein_2_kb_protein(x) for x in result.fetchall()]
-            query_composer.add_filter(epitope_start, result)
-        if epitope_stop:
-            query = f"{select_from_where_query} " \
-                    f"and epi_frag_annotation_stop = {epitope_stop} {pagination_stmt};"
-            result = await session.execute(query)
-            result = [epitope_protein_2_kb_protein(x) for x in result.fetchall()]
-            query_composer.add_filter(epitope_stop, result)
-
-        query_composer.intersect_results(lambda x: x["epitope_id"])
-        if query_composer.result() != FilterIntersection.NO_FILTERS:
-            return query_composer.result()
-        else:
-            query = f"{select_from_where_query} {pagination_stmt};"
-            all_epitopes = await session.execute(query)
-            all_epitopes = [epitope_protein_2_kb_protein(x) for x in all_epitopes.fetchall()]
-            return all_epitopes
+        result = await query.fetchall(session, pagination)
+        return [query.map_row(x) for x in result]
+
+
+async def get_epitopes_by_aa_positional_change_ids(aa_positional_change_ids: List[str]):
+    """Same as get_epitopes(aa_positional_change_id=...) repeated for every aa_positional_change_id, but resolved
+    with a single lookup of the epitope index and a single query."""
+    protein_positions = []
+    for aa_positional_change_id in aa_positional_change_ids:
+        prot, ref, pos, alt = aa_change_id_2_vcm_aa_change(aa_positional_change_id)
+        protein_positions.append((prot, pos))
+    query = _epitopes_query()
+    query.where("epi_fragment_id = any(:epitope_ids)",
+                epitope_ids=get_epitope_index().epitopes_over_any(protein_positions))
+    async with get_session() as session:
+        result = await query.fetchall(session)
+        return [query.map_row(x) for x in result]
 
 
 async def get_epitope(epitope_id: int):
     async with get_session() as session:
-        result = await session.execute(
-            f"select epi_fragment_id as \"epitope_id\" , protein_name as \"protein_id\", "
-            f"host_taxon_name as \"host_species\", epi_frag_annotation_start as \"epitope_start\", "
-            f"epi_frag_annotation_stop as \"epitope_stop\" "
-            f"from epitope natural join epitope_fragment natural join host_specie "
-            f"where virus_id = 1 "
-            f"and epi_fragment_id = {epitope_id} "
-            f"limit 1;"
-        )
+        result = await session.execute(statements.EPITOPE_BY_ID, {"epitope_id": int(epitope_id)})
         return [epitope_protein_2_kb_protein(x) for x in result.fetchall()]
 
 
+def _assays_query(epitope_id: Optional[int] = None
+                  , assay_type: Optional[str] = None
+                  , mhc_class: Optional[str] = None
+                  , hla_restriction: Optional[str] = None) -> SQLQuery:
+    query = SQLQuery("select distinct on (e.cell_type, e.mhc_class, e.mhc_allele) e.epitope_id as \"assay_id\", "
+                     "e.cell_type as \"assay_type\", e.mhc_class, e.mhc_allele as \"hla_restriction\" "
+                     "from epitope e",
+                     "virus_id = 1",
+                     order_by="assay_type, mhc_class, hla_restriction, epitope_id")
+    if epitope_id:
+        query.where("( cell_type, coalesce(mhc_class, 'NULL'), coalesce(mhc_allele, 'NULL') ) = "
+                    "( "
+                    "   select cell_type, coalesce(mhc_class, 'NULL'), coalesce(mhc_allele, 'NULL') "
+                    "   from epitope natural join epitope_fragment "
+                    "   where virus_id = 1 and epi_fragment_id = :epitope_id "
+                    ")",
+                    epitope_id=int(epitope_id))
+    if assay_type:
+        query.where("e.cell_type ilike :assay_type", assay_type=assay_type)
+    if mhc_class:
+        query.where("e.mhc_class = :mhc_class", mhc_class=mhc_class.upper())
+    if hla_restriction:
+        query.where("e.mhc_allele ilike :hla_restriction", hla_restriction=hla_restriction)
+    return query
+
+
 async def get_assays(epitope_id: Optional[int] = None
                      , limit: int = None, page: int = None
                      , assay_type: Optional[str] = None
                      , mhc_class: Optional[str] = None
                      , hla_restriction: Optional[str] = None):
     pagination = OptionalPagination(limit, page)
-    pagination_stmt = f'order by assay_type, mhc_class, hla_restriction, epitope_id {pagination.stmt}'
-    query_composer = FilterIntersection()
-    select_from_where_query = "select distinct on (e.cell_type, e.mhc_class, e.mhc_allele) e.epitope_id as \"assay_id\", " \
-                        "e.cell_type as \"assay_type\", e.mhc_class, e.mhc_allele as \"hla_restriction\" " \
-                        "from epitope e " \
-                        "where virus_id = 1 "
+    query = _assays_query(epitope_id, assay_type, mhc_class, hla_restriction)
     async with get_session() as session:
-        if epitope_id:
-            query = f"{select_from_where_query} and " \
-                    "( cell_type, coalesce(mhc_class, 'NULL'), coalesce(mhc_allele, 'NULL') ) = " \
-                    "( " \
-                    "   select cell_type, coalesce(mhc_class, 'NULL'), coalesce(mhc_allele, 'NULL') " \
-                    "   from epitope natural join epitope_fragment " \
-                    f"  where virus_id = 1 and epi_fragment_id = {epitope_id} " \
-                    f") " \
-                    f"{pagination_stmt};"
-            assays_of_epitope = await session.execute(query)
-            assays_of_epitope = assays_of_epitope.fetchall()
-            query_composer.add_filter(epitope_id, assays_of_epitope)
-        if assay_type:
-            query = f"{select_from_where_query} and " \
-                    f"e.cell_type ilike '{assay_type}' " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = result.fetchall()
-            query_composer.add_filter(assay_type, result)
-        if mhc_class:
-            query = f"{select_from_where_query} and " \
-                    f"e.mhc_class = '{mhc_class.upper()}' " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = result.fetchall()
-            query_composer.add_filter(mhc_class, result)
-        if hla_restriction:
-            query = f"{select_from_where_query} and " \
-                    f"e.mhc_allele ilike '{hla_restriction}' " \
-                    f"{pagination_stmt};"
-            result = await session.execute(query)
-            result = result.fetchall()
-            query_composer.add_filter(hla_restriction, result)
-
-        query_composer.intersect_results(lambda x: x.assay_id)
-        if query_composer.result() != FilterIntersection.NO_FILTERS:
-            return [dict(x) for x in query_composer.result()]
-        else:
-            query = f"{select_from_where_query} {pagination_stmt};"
-            all_assays = await session.execute(query)
-            all_assays = [dict(x) for x in all_assays.fetchall()]
-            return all_assays
+        return [dict(x) for x in await query.fetchall(session, pagination)]
 
     # other option for generating an hash-like ID but is ugly
     # select_query = "select concat_ws('#', cell_type, mhc_class, mhc_allele) as \"assay_id\", " \
@@ -3619,17 +2457,397 @@ async def get_assays(epitope_id: Optional[int] = None
 
 async def get_assay(assay_id: int):
     async with get_session() as session:
-        result = await session.execute(
-            f"select {assay_id} as \"assay_id\", "
-            f"cell_type as \"assay_type\", mhc_class, mhc_allele as \"hla_restriction\" "
-            f"from epitope "
-            f"where epitope_id = {assay_id} and virus_id = 1 "
-            f"limit 1;"
-        )
+        result = await session.execute(statements.ASSAY_BY_ID, {"assay_id": int(assay_id)})
         return [dict(x) for x in result.fetchall()]
 
 
+async def warm_up_kb_cache():
+    """
+    Fills the KB cache with the full listings of the KB entities, i.e. the results of the KB endpoints without
+    parameters.
+    """
+    for list_function in (get_variants, get_namings, get_contexts, get_effects, get_evidences,
+                          get_nuc_positional_mutations, get_aa_change_groups, get_nuc_annotations, get_protein_regions):
+        try:
+            await list_function()
+        except Exception:
+            logger.exception(f"KB cache warm up failed for {list_function.__name__}")
+
+
+# max number of ids of a bulk lookup
+MAX_BATCH_IDS = 10000
+
+
+def _upper_key(instance_id) -> str:
+    return str(instance_id).upper()
+
+
+def _int_key(instance_id) -> Optional[int]:
+    try:
+        return int(instance_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _object_id_key(instance_id) -> Optional[str]:
+    return str(bson.ObjectId(instance_id)) if bson.ObjectId.is_valid(instance_id) else None
+
+
+def _nuc_mutation_key(nuc_mutation_id) -> Optional[str]:
+    try:
+        return "".join(str(x) for x in kb_nuc_mut_2_vcm_nuc_mut(str(nuc_mutation_id))).upper()
+    except (HTTPException, ValueError):
+        return None
+
+
+def _aa_change_key(aa_change_id) -> Optional[tuple]:
+    try:
+        return aa_change_id_2_vcm_aa_change(str(aa_change_id))
+    except (HTTPException, ValueError):
+        return None
+
+
+async def _variants_by_key(variant_ids: List[str]) -> dict:
+    result = await find_raw(Variant, VariantsProjection, {"_id": {"$in": variant_ids}})
+    return {x["variant_id"]: x for x in result}
+
+
+async def _effects_by_key(effect_ids: List[str]) -> dict:
+    result = await find_raw(Effect, EffectProjection, {"_id": {"$in": [bson.ObjectId(x) for x in effect_ids]}})
+    return {x["effect_id"]: x for x in result}
+
+
+async def _sequences_by_key(sequence_ids: List[int]) -> dict:
+    return {x["sequence_id"]: x for x in await get_sequences_by_ids(sequence_ids)}
+
+
+async def _nuc_mutations_by_key(nuc_mutation_ids: List[str]) -> dict:
+    return {x["nuc_mutation_id"]: x for x in await get_nuc_mutations_by_nuc_positional_mutation_ids(nuc_mutation_ids)}
+
+
+async def _aa_changes_by_key(vcm_aa_changes: List[tuple]) -> dict:
+    prots, refs, positions, alts = (list(x) for x in zip(*vcm_aa_changes))
+    async with get_session() as session:
+        result = await session.execute(
+            statements.AA_CHANGES_BY_ANY_PROT_REF_POS_ALT,
+            {"prots": prots, "refs": refs, "positions": positions, "alts": alts})
+        # keyed in VCM syntax, i.e. as the requested ids after aa_change_id_2_vcm_aa_change
+        return {(x.protein, x.reference, x.position, x.alternative): vcm_aa_change_2_aa_change_id(x)
+                for x in result.fetchall()}
+
+
+async def _epitopes_by_key(epitope_ids: List[int]) -> dict:
+    query = _epitopes_query()
+    query.where("epi_fragment_id = any(:epitope_ids)", epitope_ids=epitope_ids)
+    async with get_session() as session:
+        result = await query.fetchall(session)
+        return {x["epitope_id"]: x for x in map(query.map_row, result)}
+
+
+# entities that can be looked up in bulk with batch_lookup: the function normalizing a requested id into the key of
+# an instance (None if the id is badly formatted) and the function reading the instances of a list of keys with a
+# single query, keyed by their key
+_batch_lookup_of_entity = {
+    'variants': (_upper_key, _variants_by_key),
+    'effects': (_object_id_key, _effects_by_key),
+    'sequences': (_int_key, _sequences_by_key),
+    'nuc_mutations': (_nuc_mutation_key, _nuc_mutations_by_key),
+    'aa_changes': (_aa_change_key, _aa_changes_by_key),
+    'epitopes': (_int_key, _epitopes_by_key),
+}
+
+
+async def batch_lookup(entity_name: str, ids: list) -> List[dict]:
+    """
+    Same as the single-instance endpoint of entity_name (e.g. get_sequence) repeated for every id, but resolved with
+    a single query. Returns, in the order of ids, {"id": <requested id>, "found": bool, "result": <instance or None>}.
+    Badly formatted ids are reported as not found.
+    """
+    lookup = _batch_lookup_of_entity.get(entity_name)
+    if lookup is None:
+        raise MyExceptions.batch_unsupported_entity
+    if len(ids) > MAX_BATCH_IDS:
+        raise MyExceptions.batch_too_many_ids(MAX_BATCH_IDS)
+    key_of_id, instances_by_key = lookup
+    keys = [key_of_id(x) for x in ids]
+    distinct_keys = list(dict.fromkeys(x for x in keys if x is not None))
+    instance_of_key = await instances_by_key(distinct_keys) if distinct_keys else dict()
+    results = []
+    for instance_id, key in zip(ids, keys):
+        instance = instance_of_key.get(key)
+        results.append({"id": instance_id, "found": instance is not None, "result": instance})
+    return results
+
+
+# entities that can be exported as a whole with export_query + stream_export, and the builder of their query
+_query_of_exportable_entity = {
+    'sequences': _sequences_query,
+    'host_samples': _host_samples_query,
+    'nuc_mutations': _nuc_mutations_query,
+    'aa_changes': _aa_changes_query,
+    'epitopes': _epitopes_query,
+    'assays': _assays_query,
+    'evidences': _evidences_query,
+    'aa_change_groups': _aa_change_groups_query,
+    'protein_regions': _protein_regions_query,
+    'aa_residues': _aa_residues_query,
+    'aa_residues_ref': _aa_residues_query,
+    'aa_residues_alt': _aa_residues_query,
+}
+
+
+def export_query(entity_name: str, query_params: dict):
+    """
+    Returns the query (SQLQuery or MongoQuery) listing all the instances of entity_name that match the given query
+    parameters, whose values are the raw strings of the query string and whose names are the ones of the API.
+    Errors in the parameters are raised here, i.e. before the response starts streaming.
+    """
+    query_builder = _query_of_exportable_entity.get(entity_name)
+    if query_builder is None:
+        raise MyExceptions.export_unsupported_entity
+    kwargs = _query_builder_kwargs(query_builder, query_params)
+    if entity_name.startswith('aa_residues'):
+        kwargs['request_path'] = entity_name
+    return query_builder(**kwargs)
+
+
+def _query_builder_kwargs(query_builder: Callable, query_params: dict) -> dict:
+    """
+    Returns the arguments of query_builder corresponding to the given query parameters, parsed to the type of the
+    argument (e.g. 'type' becomes '_type').
+    """
+    builder_parameters = inspect.signature(query_builder).parameters
+    kwargs = dict()
+    for name, value in query_params.items():
+        if name == 'type':
+            name = '_type'
+        if name not in builder_parameters or name == 'request_path':
+            raise MyExceptions.compose_request_unrecognised_query_parameter
+        kwargs[name] = parse_query_parameter(value, builder_parameters[name].annotation)
+    return kwargs
+
+
+async def stream_export(query) -> AsyncIterator[dict]:
+    """
+    Yields the instances listed by a query returned from export_query, without holding the whole result in memory.
+    """
+    if isinstance(query, SQLQuery):
+        async with get_session() as session:
+            async for row in query.stream(session):
+                yield row
+    else:
+        async for document in query.stream():
+            yield document
+
+
+# entities that can be counted by get_stats: the builder of the query filtering them, the table joins that the
+# conditions of that query refer to, and the expression identifying an instance
+_counted_entities = {
+    'sequences': (_sequences_query, "sequence natural join sequencing_project", "sequence_id"),
+    'host_samples': (_host_samples_query, "host_sample natural join host_specie natural join sequence",
+                     "host_sample_id"),
+}
+
+# dimensions the counts can be grouped by: the tables to join (natural join on sequence_id or host_sample_id), the
+# grouped expressions (named as the output columns) and the entities they apply to
+_stats_dimensions = {
+    'nuc_mutation': ("nucleotide_variant",
+                     ("upper(concat(sequence_original, start_original, sequence_alternative)) as \"nuc_mutation_id\"",),
+                     {'sequences'}),
+    'aa_change': ("annotation natural join aminoacid_variant",
+                  ("product as \"protein\"", "sequence_aa_original as \"reference\"",
+                   "start_aa_original as \"position\"", "sequence_aa_alternative as \"alternative\"",
+                   "variant_aa_type as \"type\"", "variant_aa_length as \"length\""),
+                  {'sequences'}),
+    'continent': ("host_sample", ("geo_group as \"continent\"",), {'sequences', 'host_samples'}),
+    'country': ("host_sample", ("country",), {'sequences', 'host_samples'}),
+    # dates with only the year (or no date) are grouped under null
+    'collection_month': ("host_sample",
+                         ("substring(collection_date from '^\\d{4}-\\d{2}') as \"collection_month\"",),
+                         {'sequences', 'host_samples'}),
+}
+
+
+def _stats_query(entity_name: str, group_by: str, query_params: dict) -> SQLQuery:
+    """
+    Returns the query counting the instances of entity_name that match the given query parameters (the ones of the
+    entity endpoint) grouped by the dimension group_by, i.e. a single aggregation in the database returning one row
+    per group.
+    """
+    counted_entity = _counted_entities.get(entity_name)
+    if counted_entity is None:
+        raise MyExceptions.stats_unsupported_entity
+    query_builder, tables, counted_expression = counted_entity
+    dimension = _stats_dimensions.get(group_by)
+    if dimension is None or entity_name not in dimension[2]:
+        raise MyExceptions.stats_unsupported_group_by
+    dimension_tables, dimension_expressions, _ = dimension
+    if dimension_tables not in tables:
+        tables += f" natural join {dimension_tables}"
+    # the filters are the same conditions of the query of the entity endpoint
+    filters = query_builder(**_query_builder_kwargs(query_builder, query_params))
+    return SQLQuery(f"select {', '.join(dimension_expressions)}, count(distinct {counted_expression}) as \"count\" "
+                    f"from {tables}",
+                    *filters.conditions,
+                    group_by=", ".join(str(i + 1) for i in range(len(dimension_expressions))),
+                    order_by="\"count\" desc",
+                    **filters.params)
+
+
+def _stats_summary_query(group_by: str) -> Optional[SQLQuery]:
+    """
+    Returns the query reading the number of sequences of every nuc mutation or aa change from the summary tables (see
+    dal/data_sqlalchemy/summary_tables.py), where it is precomputed, or None if they are not available.
+    """
+    if not summary_tables_available():
+        return None
+    if group_by == 'nuc_mutation':
+        # one row per nuc_mutation_id in practice (type and length follow from reference and alternative)
+        return SQLQuery(f"select nuc_mutation_id, sum(n_sequences) as \"count\" from {NUC_MUTATION_SUMMARY}",
+                        group_by="nuc_mutation_id", order_by="\"count\" desc")
+    if group_by == 'aa_change':
+        # see get_stats about the aa changes of ORF1a and ORF1ab
+        return SQLQuery(f"select aa_change_id, max(n_sequences) as \"count\" from {AA_CHANGE_SUMMARY}",
+                        group_by="aa_change_id", order_by="\"count\" desc")
+    return None
+
+
+async def get_stats(entity_name: str, group_by: str, query_params: dict) -> List[dict]:
+    """
+    Returns the number of instances of entity_name (matching the given query parameters of the entity endpoint) for
+    each value of the dimension group_by, from the largest group, as a list of {<dimension>: value, "count": n}.
+    E.g. get_stats('sequences', 'country', {'aa_change_id': 'S:L452R'}) counts the sequences carrying S:L452R in each
+    country.
+    """
+    query = _stats_query(entity_name, group_by, query_params)
+    summary_query = None if query_params else _stats_summary_query(group_by)
+    async with get_session() as session:
+        result = await (summary_query or query).fetchall(session)
+    if group_by != 'aa_change' or summary_query is not None:
+        return [dict(x) for x in result]
+    # aa changes grouped in VCM syntax are converted to aa_change_ids; the ones of ORF1a and ORF1ab that map to the
+    # same NSP change describe the same sequences through overlapping annotations, so they are counted once
+    count_of_aa_change = dict()
+    for row, aa_change in zip(result, vcm_aa_changes_2_aa_change_ids(result)):
+        aa_change_id = aa_change["aa_change_id"]
+        count_of_aa_change[aa_change_id] = max(count_of_aa_change.get(aa_change_id, 0), row._mapping["count"])
+    return [{"aa_change_id": aa_change_id, "count": count}
+            for aa_change_id, count in sorted(count_of_aa_change.items(), key=lambda x: x[1], reverse=True)]
+
+
+# hops of /combine between VCM entities: (entity, previous entity) -> the builder of the query listing the instances of
+# entity, and the condition selecting the ones related to the rows of the query of the previous entity, which is nested
+# as {subquery} with the alias {rows}. The conditions match the same instances as the query parameters of the entity
+# endpoints (e.g. _sequences_query(host_sample_id=...)), but on the VCM columns of the previous entity.
+_vcm_hops = {
+    ('sequences', 'host_samples'): (
+        _sequences_query,
+        "host_sample_id in (select {rows}.host_sample_id from ({subquery}) {rows})"),
+    ('host_samples', 'sequences'): (
+        _host_samples_query,
+        "sequence_id in (select {rows}.sequence_id from ({subquery}) {rows})"),
+    ('sequences', 'nuc_mutations'): (
+        _sequences_query,
+        "exists (select 1 from nucleotide_variant nv "
+        "        where nv.sequence_id = sequence.sequence_id "
+        "        and (nv.sequence_original, nv.start_original, nv.sequence_alternative) in ("
+        "            select lower({rows}.reference), {rows}.position, lower({rows}.alternative) "
+        "            from ({subquery}) {rows}))"),
+    ('nuc_mutations', 'sequences'): (
+        _nuc_mutations_variants_query,
+        "sequence_id in (select {rows}.sequence_id from ({subquery}) {rows})"),
+    ('sequences', 'aa_changes'): (
+        _sequences_query,
+        "exists (select 1 from annotation a natural join aminoacid_variant av "
+        "        where a.sequence_id = sequence.sequence_id "
+        "        and (a.product, av.sequence_aa_original, av.start_aa_original, av.sequence_aa_alternative) in ("
+        "            select {rows}.protein, {rows}.reference, {rows}.position, {rows}.alternative "
+        "            from ({subquery}) {rows}))"),
+    ('aa_changes', 'sequences'): (
+        _aa_changes_variants_query,
+        "sequence_id in (select {rows}.sequence_id from ({subquery}) {rows})"),
+    ('epitopes', 'assays'): (
+        _epitopes_query,
+        "(cell_type, mhc_allele, mhc_class) in ("
+        "    select {rows}.assay_type, {rows}.hla_restriction, {rows}.mhc_class from ({subquery}) {rows})"),
+    ('assays', 'epitopes'): (
+        _assays_query,
+        "( cell_type, coalesce(mhc_class, 'NULL'), coalesce(mhc_allele, 'NULL') ) in ("
+        "    select cell_type, coalesce(mhc_class, 'NULL'), coalesce(mhc_allele, 'NULL') "
+        "    from epitope natural join epitope_fragment "
+        "    where virus_id = 1 and epi_fragment_id in (select {rows}.epitope_id from ({subquery}) {rows}))"),
+}
+
+
+# final entities of a compiled /combine chain whose query can return the same instance more than once, and the columns
+# identifying an instance: host samples are repeated for each of their sequences, and the aa changes of ORF1a and
+# ORF1ab map to the same NSP change (ORF1a is converted with the table of ORF1ab, see convertORF1ab). The second
+# element is the order of the query of the entity endpoint, on the output columns, so that the pages are the same that
+# the combine endpoint returns when it resolves the chain one entity at a time.
+_vcm_chain_distinct_on = {
+    'host_samples': ("host_sample_id", "host_sample_id"),
+    'aa_changes': ("(case when protein = 'ORF1a polyprotein' then 'ORF1ab polyprotein' else protein end), "
+                   "reference, position, alternative, type, length",
+                   "protein, reference, position, alternative"),
+}
+
+
+def vcm_chain_query(entity_names: List[str], query_params: List[Tuple[str, str]]) -> Optional[SQLQuery]:
+    """
+    Compiles a /combine request into a single query, if all the entities of the chain are in the VCM database.
+    entity_names are the entities of the request path (e.g. ['host_samples', 'sequences', 'nuc_mutations']): the last
+    one is filtered by query_params, as its endpoint would do, and every other one is filtered by a condition on the
+    query of the entity after it (see _vcm_hops), so that the database joins the whole chain and no intermediate
+    result is read. Returns None if the chain can't be compiled, i.e. if it has a single entity, if it leaves the VCM
+    database or if query_params has more than one parameter: the combine endpoint then resolves it one entity at a
+    time.
+    """
+    if len(entity_names) < 2 or len(query_params) > 1:
+        return None
+    hops = []
+    for entity_name, previous_entity_name in zip(entity_names, entity_names[1:]):
+        hop = _vcm_hops.get((entity_name, previous_entity_name))
+        if hop is None:
+            return None
+        hops.append(hop)
+    query_builder = _query_of_exportable_entity[entity_names[-1]]
+    query = query_builder(**_query_builder_kwargs(query_builder, dict(query_params)))
+    for i, (query_builder, condition) in enumerate(reversed(hops)):
+        subquery, params = query.subquery(prefix=f"_s{i}_")
+        query = query_builder().where(condition.format(subquery=subquery, rows=f"_s{i}"), **params)
+    # the result is made distinct by the database, so that the pagination applies to distinct instances
+    # and ordered as the entity endpoint; among the rows of an instance, the one of ORF1a is kept
+    if entity_names[0] in _vcm_chain_distinct_on:
+        distinct_on, order_by = _vcm_chain_distinct_on[entity_names[0]]
+        subquery, params = query.subquery(prefix="_r_")
+        query = SQLQuery(f"select * from (select distinct on ({distinct_on}) * from ({subquery}) _r "
+                         f"order by {distinct_on}, 1) _d",
+                         order_by=order_by, map_row=query.map_row, **params)
+    return query
+
+
+async def get_vcm_chain(query: SQLQuery, pagination: 'OptionalPagination') -> List[dict]:
+    """
+    Returns the page of the result of a query compiled by vcm_chain_query.
+    """
+    async with get_session() as session:
+        result = await query.fetchall(session, pagination)
+    return [query.map_row(x) for x in result]
+
+
+def parse_query_parameter(value: str, annotation):
+    for numeric_type in (int, float):
+        if annotation in (numeric_type, Optional[numeric_type]):
+            try:
+                return numeric_type(value)
+            except ValueError:
+                raise MyExceptions.invalid_query_parameter_value
+    return value
+
+
 class OptionalPagination:
+    is_keyset = False
+
     def __init__(self, limit, page):
         if limit is not None and page is not None:
             page -= 1
@@ -3650,6 +2868,55 @@ class OptionalPagination:
         return self.is_set
 
 
+class KeysetPagination:
+    """
+    Cursor-based alternative to OptionalPagination. Instead of skipping page * limit rows, each page starts right after
+    the sort key of the last row of the previous page (encoded in the opaque cursor), so that the cost of a page
+    does not depend on its depth.
+    """
+    is_keyset = True
+    FIRST_PAGE = "first"
+
+    def __init__(self, limit, cursor: str):
+        self.limit = limit
+        self.is_set = True
+        if cursor == KeysetPagination.FIRST_PAGE:
+            self.last_key = None
+        else:
+            try:
+                self.last_key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            except (ValueError, TypeError):
+                raise MyExceptions.invalid_pagination_cursor
+            if not isinstance(self.last_key, list) or not self.last_key:
+                raise MyExceptions.invalid_pagination_cursor
+
+    def __bool__(self):
+        return self.is_set
+
+    @staticmethod
+    def encode_cursor(key: list) -> str:
+        return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+    def page(self, results: list, last_row_key: Optional[list]) -> dict:
+        """
+        Wraps a page of results together with the cursor of the next page (None if this is the last page).
+        """
+        if last_row_key is not None and len(results) >= self.limit:
+            next_cursor = KeysetPagination.encode_cursor(last_row_key)
+        else:
+            next_cursor = None
+        return {"results": results, "next_cursor": next_cursor}
+
+
+def pagination_of(limit, page, cursor: Optional[str] = None):
+    if cursor is None:
+        return OptionalPagination(limit, page)
+    elif limit is None:
+        raise MyExceptions.incomplete_optional_pagination_params
+    else:
+        return KeysetPagination(limit, cursor)
+
+
 class FilterIntersection:
     NO_FILTERS = "!NO_FILTERS"
 
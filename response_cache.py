@@ -0,0 +1,116 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import *
+
+from starlette.responses import Response
+
+# values of these query parameters are normalised (upper_if_exists, lower_if_exists, .upper() or an ilike condition)
+# by every function of queries.py accepting them, so they are uppercased in the cache key. The ObjectId parameters
+# and the ids that some query compares as given (aa_positional_change_id, aa_residue_change_id, aa_change_id) are
+# left as they are.
+CASE_INSENSITIVE_QUERY_PARAMS = frozenset({
+    'variant_id', 'naming_id', 'context_id', 'nuc_positional_mutation_id', 'protein_id', 'aa_residue_id',
+    'nuc_mutation_id', 'reference', 'alternative', 'type', 'name', 'category', 'v_class', 'lv', 'method', 'citation',
+    'publisher', 'organization', 'owner', 'rule_description', 'aa_sequence', 'charge', 'polarity', 'r_group_structure',
+    'essentiality', 'side_chain_flexibility', 'chemical_group_in_the_side_chain', 'host_species', 'accession_id',
+    'source_database', 'continent', 'country', 'region', 'assay_type', 'mhc_class', 'hla_restriction'
+})
+
+
+class CachedResponse:
+    def __init__(self, body: bytes, media_type: str, data_version, created_at: float):
+        self.body = body
+        self.media_type = media_type
+        self.data_version = data_version
+        self.created_at = created_at
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+    def response_to(self, if_none_match: Optional[str]) -> Response:
+        if if_none_match is not None and etag_matches(self.etag, if_none_match):
+            return Response(status_code=304, headers={"ETag": self.etag})
+        return Response(content=self.body, media_type=self.media_type, headers={"ETag": self.etag})
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    candidates = [x.strip() for x in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+class ResponseCache:
+    """
+    LRU cache of the serialized bodies of successful GET responses, bounded in number of entries, total size and age
+    of the entries. Entries are tagged with the version of the data they were computed from (i.e. the versions of the
+    KB and of the VCM database): when set_data_version() receives a new version the whole cache is dropped, and
+    responses computed from an older version are not stored.
+    """
+
+    def __init__(self, max_entries: int = 4096, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.data_version = None
+        self._entries: OrderedDict = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_of(path: str, query_params: Iterable[Tuple[str, str]]) -> tuple:
+        """
+        Returns the cache key of a request: its path without trailing slashes and its query parameters sorted by name,
+        with the values of the case-insensitive ones in uppercase.
+        """
+        normalized_params = tuple(sorted(
+            (name, value.upper() if name in CASE_INSENSITIVE_QUERY_PARAMS else value)
+            for name, value in query_params))
+        return path.rstrip('/'), normalized_params
+
+    def get(self, key) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry.created_at > self.ttl_seconds:
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, body: bytes, media_type: str, data_version) -> Optional[CachedResponse]:
+        """
+        Stores the body of a response computed from data_version and returns the new entry, or None if the response
+        can't be cached (the data changed in the meantime or the body exceeds the size of the cache).
+        """
+        if data_version != self.data_version or len(body) > self.max_bytes:
+            return None
+        if key in self._entries:
+            self._remove(key)
+        entry = CachedResponse(body, media_type, data_version, time.monotonic())
+        self._entries[key] = entry
+        self._size += len(body)
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._size -= len(entry.body)
+
+    def set_data_version(self, data_version):
+        if data_version != self.data_version:
+            self.clear()
+            self.data_version = data_version
+
+    def clear(self):
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def stats(self) -> dict:
+        return {
+            "data_version": self.data_version,
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -13,5 +13,7 @@ cd /home/alfonsi/cov2k-services/cov2k_api_v1.2
 ROOT_PATH=/cov2k/api
 echo $ROOT_PATH > root_path.txt
 mkdir -p logs
-uvicorn main_beanie:app --host=localhost --root-path ${ROOT_PATH} 2>&1 | tee "logs/log_$(timestamp).txt"
+# run one uvicorn worker per core under gunicorn (settings in gunicorn_conf.py, e.g. COV2K_WORKERS=4)
+# graceful rolling restart: kill -HUP $(cat gunicorn.pid)
+gunicorn main_beanie:app -c gunicorn_conf.py 2>&1 | tee "logs/log_$(timestamp).txt"
 
@@ -0,0 +1,174 @@
+"""
+Properties of the ORF1 coordinate converters of dal/data_sqlalchemy/convert_prot_names.py, checked against the
+if/elif implementation that the tables replaced (frozen below as previous_convertORF1ab):
+- convertORF1ab agrees with it on every position around the polyproteins, for ORF1ab, ORF1a, ORF1b and other
+  proteins;
+- convertORF1ab_columns agrees with convertORF1ab row by row, on random columns mixing the proteins;
+- convertNSP2ORF1ab and convertNSP2ORF1ab_columns invert the ORF1ab conversion, and leave unchanged what they can't
+  convert.
+"""
+import warnings
+
+import numpy as np
+import pytest
+
+from dal.data_sqlalchemy.convert_prot_names import convertORF1ab, convertORF1ab_columns, convertNSP2ORF1ab, \
+    convertNSP2ORF1ab_columns
+
+ORF1_PROTEINS = ["ORF1AB", "ORF1A", "ORF1B"]
+NSPS = ["NSP1", "NSP2", "NSP3", "NSP4", "NSP5", "NSP6", "NSP7", "NSP8", "NSP9", "NSP10", "NSP12", "NSP13", "NSP14",
+        "NSP15", "NSP16"]
+# around the ends of the longest polyprotein (ORF1ab ends at 7096)
+POSITIONS = range(-5, 7200)
+
+
+# convertORF1ab before it was made table-driven
+def previous_convertORF1ab(protein, pos):
+    # map ORF1A/B to sub-proteins
+    if protein == 'ORF1AB' or protein == 'ORF1A':
+        if 1 <= pos <= 180:
+            protein = "NSP1"
+        elif 181 <= pos <= 818:
+            pos = pos - 181 + 1
+            protein = "NSP2"
+        elif 819 <= pos <= 2763:
+            pos = pos - 819 + 1
+            protein = "NSP3"
+        elif 2764 <= pos <= 3263:
+            pos = pos - 2764 + 1
+            protein = "NSP4"
+        elif 3264 <= pos <= 3569:
+            pos = pos - 3264 + 1
+            protein = "NSP5"
+        elif 3570 <= pos <= 3859:
+            pos = pos - 3570 + 1
+            protein = "NSP6"
+        elif 3860 <= pos <= 3942:
+            pos = pos - 3860 + 1
+            protein = "NSP7"
+        elif 3943 <= pos <= 4140:
+            pos = pos - 3943 + 1
+            protein = "NSP8"
+        elif 4141 <= pos <= 4253:
+            pos = pos - 4141 + 1
+            protein = "NSP9"
+        elif 4254 <= pos <= 4392:
+            pos = pos - 4254 + 1
+            protein = "NSP10"
+        elif 4393 <= pos <= 5324:
+            pos = pos - 4393 + 1
+            protein = "NSP12"
+        elif 5325 <= pos <= 5925:
+            pos = pos - 5325 + 1
+            protein = "NSP13"
+        elif 5926 <= pos <= 6452:
+            pos = pos - 5926 + 1
+            protein = "NSP14"
+        elif 6453 <= pos <= 6798:
+            pos = pos - 6453 + 1
+            protein = "NSP15"
+        elif 6799 <= pos <= 7096:
+            pos = pos - 6799 + 1
+            protein = "NSP16"
+        else:
+            warnings.warn(f"AA change with protein {protein} and pos {pos} doesn't resolve to any NSP")
+        return protein, pos
+    elif protein == 'ORF1B':
+        if 1 <= pos <= 923:  # 1 -> 923
+            pos = pos + 9
+            protein = "NSP12"
+        elif 924 <= pos <= 1524:  # 924 -> 1524
+            pos = pos - 924 + 1
+            protein = "NSP13"
+        elif 1525 <= pos <= 2051:  # 1525 -> 2051
+            pos = pos - 1525 + 1
+            protein = "NSP14"
+        elif 2052 <= pos <= 2397:  # 2052 ->2397
+            pos = pos - 2052 + 1
+            protein = "NSP15"
+        elif 2398 <= pos <= 2695:  # 2398 -> 2695
+            pos = pos - 2398 + 1
+            protein = "NSP16"
+        else:
+            warnings.warn(f"AA change with protein {protein} and pos {pos} doesn't resolve to any NSP")
+        return protein, pos
+    else:
+        raise KeyError(f"Cannot convert coordinates of protein {protein} and pos {pos}")
+
+
+def previous_or_error(protein, pos):
+    try:
+        return previous_convertORF1ab(protein, pos)
+    except KeyError:
+        return KeyError
+
+
+def current_or_error(protein, pos):
+    try:
+        return convertORF1ab(protein, pos)
+    except KeyError:
+        return KeyError
+
+
+@pytest.fixture(autouse=True)
+def ignore_unresolved_position_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        yield
+
+
+@pytest.mark.parametrize("protein", ORF1_PROTEINS + ["S", "NSP12", "ORF1", ""])
+def test_convert_orf1ab_matches_previous_implementation(protein):
+    for pos in POSITIONS:
+        assert current_or_error(protein, pos) == previous_or_error(protein, pos), (protein, pos)
+
+
+def test_convert_orf1ab_columns_matches_scalar_conversion():
+    rng = np.random.default_rng(0)
+    n_rows = 200000
+    proteins = rng.choice(ORF1_PROTEINS + ["S", "N", "NSP3"], size=n_rows).tolist()
+    positions = rng.integers(POSITIONS.start, POSITIONS.stop, size=n_rows).tolist()
+    converted_proteins, converted_positions = convertORF1ab_columns(proteins, positions)
+    for protein, pos, converted_protein, converted_pos in zip(proteins, positions, converted_proteins,
+                                                             converted_positions.tolist()):
+        expected = previous_or_error(protein, pos)
+        if expected is KeyError:    # other proteins are left unchanged by the columns
+            expected = (protein, pos)
+        assert (converted_protein, converted_pos) == expected, (protein, pos)
+
+
+def test_convert_orf1ab_columns_of_no_rows():
+    converted_proteins, converted_positions = convertORF1ab_columns([], [])
+    assert converted_proteins == [] and len(converted_positions) == 0
+
+
+def test_nsp_to_orf1ab_round_trip():
+    for pos in range(1, 7097):
+        nsp, nsp_pos = convertORF1ab("ORF1AB", pos)
+        assert convertNSP2ORF1ab(nsp, nsp_pos) == ("ORF1AB", pos)
+    for nsp in NSPS:
+        for nsp_pos in range(1, 2000):
+            converted = convertNSP2ORF1ab(nsp, nsp_pos)
+            if converted != (nsp, nsp_pos):     # positions within the NSP
+                assert convertORF1ab(*converted) == (nsp, nsp_pos)
+
+
+def test_nsp_to_orf1ab_rejects_other_proteins():
+    for protein in ["ORF1AB", "NSP11", "S"]:
+        with pytest.raises(KeyError):
+            convertNSP2ORF1ab(protein, 1)
+
+
+def test_nsp_to_orf1ab_columns_matches_scalar_conversion():
+    rng = np.random.default_rng(1)
+    n_rows = 200000
+    proteins = rng.choice(NSPS + ["S", "ORF1AB"], size=n_rows).tolist()
+    positions = rng.integers(-5, 2000, size=n_rows).tolist()
+    converted_proteins, converted_positions = convertNSP2ORF1ab_columns(proteins, positions)
+    for protein, pos, converted_protein, converted_pos in zip(proteins, positions, converted_proteins,
+                                                             converted_positions.tolist()):
+        try:
+            expected = convertNSP2ORF1ab(protein, pos)
+        except KeyError:
+            expected = (protein, pos)
+        assert (converted_protein, converted_pos) == expected, (protein, pos)
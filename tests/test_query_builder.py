@@ -0,0 +1,57 @@
+"""
+Keyset pagination of SQLQuery (dal/data_sqlalchemy/query_builder.py) on a keyset with nullable columns:
+- the seek condition and the ordering compare the nullable columns through coalesce, so that a NULL never makes the
+  row comparison NULL;
+- key_of puts the value standing for NULL in the cursor, and sql() rejects a cursor whose key contains a null.
+"""
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from api_exceptions import MyExceptions
+from dal.data_sqlalchemy.query_builder import SQLQuery, nullable_key
+
+
+# the attributes of queries.KeysetPagination read by SQLQuery.sql()
+class Cursor:
+    is_keyset = True
+
+    def __init__(self, last_key, limit=10):
+        self.last_key = last_key
+        self.limit = limit
+
+
+class Row:
+    def __init__(self, **columns):
+        self._mapping = columns
+
+
+def nuc_mutations_query() -> SQLQuery:
+    return SQLQuery("select reference, position, alternative from nuc_mutation_summary",
+                    order_by="reference, position, alternative",
+                    keyset=[("reference", "reference", str), (nullable_key("position", int), "position", int),
+                            ("alternative", "alternative", str)])
+
+
+def test_seek_condition_coalesces_the_nullable_columns():
+    stmt, params = nuc_mutations_query().sql(Cursor(["A", -1, "G"]))
+    assert "where ((reference, coalesce(position, -1), alternative) > (:_key_0, :_key_1, :_key_2))" in stmt
+    assert stmt.endswith("order by reference, coalesce(position, -1), alternative limit :_limit")
+    assert params == {"_key_0": "A", "_key_1": -1, "_key_2": "G", "_limit": 10}
+
+
+def test_key_of_replaces_null_columns():
+    query = nuc_mutations_query()
+    assert query.key_of(Row(reference="A", position=None, alternative="G")) == ["A", -1, "G"]
+    assert query.key_of(Row(reference="A", position=241, alternative="G")) == ["A", 241, "G"]
+
+
+def test_nullable_key_of_strings():
+    assert nullable_key("product", str) == "coalesce(product, '')"
+
+
+@pytest.mark.parametrize("last_key", [["A", None, "G"], [None, 241, "G"], ["A", 241, None]])
+def test_cursor_with_null_is_rejected(last_key):
+    with pytest.raises(type(MyExceptions.invalid_pagination_cursor)) as error:
+        nuc_mutations_query().sql(Cursor(last_key))
+    assert error.value is MyExceptions.invalid_pagination_cursor